@@ -0,0 +1,93 @@
+"""Сравнение поштучного и пакетного чтения DOM на сохранённых страницах split.tg.
+
+Запуск:  python bench/bench_dom_extract.py [--runs 20]
+Нужен установленный браузер Playwright (python -m playwright install chromium). Сеть не нужна:
+страницы грузятся через set_content, все внешние запросы обрываются.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from playwright.async_api import async_playwright
+
+from split_client import describe_inputs, extract_result, _is_invoice_href
+
+PAGES = ["split_step_2_result.html", "split_debug_no_amount.html", "split_debug_no_username.html"]
+
+
+async def old_links(page) -> tuple[str | None, int]:
+    """Как было: locator("a").all() и get_attribute("href") на каждую ссылку."""
+    calls = 1
+    links = await page.locator("a").all()
+    for link in links:
+        calls += 1
+        href = await link.get_attribute("href")
+        if _is_invoice_href(href):
+            return href, calls
+    return None, calls
+
+
+async def old_inputs(page) -> tuple[list[str], int]:
+    """Как было: count() и четыре get_attribute на каждый видимый input."""
+    inputs = page.locator("input:visible")
+    cnt = await inputs.count()
+    calls = 1
+    lines = []
+    for i in range(cnt):
+        el = inputs.nth(i)
+        attrs = []
+        for name in ("placeholder", "name", "type", "aria-label"):
+            calls += 1
+            attrs.append(await el.get_attribute(name))
+        lines.append(f"#{i}: {attrs}")
+    return lines, calls
+
+
+async def new_links(page) -> tuple[str | None, int]:
+    return (await extract_result(page))["invoice_url"], 1
+
+
+async def new_inputs(page) -> tuple[list, int]:
+    return await describe_inputs(page), 1
+
+
+async def measure(page, fn, runs: int) -> tuple[float, int]:
+    times = []
+    calls = 0
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        _, calls = await fn(page)
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times), calls
+
+
+async def main(runs: int) -> None:
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        context = await browser.new_context()
+        await context.route("**/*", lambda route: route.abort())
+        page = await context.new_page()
+        print(f"{'page':32} {'probe':8} {'old ms':>8} {'old rt':>7} {'new ms':>8} {'new rt':>7}")
+        for name in PAGES:
+            path = os.path.join(ROOT, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                await page.set_content(f.read(), wait_until="domcontentloaded")
+            for probe, old, new in (("links", old_links, new_links), ("inputs", old_inputs, new_inputs)):
+                old_ms, old_rt = await measure(page, old, runs)
+                new_ms, new_rt = await measure(page, new, runs)
+                print(f"{name:32} {probe:8} {old_ms:8.2f} {old_rt:7d} {new_ms:8.2f} {new_rt:7d}")
+        await browser.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=20)
+    asyncio.run(main(ap.parse_args().runs))
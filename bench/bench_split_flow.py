@@ -0,0 +1,139 @@
+"""Бенчмарк SplitClient.buy_stars на локальной копии split.tg (bench/split_replica.py).
+
+Меряет сквозное время покупки и время каждого шага (spans из buy_stars(..., with_timings=True)) для
+набора вариантов вёрстки, в режимах "cold" (браузер на каждый заказ) и "pool" (start() + прогретые страницы).
+
+    python bench/bench_split_flow.py --runs 5
+    python bench/bench_split_flow.py --runs 5 --save bench/split_baseline.json
+    python bench/bench_split_flow.py --runs 5 --baseline bench/split_baseline.json --tolerance 0.25
+
+С --baseline скрипт завершится с кодом 1, если p50 какого-то прогона выросло больше чем на tolerance.
+Нужен установленный браузер Playwright; сеть не нужна.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from split_client import RoutePolicy, SplitClient
+from split_replica import start_replica
+
+VARIANTS = [
+    ("default",),
+    ("ru",),
+    ("product_link",),
+    ("no_buy_to_user",),
+    ("amount_by_name",),
+    ("cookies",),
+    ("invoice",),
+    ("iframe",),
+]
+
+
+def pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def run_variant(variant: tuple, mode: str, runs: int, latency_ms: int) -> dict:
+    replica, runner, base_url = await start_replica(variant, latency_ms=latency_ms)
+    client = SplitClient("", "", base_url=base_url, route_policy=RoutePolicy(), pool_size=1 if mode == "pool" else 0)
+    e2e: list[float] = []
+    steps: dict[str, list[float]] = {}
+    timeouts: dict[str, int] = {}
+    errors = 0
+    try:
+        if mode == "pool":
+            await client.start()
+            # ждём, пока прогреется первая страница, — именно это состояние и меряем
+            for _ in range(600):
+                if client.pool_ready():
+                    break
+                await asyncio.sleep(0.1)
+        for i in range(runs):
+            t0 = time.perf_counter()
+            try:
+                _, spans = await client.buy_stars(f"@bench_user_{i}", 50 + i, with_timings=True)
+            except Exception:
+                errors += 1
+                spans = client.last_trace
+            e2e.append((time.perf_counter() - t0) * 1000)
+            for rec in spans:
+                steps.setdefault(rec["step"], []).append(rec["elapsed_ms"])
+                timeouts[rec["step"]] = timeouts.get(rec["step"], 0) + int(rec.get("timed_out") or 0)
+            if mode == "pool":
+                for _ in range(600):
+                    if client.pool_ready():
+                        break
+                    await asyncio.sleep(0.1)
+    finally:
+        await client.close()
+        await runner.cleanup()
+    return {
+        "variant": "+".join(variant),
+        "mode": mode,
+        "runs": runs,
+        "errors": errors,
+        "orders": len(replica.orders),
+        "p50_ms": pct(e2e, 0.5),
+        "p95_ms": pct(e2e, 0.95),
+        "steps": {k: {"p50_ms": pct(v, 0.5), "p95_ms": pct(v, 0.95), "timeouts": timeouts.get(k, 0)} for k, v in steps.items()},
+    }
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    problems = []
+    for r in results:
+        key = f"{r['variant']}/{r['mode']}"
+        base = baseline.get(key)
+        if not base:
+            continue
+        if r["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+            problems.append(f"{key}: p50 {r['p50_ms']:.0f} ms против {base['p50_ms']:.0f} ms в baseline")
+        if r["errors"] > base.get("errors", 0):
+            problems.append(f"{key}: ошибок {r['errors']} против {base.get('errors', 0)} в baseline")
+    return problems
+
+
+async def main(args) -> int:
+    variants = VARIANTS if not args.variant else [tuple(args.variant.split(","))]
+    modes = ["cold", "pool"] if args.mode == "both" else [args.mode]
+    results = []
+    for variant in variants:
+        for mode in modes:
+            r = await run_variant(variant, mode, args.runs, args.latency_ms)
+            results.append(r)
+            print(f"{r['variant']:16} {mode:5} p50={r['p50_ms']:8.0f} ms p95={r['p95_ms']:8.0f} ms errors={r['errors']}")
+            for step, st in r["steps"].items():
+                print(f"    {step:22} p50={st['p50_ms']:8.0f} ms p95={st['p95_ms']:8.0f} ms timeouts={st['timeouts']}")
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({f"{r['variant']}/{r['mode']}": r for r in results}, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for p in problems:
+            print("REGRESSION:", p)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--variant", default="", help="один вариант, например ru или iframe,cookies")
+    ap.add_argument("--mode", choices=["cold", "pool", "both"], default="both")
+    ap.add_argument("--latency-ms", type=int, default=0, help="искусственная задержка ответа копии")
+    ap.add_argument("--save", default="")
+    ap.add_argument("--baseline", default="")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    sys.exit(asyncio.run(main(ap.parse_args())))
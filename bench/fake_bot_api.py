@@ -0,0 +1,284 @@
+"""Локальный поддельный Telegram Bot API для нагрузочных прогонов бота без сети.
+
+Понимает методы, которые бот вызывает в сценарии покупки: getMe, getUpdates (long polling),
+sendMessage, editMessageText, editMessageReplyMarkup, answerCallbackQuery, getChatMember;
+на остальные отвечает `true`. Сообщения хранятся в памяти, поэтому виртуальные пользователи
+видят ровно то, что показал бот, и нажимают кнопки из его клавиатур.
+
+    api, runner, base = await start_fake_api(latency_ms=5)
+    bot.session.api = TelegramAPIServer.from_base(base)
+    api.send_text(user, "/start")
+    msg, data = await api.wait_button(user["id"], "balance")
+    api.click(user, msg, data)
+
+Ожидание (wait_for) проверяется только при изменениях в своём чате, а кнопки проиндексированы
+по (chat_id, callback_data) — поиск кнопки заявки в общем чате админов не растёт с числом сообщений.
+
+Запуск отдельно (для ручной проверки): python bench/fake_bot_api.py --port 8081
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "LoadTestBot", "username": "load_test_bot"}
+
+
+def make_user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+class FakeBotAPI:
+    def __init__(self, *, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self._update_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._message_ids: dict[int, itertools.count] = {}
+        self._updates: list[dict] = []
+        self._new_updates = asyncio.Event()
+        # chat_id -> {message_id: message}
+        self.messages: dict[int, dict[int, dict]] = {}
+        # (chat_id, callback_data) -> message_id
+        self.buttons: dict[tuple[int, str], int] = {}
+        # chat_id -> [(predicate, future)]
+        self._waiters: dict[int, list] = {}
+        self.calls: dict[str, int] = {}
+        self.not_modified = 0
+        # запросы бота, кроме getUpdates, на которые ещё не ответили
+        self.in_flight = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    # ======== Для виртуальных пользователей ========
+
+    def _chat(self, chat_id: int) -> dict:
+        return {"id": chat_id, "type": "private" if chat_id > 0 else "group", **({"title": "admins"} if chat_id < 0 else {})}
+
+    def _push(self, update: dict) -> None:
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_updates.set()
+
+    def send_text(self, user: dict, text: str, *, chat_id: int | None = None) -> None:
+        chat_id = user["id"] if chat_id is None else chat_id
+        msg = {
+            "message_id": self._next_message_id(chat_id),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self._push({"message": msg})
+
+    def click(self, user: dict, message: dict, data: str) -> None:
+        self._push({"callback_query": {
+            "id": str(next(self._callback_ids)),
+            "from": user,
+            "chat_instance": str(message["chat"]["id"]),
+            "message": message,
+            "data": data,
+        }})
+
+    def find_button(self, chat_id: int, prefix: str):
+        """(сообщение, callback_data) — последняя кнопка в чате, чей callback_data начинается с prefix.
+        Если prefix — точное значение callback_data, поиск идёт по индексу.
+        """
+        message_id = self.buttons.get((chat_id, prefix))
+        if message_id is not None:
+            return self.messages[chat_id][message_id], prefix
+        for msg in reversed(list(self.messages.get(chat_id, {}).values())):
+            for row in (msg.get("reply_markup") or {}).get("inline_keyboard", []):
+                for btn in row:
+                    if str(btn.get("callback_data", "")).startswith(prefix):
+                        return msg, btn["callback_data"]
+        return None
+
+    def find_text(self, chat_id: int, substring: str):
+        for msg in reversed(list(self.messages.get(chat_id, {}).values())):
+            if substring in msg.get("text", ""):
+                return msg
+        return None
+
+    async def wait_for(self, chat_id: int, predicate, timeout: float = 30.0):
+        """Ждёт, пока predicate() вернёт не None; проверяется после каждого изменения сообщений в chat_id."""
+        found = predicate()
+        if found is not None:
+            return found
+        fut = asyncio.get_running_loop().create_future()
+        entry = (predicate, fut)
+        self._waiters.setdefault(chat_id, []).append(entry)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            waiters = self._waiters.get(chat_id)
+            if waiters and entry in waiters:
+                waiters.remove(entry)
+
+    async def wait_button(self, chat_id: int, prefix: str, *, timeout: float = 30.0):
+        return await self.wait_for(chat_id, lambda: self.find_button(chat_id, prefix), timeout)
+
+    async def wait_text(self, chat_id: int, substring: str, *, timeout: float = 30.0):
+        return await self.wait_for(chat_id, lambda: self.find_text(chat_id, substring), timeout)
+
+    # ======== Bot API ========
+
+    def _next_message_id(self, chat_id: int) -> int:
+        counter = self._message_ids.get(chat_id)
+        if counter is None:
+            counter = self._message_ids[chat_id] = itertools.count(1)
+        return next(counter)
+
+    def _index(self, msg: dict, add: bool) -> None:
+        chat_id = msg["chat"]["id"]
+        for row in (msg.get("reply_markup") or {}).get("inline_keyboard", []):
+            for btn in row:
+                if "callback_data" in btn:
+                    if add:
+                        self.buttons[(chat_id, btn["callback_data"])] = msg["message_id"]
+                    elif self.buttons.get((chat_id, btn["callback_data"])) == msg["message_id"]:
+                        del self.buttons[(chat_id, btn["callback_data"])]
+
+    def _notify(self, chat_id: int) -> None:
+        for predicate, fut in list(self._waiters.get(chat_id, ())):
+            if fut.done():
+                continue
+            try:
+                found = predicate()
+            except Exception as e:
+                fut.set_exception(e)
+                continue
+            if found is not None:
+                fut.set_result(found)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+        self.in_flight += 1
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            handler = getattr(self, f"_m_{method}", None)
+            if handler is None:
+                return web.json_response({"ok": True, "result": True})
+            try:
+                result = await handler(params)
+            except _BadRequest as e:
+                return web.json_response({"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}, status=400)
+            return web.json_response({"ok": True, "result": result})
+        finally:
+            self.in_flight -= 1
+
+    async def wait_idle(self, quiet: float = 0.2, timeout: float = 30.0) -> None:
+        """Ждёт, пока бот quiet секунд подряд не делает запросов (кроме getUpdates): обработчики
+        апдейтов работают задачами, и после последнего ответа пользователю они ещё могут править
+        сообщения админов."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        last, calls = loop.time(), sum(self.calls.values())
+        while loop.time() < deadline:
+            await asyncio.sleep(quiet / 4)
+            now_calls = sum(self.calls.values()) - self.calls.get("getUpdates", 0)
+            if self.in_flight or now_calls != calls:
+                last, calls = loop.time(), now_calls
+            elif loop.time() - last >= quiet:
+                return
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), min(float(params.get("timeout") or 0), 1.0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    async def _m_getMe(self, params):
+        return BOT_USER
+
+    async def _m_getChatMember(self, params):
+        return {"status": "member", "user": make_user(int(params.get("user_id", 0)))}
+
+    async def _m_answerCallbackQuery(self, params):
+        return True
+
+    async def _m_sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        msg = {
+            "message_id": self._next_message_id(chat_id),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            msg["reply_markup"] = json.loads(params["reply_markup"])
+        self.messages.setdefault(chat_id, {})[msg["message_id"]] = msg
+        self._index(msg, True)
+        self._notify(chat_id)
+        return msg
+
+    def _get_message(self, params) -> dict:
+        msg = self.messages.get(int(params.get("chat_id", 0)), {}).get(int(params.get("message_id", 0)))
+        if msg is None:
+            raise _BadRequest("message to edit not found")
+        return msg
+
+    async def _edit(self, params, *, text: bool):
+        msg = self._get_message(params)
+        new_text = params.get("text", "") if text else msg.get("text", "")
+        new_markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        if new_text == msg.get("text") and new_markup == msg.get("reply_markup"):
+            self.not_modified += 1
+            raise _BadRequest("message is not modified: specified new message content and reply markup are exactly the same")
+        self._index(msg, False)
+        msg["text"] = new_text
+        msg.pop("reply_markup", None)
+        if new_markup:
+            msg["reply_markup"] = new_markup
+        self._index(msg, True)
+        self._notify(msg["chat"]["id"])
+        return msg
+
+    async def _m_editMessageText(self, params):
+        return await self._edit(params, text=True)
+
+    async def _m_editMessageReplyMarkup(self, params):
+        return await self._edit(params, text=False)
+
+
+class _BadRequest(Exception):
+    pass
+
+
+async def start_fake_api(*, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0):
+    """Поднимает API в текущем event loop. Возвращает (api, runner, base_url)."""
+    api = FakeBotAPI(latency_ms=latency_ms)
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    real_port = site._server.sockets[0].getsockname()[1]
+    return api, runner, f"http://{host}:{real_port}"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency-ms", type=float, default=0)
+    args = ap.parse_args()
+    web.run_app(FakeBotAPI(latency_ms=args.latency_ms).app(), host="127.0.0.1", port=args.port, access_log=None)
@@ -0,0 +1,214 @@
+"""Нагрузочный прогон бота: настоящий dp из bot.py против локального поддельного Bot API (bench/fake_bot_api.py).
+
+Каждый виртуальный пользователь проходит сценарий
+    /start → «Пополнить баланс» → 500 ₽ → Карта РФ → «Далее» → «Я оплатил» → админ подтверждает СБП
+    → «Купить звёзды» → 50 ⭐ (cq_buy) → админ подтверждает заявку,
+нажимая кнопки из сообщений, которые реально показал бот. Задержка шага — от отправки апдейта
+до появления ожидаемого сообщения/кнопки.
+
+    python bench/load_test.py --users 200 --concurrency 50
+    python bench/load_test.py --users 500 --concurrency 100 --api-latency-ms 30 --json bench/load.json
+
+Отчёт: пропускная способность (сценариев и апдейтов в секунду), p50/p95/p99 по шагам,
+задержка event loop (бот, поддельный API и пользователи живут в одном loop — это верхняя оценка),
+память процесса. Файлы бота (balances.json и пр.) пишутся во временный каталог; сеть не нужна.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import make_user, start_fake_api
+
+STEPS = [
+    "start", "balance", "topup_amount", "pay_sbp", "sbp_next", "sbp_paid", "admin_sbp_approve",
+    "buy_menu", "buy", "admin_star_approve",
+]
+
+
+def pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    return vals[min(len(vals) - 1, int(q * len(vals)))]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except Exception:
+        # macOS и др.: максимум за время жизни процесса (в байтах на macOS, в КБ на Linux)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+class LoopMonitor:
+    """Задержка event loop: насколько позже запланированного просыпается sleep(interval); заодно пик RSS."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lag_ms: list[float] = []
+        self.rss_peak = rss_mb()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag_ms.append(max(0.0, (loop.time() - t0 - self.interval) * 1000))
+            self.rss_peak = max(self.rss_peak, rss_mb())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bot_load_")
+    os.chdir(workdir)
+    os.environ.setdefault("BOT_TOKEN", "123456:LOAD-TEST-TOKEN")
+    rss_start = rss_mb()
+
+    import bot as bot_module
+    from aiogram.client.telegram import TelegramAPIServer
+
+    api, runner, base = await start_fake_api(latency_ms=args.api_latency_ms)
+    # та же сессия (с её middleware), только адрес API — локальный
+    bot_module.bot.session.api = TelegramAPIServer.from_base(base)
+    admin = make_user(bot_module.settings.ADMIN_IDS[0])
+    admin_chat = bot_module.get_admin_group_id()
+
+    polling = asyncio.create_task(bot_module.dp.start_polling(bot_module.bot, handle_signals=False, polling_timeout=1))
+    while not api.calls.get("getUpdates"):
+        await asyncio.sleep(0.01)
+
+    monitor = LoopMonitor()
+    monitor.start()
+    latencies: dict[str, list[float]] = {s: [] for s in STEPS}
+    failures: dict[str, int] = {}
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def step(name: str, action, waiter):
+        t0 = time.perf_counter()
+        action()
+        try:
+            found = await asyncio.wait_for(waiter, args.timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(name)
+        latencies[name].append((time.perf_counter() - t0) * 1000)
+        return found
+
+    async def flow(user_id: int) -> bool:
+        user = make_user(user_id)
+        uid = user_id
+        async with sem:
+            try:
+                msg, _ = await step("start", lambda: api.send_text(user, "/start"), api.wait_button(uid, "balance"))
+                msg, _ = await step("balance", lambda: api.click(user, msg, "balance"), api.wait_button(uid, "topup_amount:500"))
+                msg, _ = await step("topup_amount", lambda: api.click(user, msg, "topup_amount:500"), api.wait_button(uid, "pay_sbp"))
+                msg, data = await step("pay_sbp", lambda: api.click(user, msg, "pay_sbp"), api.wait_button(uid, "sbp_next:"))
+                sbp_id = data.split(":", 1)[1]
+                msg, _ = await step("sbp_next", lambda: api.click(user, msg, data), api.wait_button(uid, f"sbp_paid:{sbp_id}"))
+                adm_msg, adm_data = await step(
+                    "sbp_paid", lambda: api.click(user, msg, f"sbp_paid:{sbp_id}"), api.wait_button(admin_chat, f"sbp_approve:{sbp_id}"),
+                )
+                await step(
+                    "admin_sbp_approve", lambda: api.click(admin, adm_msg, adm_data), api.wait_text(uid, "Баланс пополнен на 500"),
+                )
+                menu, _ = await api.wait_button(uid, "buy_menu")
+                msg, _ = await step("buy_menu", lambda: api.click(user, menu, "buy_menu"), api.wait_button(uid, "buy:50"))
+                done = await step("buy", lambda: api.click(user, msg, "buy:50"), api.wait_text(uid, "Код заявки: <code>"))
+                order_id = re.search(r"<code>([^<]+)</code>", done["text"]).group(1)
+                adm_msg, adm_data = await api.wait_button(admin_chat, f"star_approve:{order_id}", timeout=args.timeout)
+                await step(
+                    "admin_star_approve", lambda: api.click(admin, adm_msg, adm_data),
+                    api.wait_text(uid, "Администратор подтвердил покупку"),
+                )
+                return True
+            except RuntimeError as e:
+                failures[str(e)] = failures.get(str(e), 0) + 1
+                return False
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(flow(1_000_000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - t0
+
+    await monitor.stop()
+    await api.wait_idle()
+    await bot_module.dp.stop_polling()
+    await asyncio.gather(polling, return_exceptions=True)
+    await runner.cleanup()
+
+    all_lat = [v for vals in latencies.values() for v in vals]
+    updates = sum(len(v) for v in latencies.values())
+    return {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "api_latency_ms": args.api_latency_ms,
+        "completed": sum(results),
+        "failed": failures,
+        "elapsed_sec": round(elapsed, 3),
+        "flows_per_sec": round(sum(results) / elapsed, 2),
+        "updates_per_sec": round(updates / elapsed, 1),
+        "api_calls": dict(sorted(api.calls.items())),
+        "api_not_modified": api.not_modified,
+        "latency_ms": {"all": _summary(all_lat), **{s: _summary(v) for s, v in latencies.items()}},
+        "loop_lag_ms": {"p50": round(pct(monitor.lag_ms, 0.5), 2), "p99": round(pct(monitor.lag_ms, 0.99), 2),
+                        "max": round(max(monitor.lag_ms, default=0.0), 2)},
+        "rss_mb": {"start": round(rss_start, 1), "peak": round(monitor.rss_peak, 1), "end": round(rss_mb(), 1)},
+        "render_cache": bot_module.render_cache.stats(),
+        "throttle": bot_module.throttle_buckets.stats(),
+        "workdir": workdir,
+    }
+
+
+def _summary(values: list[float]) -> dict:
+    return {"n": len(values), "p50": round(pct(values, 0.5), 2), "p95": round(pct(values, 0.95), 2),
+            "p99": round(pct(values, 0.99), 2), "max": round(max(values, default=0.0), 2)}
+
+
+def print_report(r: dict) -> None:
+    print(f"Пользователей: {r['users']} (одновременно до {r['concurrency']}), задержка API {r['api_latency_ms']} мс")
+    print(f"Завершили сценарий: {r['completed']}, ошибки по шагам: {r['failed'] or 'нет'}")
+    print(f"Время: {r['elapsed_sec']} с — {r['flows_per_sec']} сценариев/с, {r['updates_per_sec']} апдейтов/с")
+    print(f"{'шаг':<20} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (мс)")
+    for name, s in r["latency_ms"].items():
+        print(f"{name:<20} {s['n']:>6} {s['p50']:>9.1f} {s['p95']:>9.1f} {s['p99']:>9.1f} {s['max']:>9.1f}")
+    lag = r["loop_lag_ms"]
+    print(f"Задержка event loop: p50 {lag['p50']} мс, p99 {lag['p99']} мс, max {lag['max']} мс")
+    mem = r["rss_mb"]
+    print(f"Память (RSS): старт {mem['start']} МБ, пик {mem['peak']} МБ, конец {mem['end']} МБ")
+    print(f"Вызовы API: {r['api_calls']}")
+    rc = r["render_cache"]
+    print(f"Пропущено правок без изменений: {rc['skipped']}, ответов «not modified» от API: {r['api_not_modified']}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--api-latency-ms", type=float, default=0)
+    ap.add_argument("--timeout", type=float, default=30.0, help="сколько ждать ответа бота на шаге, с")
+    ap.add_argument("--json", help="сохранить отчёт в файл")
+    args = ap.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    report = asyncio.run(run(args))
+    print_report(report)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,258 @@
+"""Локальная копия сценария split.tg для прогонов SplitClient без живого сайта.
+
+Повторяет разметку из сохранённых split_step_2_result.html / split_debug_*.html:
+/stars → "Premium & Stars" (/store) → карточка Telegram Stars → "Buy Stars to User" →
+модалка с @username, дропдауном актива и количеством → "Buy Telegram Stars" → номер заказа или ссылка CryptoBot.
+
+Варианты вёрстки (--variant, можно через запятую):
+    default          — как на сохранённых страницах
+    ru               — русские плейсхолдеры
+    product_link     — карточка Telegram Stars является ссылкой <a href="/stars/buy">
+    no_buy_to_user   — форма открыта сразу, без кнопки "Buy Stars to User"
+    amount_by_name   — поле количества без плейсхолдера, только input[name=amount]
+    iframe           — форма внутри iframe
+    cookies          — баннер согласия с cookies
+    invoice          — вместо номера заказа отдаётся ссылка на оплату в CryptoBot
+
+Запуск:  python bench/split_replica.py --port 8765 --variant default
+Затем SplitClient(..., base_url="http://127.0.0.1:8765").
+"""
+import argparse
+import asyncio
+import itertools
+import json
+
+from aiohttp import web
+
+ASSET_JS = "/assets/index-Dq3kR7xP.js"
+ASSET_CSS = "/assets/index-BYoEimbO.css"
+
+CSS = """
+body { font-family: sans-serif; margin: 0; }
+header nav a { margin-right: 12px; }
+.card { border: 1px solid #ccc; border-radius: 12px; padding: 12px; margin: 8px; }
+#modal .sheet { position: fixed; inset: 10% 20%; background: #fff; border: 1px solid #999; padding: 16px; }
+ul.menu { list-style: none; padding: 0; }
+li.flex { display: flex; cursor: pointer; padding: 4px; }
+#cookies { position: fixed; bottom: 0; left: 0; right: 0; background: #eee; padding: 8px; }
+"""
+
+# Поведение модалки: дропдаун актива, «резолв» username, включение кнопки, отправка заказа
+JS = """
+(function () {
+  function $(sel, root) { return (root || document).querySelector(sel); }
+  function bindForm(root) {
+    var user = $("input[data-field=user]", root), amount = $("input[data-field=amount]", root);
+    var buy = $("button[data-action=buy]", root), drop = $("button[data-action=asset]", root);
+    var menu = $("ul.menu", root), asset = "USDT (TON)", resolved = false, timer = null;
+    function refresh() { buy.disabled = !(resolved && parseInt(amount.value || "0", 10) >= 50); }
+    user.addEventListener("input", function () {
+      resolved = false; clearTimeout(timer);
+      timer = setTimeout(function () {
+        fetch("/api/resolve?username=" + encodeURIComponent(user.value)).then(function (r) { return r.json(); })
+          .then(function (d) { resolved = !!d.ok; refresh(); });
+      }, 150);
+      refresh();
+    });
+    amount.addEventListener("input", refresh);
+    drop.addEventListener("click", function () { menu.style.display = menu.style.display === "none" ? "block" : "none"; });
+    Array.prototype.forEach.call(root.querySelectorAll("ul.menu li"), function (li) {
+      li.addEventListener("click", function () {
+        asset = li.textContent.trim(); $("div", drop).textContent = asset; menu.style.display = "none";
+      });
+    });
+    buy.addEventListener("click", function () {
+      buy.disabled = true;
+      fetch("/api/buy", {method: "POST", headers: {"Content-Type": "application/json"},
+        body: JSON.stringify({username: user.value, qty: parseInt(amount.value, 10), asset: asset})})
+        .then(function (r) { return r.json(); })
+        .then(function (d) {
+          var out = document.createElement("div");
+          if (d.order_id) { out.innerHTML = 'Order ID: <span class="order-id">' + d.order_id + "</span>"; }
+          else { out.innerHTML = '<a href="' + d.invoice_url + '">Pay in CryptoBot</a>'; }
+          root.appendChild(out);
+        });
+    });
+  }
+  window.splitReplica = {bindForm: bindForm};
+  document.addEventListener("DOMContentLoaded", function () {
+    var open = $("button[data-action=open-form]");
+    var form = $("#form-template");
+    function show() {
+      if (!form) { return; }
+      var modal = $("#modal");
+      modal.innerHTML = '<div class="sheet">' + form.innerHTML + "</div>";
+      bindForm(modal);
+    }
+    if (open) { open.addEventListener("click", show); }
+    else if (form) { show(); }
+    var cookies = $("#cookies button");
+    if (cookies) { cookies.addEventListener("click", function () { $("#cookies").remove(); }); }
+  });
+})();
+"""
+
+
+class Replica:
+    """Состояние и страницы локальной копии split.tg."""
+
+    def __init__(self, variants=("default",), latency_ms: int = 0):
+        self.variants = set(variants)
+        self.latency_ms = int(latency_ms)
+        self.orders: list[dict] = []
+        self._seq = itertools.count(1)
+
+    def has(self, name: str) -> bool:
+        return name in self.variants
+
+    # ======== Разметка ========
+
+    def _page(self, body: str) -> str:
+        cookies = '<div id="cookies">We use cookies <button>Accept</button></div>' if self.has("cookies") else ""
+        return (
+            '<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><title>Split</title>'
+            f'<link rel="stylesheet" href="{ASSET_CSS}"><script src="{ASSET_JS}"></script>'
+            '<script async src="https://www.googletagmanager.com/gtag/js?id=G-REPLICA"></script>'
+            '</head><body><div id="root"><header><a href="/" data-discover="true"><span>Split</span></a><nav>'
+            '<a href="/store" data-discover="true">Premium &amp; Stars</a>'
+            '<a href="/gift" data-discover="true">Gift Codes</a></nav></header>'
+            f"<main>{body}</main></div><div id=\"modal\"></div>{cookies}</body></html>"
+        )
+
+    def _form(self) -> str:
+        ru = self.has("ru")
+        user_ph = "Введите Telegram @username" if ru else "Enter Telegram @username"
+        if self.has("amount_by_name"):
+            amount = '<input data-field="amount" name="amount" inputmode="decimal" value="">'
+        else:
+            amount_ph = "Введите кол-во Telegram Stars" if ru else "Enter amount (50 - 20&nbsp;000)"
+            amount = f'<input data-field="amount" inputmode="decimal" placeholder="{amount_ph}" value="">'
+        return (
+            "<div><div>Buy Telegram Stars</div>"
+            f'<div><div>Choose recipient</div><input data-field="user" autocomplete="off" placeholder="{user_ph}"></div>'
+            '<div><div>Payment method</div><button data-action="asset" class="rounded-xl"><div>USDT (TON)</div></button>'
+            '<ul class="menu" style="display: none">'
+            '<li class="flex cursor-pointer">USDT (TON)</li><li class="flex cursor-pointer">TON</li>'
+            '<li class="flex cursor-pointer">xRocket (USDT)</li></ul></div>'
+            f"<div><div>Choose quantity of Telegram Stars</div>{amount}</div>"
+            '<button data-action="buy" disabled><span>Buy Telegram Stars</span></button></div>'
+        )
+
+    def _stars_card(self) -> str:
+        if self.has("product_link"):
+            return '<div class="card"><a href="/stars/buy">Telegram Stars</a></div>'
+        if self.has("no_buy_to_user"):
+            return '<div class="card"><div>Telegram Stars</div></div>'
+        return (
+            '<div class="card"><div>Telegram Stars</div><div>Give your friends gifts</div>'
+            '<button data-action="open-form"><span>Buy Stars to User</span></button></div>'
+        )
+
+    def _form_block(self) -> str:
+        if self.has("iframe"):
+            # содержимое формы подгружает iframe, как у встроенных виджетов
+            return '<iframe src="/embed/form" width="600" height="400"></iframe>'
+        return f'<template id="form-template">{self._form()}</template>'
+
+    def store_page(self) -> str:
+        cards = (
+            '<div class="card"><div>Telegram Premium</div><button><span>Buy Premium to User</span></button></div>'
+            + self._stars_card()
+        )
+        form = "" if self.has("product_link") else self._form_block()
+        return self._page(f"<div>What are you buying today?</div>{cards}{form}")
+
+    def product_page(self) -> str:
+        card = (
+            '<div class="card"><div>Telegram Stars</div>'
+            '<button data-action="open-form"><span>Buy Stars to User</span></button></div>'
+        )
+        return self._page(card + self._form_block())
+
+    def embed_page(self) -> str:
+        return (
+            f'<!DOCTYPE html><html><head><script src="{ASSET_JS}"></script></head><body>'
+            f'<div id="embed">{self._form()}</div>'
+            '<script>window.splitReplica.bindForm(document.getElementById("embed"));</script></body></html>'
+        )
+
+    # ======== HTTP ========
+
+    async def _delay(self) -> None:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+
+        async def html(text: str) -> web.Response:
+            await self._delay()
+            return web.Response(text=text, content_type="text/html", headers={"ETag": f'"{hash(text) & 0xffffffff:x}"'})
+
+        async def stars(request):
+            return await html(self.store_page())
+
+        async def store(request):
+            return await html(self.store_page())
+
+        async def product(request):
+            return await html(self.product_page())
+
+        async def embed(request):
+            return await html(self.embed_page())
+
+        async def asset(request):
+            await self._delay()
+            is_js = request.path.endswith(".js")
+            return web.Response(
+                text=JS if is_js else CSS,
+                content_type="application/javascript" if is_js else "text/css",
+                headers={"Cache-Control": "public, max-age=31536000, immutable"},
+            )
+
+        async def resolve(request):
+            await self._delay()
+            return web.json_response({"ok": bool(request.query.get("username", "").strip())})
+
+        async def buy(request):
+            await self._delay()
+            data = json.loads(await request.text() or "{}")
+            n = next(self._seq)
+            rec = {"username": data.get("username"), "qty": data.get("qty"), "asset": data.get("asset")}
+            if self.has("invoice"):
+                rec["invoice_url"] = f"https://t.me/CryptoBot/app?startapp=invoice-REPLICA{n:06d}"
+            else:
+                rec["order_id"] = f"ORD-{n:06d}"
+            self.orders.append(rec)
+            return web.json_response(rec)
+
+        app.router.add_get("/stars", stars)
+        app.router.add_get("/store", store)
+        app.router.add_get("/stars/buy", product)
+        app.router.add_get("/embed/form", embed)
+        app.router.add_get(ASSET_JS, asset)
+        app.router.add_get(ASSET_CSS, asset)
+        app.router.add_get("/api/resolve", resolve)
+        app.router.add_post("/api/buy", buy)
+        return app
+
+
+async def start_replica(variants=("default",), *, host: str = "127.0.0.1", port: int = 0, latency_ms: int = 0):
+    """Поднимает копию в текущем event loop. Возвращает (replica, runner, base_url)."""
+    replica = Replica(variants, latency_ms=latency_ms)
+    runner = web.AppRunner(replica.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    real_port = site._server.sockets[0].getsockname()[1]
+    return replica, runner, f"http://{host}:{real_port}"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--variant", default="default")
+    ap.add_argument("--latency-ms", type=int, default=0)
+    args = ap.parse_args()
+    replica = Replica(args.variant.split(","), latency_ms=args.latency_ms)
+    web.run_app(replica.app(), host="127.0.0.1", port=args.port)
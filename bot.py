@@ -1,17 +1,30 @@
 import asyncio
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, PreCheckoutQuery, LabeledPrice, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, WebAppInfo, ForceReply, BotCommand
+from aiogram.types import Message, PreCheckoutQuery, LabeledPrice, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, WebAppInfo, ForceReply, BotCommand, FSInputFile
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 from pydantic import BaseModel
 
 import settings
-from split_client import SplitClient
+from split_worker import OutcomeUnknown, SplitWorker
+from split_artifacts import ArtifactStore
+from fulfilment import FulfilmentQueue
+from stats_agg import StatsAggregator, parse_range
+from ranking import Leaderboard
+from ids import IdAllocator
+from pending_index import PendingIndex, merged_page
+from expiry import Expiry, ExpiringDict
+from msg_index import MessageIndex
+from render_cache import RenderCache
+from jobs import JobRunner
+from throttle import TokenBuckets
+from idempotency import AppliedKeys, RecentIds
 
 import math
 import json
+import time
 import uuid
 import httpx
 
@@ -25,12 +38,18 @@ class Store(BaseModel):
 store = Store()
 store.user_price_per_star_rub = 1.5
 
-pending_qty: dict[int, int] = {}
+# сроки жизни незавершённых состояний (см. EXPIRE_* в settings и регистрацию видов ниже)
+expiry = Expiry()
+
+pending_qty: dict[int, int] = ExpiringDict(expiry, "pending_qty")
 ask_custom: dict[int, bool] = {}
 rub_balance: dict[int, int] = {}# баланс в копейках (RUB*100)
 
 # --- Персистентный баланс ---
 BALANCE_FILE = getattr(settings, "BALANCE_FILE", "balances.json")
+# ключи уже проведённых операций (списание по заявке, зачисление СБП/Crypto Pay) — хранятся в balances.json
+# под ключом "_applied", чтобы отметка и изменение баланса записывались одним файлом
+ledger_keys = AppliedKeys()
 
 def load_balances() -> None:
     """Загружает баланс пользователей из JSON-файла в rub_balance.
@@ -44,6 +63,7 @@ def load_balances() -> None:
             data = _json.load(f)
         if isinstance(data, dict):
             rub_balance.clear()
+            ledger_keys.load(data.get("_applied"))
             for k, v in data.items():
                 try:
                     uid = int(k)
@@ -61,7 +81,9 @@ def save_balances() -> None:
         tmp_dir = os.path.dirname(BALANCE_FILE) or "."
         fd, tmp_path = tempfile.mkstemp(prefix="balances_", dir=tmp_dir)
         with os.fdopen(fd, "w", encoding="utf-8") as f:
-            _json.dump({str(k): int(v) for k, v in rub_balance.items()}, f, ensure_ascii=False, indent=2)
+            payload = {str(k): int(v) for k, v in rub_balance.items()}
+            payload["_applied"] = ledger_keys.to_dict()
+            _json.dump(payload, f, ensure_ascii=False, indent=2)
         os.replace(tmp_path, BALANCE_FILE)
     except Exception:
         # не валим бота при ошибке записи
@@ -72,6 +94,11 @@ STATS_FILE = getattr(settings, "STATS_FILE", "stats.json")
 # суммарно пополнено (в копейках)
 total_deposits: dict[int, int] = {}
 total_stars: dict[int, int] = {}
+# агрегаты для /stats: итоги, выручка/прибыль, пополнения по методам по дням и часам
+stats_agg = StatsAggregator()
+# рейтинги по total_stars / total_deposits: топ-N и место пользователя за O(log n)
+stars_rank = Leaderboard()
+deposits_rank = Leaderboard()
 
 def load_stats() -> None:
     import os, json as _json
@@ -91,9 +118,18 @@ def load_stats() -> None:
                     total_stars[int(k)] = int(v)
                 except Exception:
                     pass
+            if "agg" in data:
+                stats_agg.load(data["agg"])
+            else:
+                # файл от старой версии: переносим итоги один раз, без разбивки по дням и методам
+                stats_agg.totals["deposits"]["OTHER"] = [0, sum(total_deposits.values())]
+                stats_agg.totals["stars"] = sum(total_stars.values())
     except Exception:
         # не валим бота при ошибке чтения
         pass
+    global stars_rank, deposits_rank
+    stars_rank = Leaderboard(total_stars)
+    deposits_rank = Leaderboard(total_deposits)
 
 def save_stats() -> None:
     import json as _json, os, tempfile
@@ -101,6 +137,7 @@ def save_stats() -> None:
         payload = {
             "deposits": {str(k): int(v) for k, v in total_deposits.items()},
             "stars":    {str(k): int(v) for k, v in total_stars.items()},
+            "agg":      stats_agg.to_dict(),
         }
         tmp_dir = os.path.dirname(STATS_FILE) or "."
         fd, tmp_path = tempfile.mkstemp(prefix="stats_", dir=tmp_dir)
@@ -113,22 +150,29 @@ def save_stats() -> None:
 
 # ожидаемые пополнения через Crypto Pay: user_id -> {topup_id, amount_rub, invoice_id}
 
-pending_topups: dict[int, dict] = {}
+pending_topups: dict[int, dict] = ExpiringDict(expiry, "pending_topups")
 
-# ожидаемые заявки на покупку звёзд вручную админом: order_id -> {user_id, qty, price_kopecks, username}
-pending_orders: dict[str, dict] = {}
+# ожидаемые заявки на покупку звёзд вручную админом: order_id -> {user_id, qty, price_kopecks, username, created_at}
+# (PendingIndex — dict с индексами по времени создания и по пользователю для /queue)
+pending_orders: PendingIndex = PendingIndex(on_set=lambda k, r: expiry.schedule("pending_orders", k, since=r["created_at"]))
 
-# ожидаемые оплаты по СБП (ручное подтверждение админом): sbp_id -> {user_id, amount_rub}
-pending_sbp: dict[str, dict] = {}
+# ожидаемые оплаты по СБП (ручное подтверждение админом): sbp_id -> {user_id, amount_rub, created_at}
+pending_sbp: PendingIndex = PendingIndex(on_set=lambda k, r: expiry.schedule("pending_sbp", k, since=r["created_at"]))
+
+# сообщения бота о каждой заявке (копии у админов и сообщение пользователю) — чтобы править их при смене статуса
+msg_index = MessageIndex(
+    getattr(settings, "MSG_INDEX_FILE", "message_index.json"),
+    getattr(settings, "MSG_INDEX_MAX", 20000),
+)
+msg_index_task: asyncio.Task | None = None
 
 # ожидание ввода изменённой суммы для СБП: (chat_id, admin_id) -> sbp_id
-sbp_change_wait: dict[tuple[int, int], str] = {}
+sbp_change_wait: dict[tuple[int, int], str] = ExpiringDict(expiry, "sbp_change_wait")
 
-# использованные коды (чтобы не повторялись за время работы бота)
-used_sbp_ids: set[str] = set()
-used_order_ids: set[str] = set()
+# коды заявок: упорядочены по времени и уникальны между рестартами и репликами (REPLICA_ID)
+code_allocator = IdAllocator(getattr(settings, "REPLICA_ID", 0))
 
-# --- Персистентные очереди заявок (без истечения срока) ---
+# --- Персистентные очереди заявок (срок — EXPIRE_ORDER_SEC / EXPIRE_SBP_SEC) ---
 PENDING_ORDERS_FILE = getattr(settings, "PENDING_ORDERS_FILE", "pending_orders.json")
 PENDING_SBP_FILE = getattr(settings, "PENDING_SBP_FILE", "pending_sbp.json")
 
@@ -154,6 +198,8 @@ def load_pending() -> None:
         try:
             with open(PENDING_ORDERS_FILE, "r", encoding="utf-8") as f:
                 data = _json.load(f)
+            # для записей без достоверного времени создания — не позже последнего изменения файла
+            file_mtime = os.path.getmtime(PENDING_ORDERS_FILE)
             if isinstance(data, dict):
                 pending_orders.clear()
                 for k, v in data.items():
@@ -163,7 +209,12 @@ def load_pending() -> None:
                             "qty": int(v.get("qty", 0)),
                             "price_kopecks": int(v.get("price_kopecks", 0)),
                             "username": str(v.get("username", "")),
+                            "created_at": PendingIndex.created_at(str(k), v, file_mtime),
                         }
+                        if v.get("auto"):
+                            pending_orders[str(k)]["auto"] = True
+                        if v.get("unsure"):
+                            pending_orders[str(k)]["unsure"] = True
         except Exception:
             pass
     # sbp
@@ -171,6 +222,8 @@ def load_pending() -> None:
         try:
             with open(PENDING_SBP_FILE, "r", encoding="utf-8") as f:
                 data = _json.load(f)
+            # для записей без достоверного времени создания — не позже последнего изменения файла
+            file_mtime = os.path.getmtime(PENDING_SBP_FILE)
             if isinstance(data, dict):
                 pending_sbp.clear()
                 for k, v in data.items():
@@ -178,15 +231,10 @@ def load_pending() -> None:
                         pending_sbp[str(k)] = {
                             "user_id": int(v.get("user_id", 0)),
                             "amount_rub": int(v.get("amount_rub", 0)),
+                            "created_at": PendingIndex.created_at(str(k), v, file_mtime),
                         }
         except Exception:
             pass
-    # восстановим множества использованных кодов, чтобы избежать коллизий
-    try:
-        used_order_ids.update(pending_orders.keys())
-        used_sbp_ids.update(pending_sbp.keys())
-    except Exception:
-        pass
 
 def save_pending_orders() -> None:
     _atomic_dump_json(PENDING_ORDERS_FILE, {str(k): v for k, v in pending_orders.items()})
@@ -194,34 +242,110 @@ def save_pending_orders() -> None:
 def save_pending_sbp() -> None:
     _atomic_dump_json(PENDING_SBP_FILE, {str(k): v for k, v in pending_sbp.items()})
 
-def _gen_unique_code(used: set[str], also_check: set[str] | dict | None = None, length: int = 12) -> str:
-    """Генерирует уникальный код и проверяет, что его ещё нет в used и also_check."""
-    while True:
-        code = uuid.uuid4().hex[:length]
-        if code in used:
-            continue
-        if also_check is not None:
-            if isinstance(also_check, dict):
-                if code in also_check:
-                    continue
-            elif isinstance(also_check, set):
-                if code in also_check:
-                    continue
-        used.add(code)
-        return code
-
 def gen_sbp_id() -> str:
-    return _gen_unique_code(used_sbp_ids, also_check=set(pending_sbp.keys()), length=12)
+    return code_allocator.new(pending_sbp)
 
 def gen_order_id() -> str:
-    return _gen_unique_code(used_order_ids, also_check=set(pending_orders.keys()), length=12)
+    return code_allocator.new(pending_orders)
 
 # флаг ожидания пользовательского ввода суммы пополнения в ₽
-ask_custom_topup: dict[int, bool] = {}
+ask_custom_topup: dict[int, bool] = ExpiringDict(expiry, "ask_custom_topup")
 
 
 bot = Bot(settings.BOT_TOKEN)
+# правки сообщений, которые ничего не меняют (то же меню повторно), не уходят в Telegram
+render_cache = RenderCache(getattr(settings, "RENDER_CACHE_SIZE", 5000))
+bot.session.middleware(render_cache)
 dp = Dispatcher()
+# медленная работа из обработчиков (запросы к Crypto Pay) — фоновыми задачами, по одной на пользователя и действие
+jobs = JobRunner(getattr(settings, "JOB_CONCURRENCY", 8))
+
+# --- Истечение срока незавершённых состояний ---
+EXPIRED_ARCHIVE_FILE = getattr(settings, "EXPIRED_ARCHIVE_FILE", "expired.jsonl")
+
+
+def _archive_expired(kind: str, key, rec) -> None:
+    """Дописывает истёкшую запись в архив (JSON по строке) — чтобы её можно было найти и зачислить вручную."""
+    if not EXPIRED_ARCHIVE_FILE:
+        return
+    try:
+        with open(EXPIRED_ARCHIVE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"kind": kind, "key": key, "rec": rec, "expired_at": int(time.time())}, ensure_ascii=False) + "\n")
+    except Exception:
+        pass
+
+
+async def _notify_quietly(chat_id, text: str) -> None:
+    try:
+        await bot.send_message(chat_id, text)
+    except Exception:
+        pass
+
+
+# для заявок, где автопокупка прервалась после начала покупки (rec["unsure"]): резерв не снимаем, пока не решит админ
+INTERRUPTED_BUY_NOTE = (
+    "Звёзды могли уже быть куплены. "
+    "Проверьте заказы split.tg: если звёзды пришли — подтвердите (сумма уже зарезервирована и второй раз не спишется), "
+    "иначе купите вручную или отклоните (резерв вернётся на баланс)."
+)
+
+
+async def _expire_topup(user_id: int, rec: dict):
+    _archive_expired("pending_topups", user_id, rec)
+    await _notify_quietly(user_id, (
+        f"Счёт Crypto Bot на {rec.get('amount_rub', 0)} ₽ истёк и больше не принимает оплату. "
+        "Если вы успели оплатить, напишите в поддержку — платёж зачислим вручную."
+    ))
+
+
+async def _expire_sbp(sbp_id: str, rec: dict):
+    _archive_expired("pending_sbp", sbp_id, rec)
+    try:
+        await announce_status(
+            sbp_id, rec.get("user_id"),
+            f"Заявка на пополнение по Карте РФ на {rec.get('amount_rub', 0)} ₽ закрыта: администратор не подтвердил её вовремя. "
+            "Если вы перевели средства, ответьте в чат с квитанцией, и мы проверим вручную.",
+            admin_text=f"⌛ Заявка СБП {sbp_id} на {rec.get('amount_rub', 0)} ₽ (id={rec.get('user_id')}) закрыта по сроку.",
+        )
+    except Exception:
+        pass
+
+
+async def _expire_order(order_id: str, rec: dict):
+    if rec.get("auto"):
+        # заявка в очереди автопокупки — её закроет воркер
+        return False
+    if rec.get("unsure") and order_hold_active(order_id):
+        # автопокупка прервалась на середине: звёзды могли уйти, вернуть резерв вслепую нельзя — решает админ
+        await send_order_to_admins(order_id, rec, note="⏰ Заявка всё ещё ждёт решения. " + INTERRUPTED_BUY_NOTE)
+        return False
+    _archive_expired("pending_orders", order_id, rec)
+    release_order_hold(order_id, rec)
+    stats_agg.record_expired()
+    try:
+        await announce_status(
+            order_id, rec.get("user_id"),
+            f"Заявка на покупку {rec.get('qty')} ⭐ для {rec.get('username')} не была обработана вовремя и закрыта. Средства не списаны.",
+            admin_text=f"⌛ Заявка {order_id} на {rec.get('qty')} ⭐ (id={rec.get('user_id')}) закрыта по сроку.",
+        )
+    except Exception:
+        pass
+
+
+def _flush_expired_orders() -> None:
+    save_pending_orders()
+    save_balances()
+    save_stats()
+
+
+expiry.register("pending_topups", pending_topups, getattr(settings, "EXPIRE_TOPUP_SEC", 2100), on_expire=_expire_topup)
+expiry.register("pending_sbp", pending_sbp, getattr(settings, "EXPIRE_SBP_SEC", 72 * 3600),
+                on_expire=_expire_sbp, on_flush=save_pending_sbp)
+expiry.register("pending_orders", pending_orders, getattr(settings, "EXPIRE_ORDER_SEC", 72 * 3600),
+                on_expire=_expire_order, on_flush=_flush_expired_orders)
+for _kind, _mapping in (("pending_qty", pending_qty), ("ask_custom_topup", ask_custom_topup), ("sbp_change_wait", sbp_change_wait)):
+    expiry.register(_kind, _mapping, getattr(settings, "EXPIRE_INPUT_SEC", 3600))
+expiry_task: asyncio.Task | None = None
 
 # --- Команды бота (/start, /help и т.п.) ---
 async def setup_commands(bot: Bot):
@@ -233,10 +357,45 @@ async def setup_commands(bot: Bot):
     ])
 
 async def on_startup(bot: Bot):
+    global expiry_task, msg_index_task
     await setup_commands(bot)
-
-# зарегистрируем on_startup для aiogram v3
+    expiry_task = asyncio.create_task(expiry.run())
+    msg_index_task = asyncio.create_task(msg_index.autosave())
+    if fulfilment is not None:
+        fulfilment.start()
+    # заявки автопокупки, не доделанные до рестарта
+    for order_id, rec in list(pending_orders.items()):
+        if not rec.get("auto"):
+            continue
+        if fulfilment is not None and not order_hold_active(order_id):
+            # покупка ещё не начиналась — просто ставим заново
+            fulfilment.submit(order_id, key=rec["username"].lower(), qty=rec["qty"])
+            continue
+        rec.pop("auto", None)
+        if order_hold_active(order_id):
+            # процесс упал посреди покупки: звёзды могли уже уйти — повторять вслепую нельзя
+            rec["unsure"] = True
+            note = "⚠️ Автопокупка была прервана перезапуском бота после начала покупки на split.tg. " + INTERRUPTED_BUY_NOTE
+        else:
+            note = "Автопокупка выключена — заявка передана на ручную обработку."
+        save_pending_orders()
+        await send_order_to_admins(order_id, rec, note=note)
+
+async def on_shutdown(bot: Bot):
+    await jobs.stop()
+    if expiry_task is not None:
+        expiry_task.cancel()
+    if msg_index_task is not None:
+        msg_index_task.cancel()
+    msg_index.save()
+    if fulfilment is not None:
+        await fulfilment.stop()
+    if split_client is not None:
+        await split_client.close()
+
+# зарегистрируем on_startup/on_shutdown для aiogram v3
 dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
 
 # --- Обязательная подписка на канал ---
 REQUIRED_CHANNEL = getattr(settings, "REQUIRED_CHANNEL", None)  # например: "@my_channel" или -1001234567890
@@ -330,7 +489,75 @@ class SubscriptionMiddleware(BaseMiddleware):
             pass
         return  # не пропускаем дальше, пока не подпишется
 
-# Подключаем middleware на все входящие сообщения и коллбэки
+# --- Ограничение частоты нажатий и сообщений от одного пользователя ---
+# действие -> (токенов в секунду, всплеск); "*" — общий лимит пользователя на всё подряд.
+# Действие коллбэка — часть callback_data до ":", у сообщений — "msg".
+THROTTLE_RULES: dict[str, tuple[float, float]] = {
+    "*": (2.0, 10),
+    "check_crypto": (0.2, 2),   # getInvoices в Crypto Pay
+    "pay_ton": (0.1, 2),        # createInvoice
+    "pay_usdt": (0.1, 2),
+    "check_sub": (0.2, 3),      # get_chat_member
+    "sbp_paid": (0.1, 2),       # сообщение в группу админов
+    "buy": (0.5, 3),
+    "msg": (1.0, 5),
+}
+THROTTLE_RULES.update(getattr(settings, "THROTTLE_RULES", None) or {})
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Token bucket на пользователя и на (пользователь, действие). Лишние нажатия гасятся на месте:
+    коллбэку — короткий ответ, сообщению — одно предупреждение раз в 10 с. Админов не ограничивает.
+    """
+
+    def __init__(self, buckets: TokenBuckets):
+        self.buckets = buckets
+        self.notices = TokenBuckets()
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        user = getattr(event, "from_user", None)
+        if not user or user.id in get_admin_ids():
+            return await handler(event, data)
+        if isinstance(event, CallbackQuery):
+            action = (event.data or "").split(":", 1)[0]
+        else:
+            action = "msg"
+        wait = self.buckets.take((user.id, "*"), *THROTTLE_RULES["*"])
+        if not wait and action in THROTTLE_RULES:
+            wait = self.buckets.take((user.id, action), *THROTTLE_RULES[action])
+        if not wait:
+            return await handler(event, data)
+        text = f"Слишком часто. Попробуйте через {max(1, math.ceil(wait))} с."
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif not self.notices.take(user.id, 0.1, 1):
+                await event.answer(text)
+        except Exception:
+            pass
+        return None
+
+
+throttle_buckets = TokenBuckets()
+
+# update_id последних апдейтов: повторная доставка (после рестарта, таймаута getUpdates) не обрабатывается второй раз
+recent_updates = RecentIds(getattr(settings, "RECENT_UPDATES_SIZE", 10000))
+
+
+class DuplicateUpdateMiddleware(BaseMiddleware):
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        update_id = getattr(event, "update_id", None)
+        if update_id is not None and not recent_updates.add(update_id):
+            return None
+        return await handler(event, data)
+
+
+dp.update.outer_middleware(DuplicateUpdateMiddleware())
+
+# Подключаем middleware на все входящие сообщения и коллбэки (ограничение частоты — раньше проверки подписки,
+# чтобы поток нажатий не превращался в поток get_chat_member)
+dp.message.middleware(ThrottlingMiddleware(throttle_buckets))
+dp.callback_query.middleware(ThrottlingMiddleware(throttle_buckets))
 dp.message.middleware(SubscriptionMiddleware())
 dp.callback_query.middleware(SubscriptionMiddleware())
 
@@ -414,6 +641,457 @@ def calc_profit_rub(qty: int) -> float:
     return (store.user_price_per_star_rub - store.cost_per_star_rub) * qty
 
 
+def format_stats(start=None, end=None) -> str:
+    """Текст /stats из готовых агрегатов (без обхода пользователей)."""
+    b = stats_agg.summary(start, end)
+    if start is None:
+        title = "Статистика за всё время"
+    elif start == end:
+        title = f"Статистика за {start.isoformat()}"
+    else:
+        title = f"Статистика за {start.isoformat()} — {end.isoformat()}"
+    dep_cnt = sum(c for c, _ in b["deposits"].values())
+    dep_kop = sum(k for _, k in b["deposits"].values())
+    lines = [
+        title,
+        f"Пополнения: {dep_cnt} шт. на {dep_kop/100:.2f} ₽",
+    ]
+    for method, (cnt, kop) in sorted(b["deposits"].items()):
+        lines.append(f"  {method}: {cnt} шт., {kop/100:.2f} ₽")
+    lines += [
+        f"Продано звёзд: {b['stars']} ⭐",
+        f"Выручка: {b['revenue']/100:.2f} ₽, прибыль: {b['profit']/100:.2f} ₽",
+        f"Заявок подтверждено: {b['approved']}, отклонено: {b['rejected']}, истекло: {b['expired']}",
+    ]
+    if start is not None and start == end:
+        hours = stats_agg.hourly(start)
+        if hours:
+            lines.append("По часам (пополнения ₽ / звёзды):")
+            for hour, hb in hours:
+                lines.append(f"  {hour:02d}:00 — {sum(k for _, k in hb['deposits'].values())/100:.2f} ₽ / {hb['stars']} ⭐")
+    return "\n".join(lines)
+
+
+# ========= Заявки на покупку звёзд: вручную админом или автопокупка через split.tg =========
+
+async def send_order_to_admins(order_id: str, rec: dict, *, note: str = "") -> str | None:
+    """Отправляет заявку в группу админов на ручную покупку.
+    Возвращает текст ошибки для пользователя или None, если сообщение ушло.
+    """
+    admin_group_id = get_admin_group_id()
+    if not admin_group_id:
+        return "Не удалось отправить заявку: группа админов не настроена. Установите ADMIN_GROUP_ID в settings.py."
+    kb = InlineKeyboardBuilder()
+    kb.button(text="✅ Подтвердить", callback_data=f"star_approve:{order_id}")
+    kb.button(text="❌ Отклонить", callback_data=f"star_reject:{order_id}")
+    kb.adjust(2)
+    text = (
+        "Заявка на покупку ⭐ вручную:\n"
+        f"Код: {order_id}\n"
+        f"Пользователь: {rec['username'] if rec['username'].startswith('@') else 'id=' + str(rec['user_id'])}\n"
+        f"Количество: {rec['qty']} ⭐\n"
+        f"К списанию: {rec['price_kopecks']/100:.2f} ₽\n\n"
+        "После оплаты звёзд вручную подтвердите заявку."
+    )
+    if note:
+        text += f"\n\n{note}"
+    try:
+        sent = await bot.send_message(admin_group_id, text, reply_markup=kb.as_markup())
+    except Exception:
+        return "Не удалось отправить сообщение в группу админов. Проверьте, что бот добавлен в группу и может писать."
+    msg_index.add(order_id, admin_group_id, sent.message_id, "admin")
+    return None
+
+
+async def dispatch_star_order(order_id: str) -> tuple[bool, str]:
+    """Отдаёт новую заявку в работу: в очередь автопокупки (AUTO_FULFIL) или админам.
+    Возвращает (ok, текст для пользователя).
+    """
+    rec = pending_orders[order_id]
+    note = ""
+    if fulfilment is not None and not rec["username"].startswith("@"):
+        # split.tg покупает только по @username — без него автопокупка гарантированно не пройдёт
+        note = "Автопокупка невозможна: у пользователя нет @username."
+    elif fulfilment is not None:
+        rec["auto"] = True
+        save_pending_orders()
+        fulfilment.submit(order_id, key=rec["username"].lower(), qty=rec["qty"])
+        return True, (
+            "Заказ принят. Звёзды будут куплены автоматически в течение нескольких минут — с баланса спишется нужная сумма, а вы получите уведомление.\n"
+            f"Код заявки: <code>{order_id}</code>."
+        )
+    err = await send_order_to_admins(order_id, rec, note=note)
+    if err:
+        return False, err
+    return True, (
+        "Заявка отправлена администратору. Как только админ купит звёзды и подтвердит — с баланса спишется нужная сумма, а вы получите уведомление.\n"
+        f"Код заявки: <code>{order_id}</code>."
+    )
+
+
+def order_hold_active(order_id: str) -> bool:
+    """Стоимость заявки зарезервирована (списана) под автопокупку, а итога покупки ещё нет."""
+    return ledger_keys.get(f"hold:{order_id}") == "held"
+
+
+def hold_order_funds(order_id: str, rec: dict) -> None:
+    """Резервирует стоимость заявки перед автопокупкой (только в памяти — сохраняет вызывающий).
+    Ключ hold:<id> лежит в balances.json вместе с балансом, поэтому резерв и отметка «покупка начата»
+    пишутся на диск одной записью.
+    """
+    ledger_keys.mark(f"hold:{order_id}", "held")
+    rub_balance[rec["user_id"]] = rub_balance.get(rec["user_id"], 0) - rec["price_kopecks"]
+
+
+def release_order_hold(order_id: str, rec: dict) -> bool:
+    """Возвращает резерв заявки на баланс (покупка не состоялась / заявка отклонена). Без сохранения."""
+    if not order_hold_active(order_id):
+        return False
+    ledger_keys.mark(f"hold:{order_id}", "released")
+    rub_balance[rec["user_id"]] = rub_balance.get(rec["user_id"], 0) + rec["price_kopecks"]
+    return True
+
+
+def complete_star_order(order_id: str, rec: dict, *, allow_negative: bool = False, save: bool = True) -> bool:
+    """Списывает стоимость заявки с баланса, учитывает звёзды в статистике и закрывает заявку.
+    Без allow_negative не списывает, если средств не хватает (возвращает False).
+    Если под заявку уже есть резерв (автопокупка), он засчитывается вместо повторного списания.
+    save=False — только в памяти (пакетная обработка сохраняет файлы один раз в конце).
+    """
+    user_id = rec["user_id"]
+    price_kopecks = rec["price_kopecks"]
+    if ledger_keys.get(f"order:{order_id}"):
+        # по этой заявке уже было решение — второй раз не списываем
+        pending_orders.pop(order_id, None)
+        return False
+    held = order_hold_active(order_id)
+    if not held and not allow_negative and rub_balance.get(user_id, 0) < price_kopecks:
+        return False
+    ledger_keys.mark(f"order:{order_id}", "approved")
+    if held:
+        ledger_keys.mark(f"hold:{order_id}", "captured")
+    else:
+        rub_balance[user_id] = rub_balance.get(user_id, 0) - price_kopecks
+    total_stars[user_id] = total_stars.get(user_id, 0) + rec["qty"]
+    stars_rank.update(user_id, total_stars[user_id])
+    stats_agg.record_order(rec["qty"], price_kopecks, round(calc_profit_rub(rec["qty"]) * 100))
+    pending_orders.pop(order_id, None)
+    if save:
+        save_balances()
+        save_stats()
+        save_pending_orders()
+    return True
+
+
+def credit_sbp_topup(sbp_id: str, rec: dict, *, save: bool = True) -> int:
+    """Зачисляет пополнение по СБП и закрывает заявку. Возвращает сумму в ₽ (0 — сумма некорректна, ничего не изменено)."""
+    # Всегда берём актуальную (возможно отредактированную) сумму из заявки
+    try:
+        amt_rub = int(str(rec.get("amount_rub", 0)).strip())
+    except Exception:
+        amt_rub = 0
+    if amt_rub <= 0 or ledger_keys.get(f"sbp:{sbp_id}"):
+        return 0
+    user_id = rec.get("user_id")
+    pending_sbp.pop(sbp_id, None)
+    ledger_keys.mark(f"sbp:{sbp_id}", "approved")
+    rub_balance[user_id] = rub_balance.get(user_id, 0) + amt_rub * 100
+    # обновляем статистику суммарных пополнений
+    total_deposits[user_id] = total_deposits.get(user_id, 0) + amt_rub * 100
+    deposits_rank.update(user_id, total_deposits[user_id])
+    stats_agg.record_deposit("SBP", amt_rub * 100)
+    if save:
+        save_pending_sbp()
+        save_balances()
+        save_stats()
+    return amt_rub
+
+
+async def announce_status(item_id: str, user_id: int | None, user_text: str, *, admin_text: str | None = None,
+                          user_markup=None, skip: tuple[int, int] | None = None, final: bool = True) -> bool:
+    """Сообщает о смене статуса заявки, правя уже отправленные сообщения о ней (msg_index) на месте.
+    admin_text — новый текст копий в группе админов (кнопки убираются); None — копии не трогаем.
+    skip — (chat_id, message_id) сообщения, которое вызывающий правит сам (нажатая кнопка).
+    Если сообщения пользователю в индексе нет или его уже нельзя править — отправляет новое.
+    final=False — заявка ещё жива, её сообщения остаются в индексе.
+    Возвращает True, если пользователь получил текст.
+    """
+    locs = msg_index.pop(item_id) if final else msg_index.get(item_id)
+    user_done = False
+    for chat_id, message_id, role in locs:
+        if (chat_id, message_id) == skip:
+            continue
+        if role == "admin":
+            if admin_text is None:
+                continue
+            text, markup = admin_text, None
+        else:
+            text, markup = user_text, user_markup
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=markup)
+            user_done = user_done or role == "user"
+        except TelegramRetryAfter:
+            raise
+        except TelegramBadRequest as e:
+            # «message is not modified» — текст уже такой, остальное (удалено, старше 48 ч) — шлём заново
+            user_done = user_done or (role == "user" and "not modified" in str(e))
+        except Exception:
+            pass
+    if user_done or not user_id:
+        return user_done
+    try:
+        await bot.send_message(user_id, user_text, reply_markup=user_markup)
+        return True
+    except TelegramRetryAfter:
+        raise
+    except Exception:
+        return False
+
+
+# --- Пакетная обработка заявок (/approve_all, /approve) ---
+# Сколько уведомлений пользователям отправлять одновременно (лимит Telegram — ~30 сообщений в секунду)
+BULK_NOTIFY_CONCURRENCY = int(getattr(settings, "BULK_NOTIFY_CONCURRENCY", 20))
+
+
+async def notify_many(messages: list[tuple[str, int, str, str]]) -> tuple[int, int]:
+    """Сообщает о новых статусах [(id заявки, user_id, текст пользователю, текст админам)] параллельно
+    с ограничением (через announce_status — правкой уже отправленных сообщений).
+    Возвращает (доставлено пользователям, не доставлено).
+    """
+    sem = asyncio.Semaphore(max(1, BULK_NOTIFY_CONCURRENCY))
+
+    async def _one(item_id: str, user_id: int, user_text: str, admin_text: str) -> bool:
+        async with sem:
+            for _ in range(3):
+                try:
+                    return await announce_status(item_id, user_id, user_text, admin_text=admin_text)
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except Exception:
+                    return False
+            return False
+
+    results = await asyncio.gather(*(_one(*msg) for msg in messages))
+    sent = sum(1 for r in results if r)
+    return sent, len(results) - sent
+
+
+async def bulk_process(items: list[tuple[str, str]], approve: bool) -> str:
+    """Подтверждает/отклоняет пачку заявок: ("order" | "sbp", id).
+    Все изменения применяются в памяти, файлы пишутся один раз, уведомления уходят параллельно.
+    Возвращает отчёт для админа.
+    """
+    t0 = time.monotonic()
+    done = 0
+    skipped: list[str] = []
+    messages: list[tuple[str, int, str, str]] = []
+    dirty_orders = dirty_sbp = dirty_ledger = False
+    for kind, item_id in items:
+        if ledger_keys.get(f"{kind}:{item_id}"):
+            skipped.append(f"{item_id}: уже обработана")
+            continue
+        if kind == "order":
+            rec = pending_orders.get(item_id)
+            if not rec:
+                skipped.append(f"{item_id}: не найдена")
+                continue
+            if approve:
+                if not complete_star_order(item_id, rec, save=False):
+                    skipped.append(f"{item_id}: недостаточно средств")
+                    continue
+                messages.append((item_id, rec["user_id"], (
+                    f"Администратор подтвердил покупку {rec['qty']} ⭐ для {rec['username']}. "
+                    f"Списано {rec['price_kopecks']/100:.2f} ₽. Спасибо!"
+                ), f"✅ Заявка {item_id}: покупка {rec['qty']} ⭐ для {rec['username']} подтверждена, списано {rec['price_kopecks']/100:.2f} ₽."))
+            else:
+                pending_orders.pop(item_id, None)
+                release_order_hold(item_id, rec)
+                ledger_keys.mark(f"order:{item_id}", "rejected")
+                stats_agg.record_rejected()
+                messages.append((item_id, rec["user_id"], f"Заявка на покупку {rec['qty']} ⭐ отклонена администратором. Средства не списаны.",
+                                 f"❌ Заявка {item_id} на {rec['qty']} ⭐ для {rec['username']} отклонена."))
+            dirty_orders = dirty_ledger = True
+        else:
+            rec = pending_sbp.get(item_id)
+            if not rec:
+                skipped.append(f"{item_id}: не найдена")
+                continue
+            if approve:
+                amt_rub = credit_sbp_topup(item_id, rec, save=False)
+                if not amt_rub:
+                    skipped.append(f"{item_id}: некорректная сумма")
+                    continue
+                dirty_ledger = True
+                messages.append((item_id, rec["user_id"], f"Оплата по Карте РФ подтверждена. Баланс пополнен на {amt_rub} ₽.",
+                                 f"✅ Заявка СБП {item_id}: баланс пользователя {rec['user_id']} пополнен на {amt_rub} ₽."))
+            else:
+                pending_sbp.pop(item_id, None)
+                ledger_keys.mark(f"sbp:{item_id}", "rejected")
+                dirty_ledger = True
+                messages.append((item_id, rec["user_id"], (
+                    "Оплата по Карте РФ не подтверждена. Если вы перевели средства, ответьте в чат с квитанцией, и мы проверим повторно."),
+                    f"❌ Заявка СБП {item_id} на {rec.get('amount_rub', 0)} ₽ (id={rec['user_id']}) отклонена."))
+            dirty_sbp = True
+        done += 1
+    # одна запись каждого файла на всю пачку
+    if dirty_ledger:
+        save_balances()
+        save_stats()
+    if dirty_orders:
+        save_pending_orders()
+    if dirty_sbp:
+        save_pending_sbp()
+    persisted_ms = (time.monotonic() - t0) * 1000
+    sent, failed = await notify_many(messages)
+    total_ms = (time.monotonic() - t0) * 1000
+    lines = [
+        f"{'Подтверждено' if approve else 'Отклонено'}: {done} из {len(items)}",
+        f"Уведомлений отправлено: {sent}" + (f", не доставлено: {failed}" if failed else ""),
+        f"Время: {total_ms:.0f} мс (запись файлов — {persisted_ms:.0f} мс)",
+    ]
+    if skipped:
+        lines.append("Пропущено:")
+        lines += [f"  {s}" for s in skipped[:20]]
+        if len(skipped) > 20:
+            lines.append(f"  … и ещё {len(skipped) - 20}")
+    return "\n".join(lines)
+
+
+# --- Автопокупка ---
+# Браузер живёт в отдельном процессе (split_worker.py): Playwright не грузится в бота,
+# а падение/зависание Chromium не задевает обработку апдейтов.
+split_client: SplitWorker | None = None
+
+
+def get_split_client() -> SplitWorker:
+    global split_client
+    if split_client is None:
+        split_client = SplitWorker(
+            max_jobs=getattr(settings, "SPLIT_WORKER_MAX_JOBS", 50),
+            timeout=getattr(settings, "SPLIT_WORKER_TIMEOUT", 600),
+        )
+    return split_client
+
+
+async def _auto_buy(order_ids: list[str]) -> str:
+    """Одна покупка на пачку заявок одного получателя: суммарное количество одним заказом split.tg."""
+    recs = {o: pending_orders[o] for o in order_ids if o in pending_orders and not ledger_keys.get(f"order:{o}")}
+    if not recs:
+        raise RuntimeError("заявка уже обработана")
+    # средств должно хватить на все заявки пользователя в пачке сразу
+    need: dict[int, int] = {}
+    for rec in recs.values():
+        need[rec["user_id"]] = need.get(rec["user_id"], 0) + rec["price_kopecks"]
+    if any(rub_balance.get(uid, 0) < amount for uid, amount in need.items()):
+        raise RuntimeError("недостаточно средств на балансе пользователя")
+    # резервируем до покупки: параллельная пачка того же пользователя увидит уже уменьшенный баланс,
+    # а после падения процесса посреди покупки заявку не купят второй раз (см. on_startup)
+    for order_id, rec in recs.items():
+        hold_order_funds(order_id, rec)
+    save_balances()
+    first = next(iter(recs.values()))
+    return await get_split_client().buy_stars(first["username"], sum(rec["qty"] for rec in recs.values()))
+
+
+async def _auto_buy_done(order_id: str, split_order_id: str, batch_size: int = 1) -> None:
+    rec = pending_orders.get(order_id)
+    if not rec:
+        return
+    # звёзды уже куплены — засчитываем резерв (без резерва списываем, даже если баланс успел уменьшиться,
+    # и предупреждаем админов)
+    if not complete_star_order(order_id, rec, allow_negative=True):
+        # по заявке уже было решение (повторный колбэк) — второй раз не списываем и не уведомляем
+        return
+    user_id = rec["user_id"]
+    kb_user = InlineKeyboardBuilder()
+    kb_user.button(text="⬅️ В меню", callback_data="menu")
+    kb_user.adjust(1)
+    try:
+        await announce_status(
+            order_id, user_id,
+            (
+                f"Готово! Куплено {rec['qty']} ⭐ для {rec['username']}. "
+                f"Списано {rec['price_kopecks']/100:.2f} ₽. Спасибо!"
+            ),
+            user_markup=kb_user.as_markup(),
+        )
+    except Exception:
+        pass
+    admin_group_id = get_admin_group_id()
+    if admin_group_id:
+        note = ""
+        if rub_balance.get(user_id, 0) < 0:
+            note = f"\n⚠️ Баланс пользователя ушёл в минус: {rub_balance[user_id]/100:.2f} ₽"
+        try:
+            await bot.send_message(
+                admin_group_id,
+                f"Автопокупка: {rec['qty']} ⭐ для {rec['username']}, код {order_id}, заказ split.tg {split_order_id}"
+                + (f" (одной покупкой с ещё {batch_size - 1} заявк.)" if batch_size > 1 else "")
+                + f".{note}",
+                disable_notification=not note,
+            )
+        except Exception:
+            pass
+
+
+async def _auto_buy_failed(order_id: str, reason: str, payment_link: str | None, batch: list[str] | None = None,
+                           error: Exception | None = None) -> None:
+    rec = pending_orders.get(order_id)
+    if not rec:
+        return
+    rec.pop("auto", None)
+    unsure = isinstance(error, OutcomeUnknown) and order_hold_active(order_id)
+    if unsure:
+        # воркер умер посреди покупки: звёзды могли уйти — резерв держим, пока не решит админ
+        rec["unsure"] = True
+    elif release_order_hold(order_id, rec):
+        save_balances()
+    save_pending_orders()
+    note = f"⚠️ Автопокупка не удалась: {reason}"
+    if unsure:
+        note = f"⚠️ Итог автопокупки неизвестен: {reason}. " + INTERRUPTED_BUY_NOTE
+    batch = [o for o in (batch or [order_id]) if o in pending_orders]
+    if payment_link and len(batch) > 1:
+        # счёт выписан на всю пачку — ссылка идёт один раз, в заявке, которая в пачке первая
+        if order_id == batch[0]:
+            total = sum(pending_orders[o]["qty"] for o in batch)
+            note += (
+                f"\nСсылка на оплату split.tg — одним счётом на {total} ⭐ по заявкам {', '.join(batch)}: {payment_link}"
+                "\nОплатите её один раз и подтвердите каждую из этих заявок."
+            )
+        else:
+            note += f"\nСчёт split.tg выписан на всю пачку — ссылка в заявке {batch[0]}. Отдельно эту заявку не покупайте."
+    elif payment_link:
+        note += f"\nСсылка на оплату split.tg: {payment_link}"
+    await send_order_to_admins(order_id, rec, note=note)
+    try:
+        await announce_status(
+            order_id, rec["user_id"],
+            (
+                f"Автоматическая покупка по заявке {order_id} прервалась — заявка передана администратору на проверку. "
+                "Сумма заявки зарезервирована: если покупка не прошла, она вернётся на баланс."
+                if unsure else
+                f"Автоматическая покупка по заявке {order_id} не прошла — заявка передана администратору. Средства пока не списаны."
+            ),
+            final=False,
+        )
+    except Exception:
+        pass
+
+
+# Очередь автопокупки (None — как раньше, все заявки обрабатывают админы вручную)
+fulfilment: FulfilmentQueue | None = None
+if getattr(settings, "AUTO_FULFIL", False):
+    fulfilment = FulfilmentQueue(
+        _auto_buy,
+        on_success=_auto_buy_done,
+        on_failure=_auto_buy_failed,
+        workers=getattr(settings, "AUTO_FULFIL_WORKERS", 1),
+        coalesce_sec=getattr(settings, "AUTO_FULFIL_COALESCE_SEC", 0),
+        max_qty=1_000_000,
+    )
+
+
 # ========= Команды =========
 
 @dp.message(Command("start"))
@@ -564,6 +1242,61 @@ def _payment_instructions_text(method: str, amt_rub: int) -> str:
         return f"Сумма к оплате: {amt_rub} ₽\nПерейдите: {settings.CRYPTO_USDT_LINK}"
     return "Инструкции недоступны"
 
+async def _create_crypto_invoice(message: Message, user_id: int, amt_rub: int, asset: str) -> None:
+    """Фоновая задача: создаёт счёт Crypto Pay и показывает его в message."""
+    payload = {
+        "type": "topup",
+        "user_id": user_id,
+        "topup_id": str(uuid.uuid4()),
+        "amount_rub": amt_rub,
+    }
+    body = {
+        "currency_type": "fiat",
+        "fiat": "RUB",
+        "amount": str(amt_rub),
+        "accepted_assets": asset,
+        "description": f"Пополнение {amt_rub} ₽ для user {user_id}",
+        "payload": json.dumps(payload),
+        "allow_anonymous": True,
+        "allow_comments": False,
+        "expires_in": 1800,
+    }
+    headers = {
+        "Crypto-Pay-API-Token": settings.CRYPTOPAY_API_TOKEN,
+        "Content-Type": "application/json",
+    }
+    try:
+        async with httpx.AsyncClient(timeout=20) as client:
+            r = await client.post(f"{settings.CRYPTOPAY_API_URL}/createInvoice", headers=headers, json=body)
+            r.raise_for_status()
+            data = r.json()
+        if not data.get("ok"):
+            await message.edit_text(f"Ошибка Crypto Pay: {data.get('error','unknown')}")
+            return
+        inv = data.get("result", {})
+        url = inv.get("mini_app_invoice_url") or inv.get("bot_invoice_url") or inv.get("pay_url")
+        if not url or not isinstance(url, str) or not url.startswith("http"):
+            await message.edit_text("Crypto Pay вернул счёт без корректной ссылки для оплаты. Попробуйте позже.")
+            return
+        invoice_id = inv.get("invoice_id")
+        pending_topups[user_id] = {"topup_id": payload["topup_id"], "amount_rub": amt_rub, "invoice_id": invoice_id, "method": asset}
+        kb = InlineKeyboardBuilder()
+        # ВАЖНО: bot_invoice_url — это t.me deep link для mini-app; его нужно передавать как обычный URL-кнопки,
+        # а не как web_app, иначе Telegram вернёт BUTTON_URL_INVALID
+        kb.button(text="Оплатить в Crypto Bot (mini-app)", url=url)
+        kb.button(text="Проверить оплату", callback_data="check_crypto")
+        kb.button(text="⬅️ Назад", callback_data="balance")
+        kb.adjust(1)
+        await message.edit_text(
+            f"Выставлен счёт в Crypto Bot на {amt_rub} ₽ (актив: {asset}). Откроется мини‑апп CryptoBot.",
+            reply_markup=kb.as_markup(),
+        )
+        return
+    except Exception as e:
+        await message.edit_text(f"Не удалось создать счёт в Crypto Pay: {e}")
+        return
+
+
 @dp.callback_query(F.data.in_({"pay_sbp", "pay_ton", "pay_usdt"}))
 async def cb_pay_method(cq: CallbackQuery):
     await cq.answer()
@@ -593,57 +1326,13 @@ async def cb_pay_method(cq: CallbackQuery):
     # TON / USDT — создаём инвойс в Crypto Pay на RUB (fiat) с ограничением на актив
     if method in {"ton", "usdt"}:
         asset = "TON" if method == "ton" else "USDT"
-        payload = {
-            "type": "topup",
-            "user_id": cq.from_user.id,
-            "topup_id": str(uuid.uuid4()),
-            "amount_rub": amt_rub,
-        }
-        body = {
-            "currency_type": "fiat",
-            "fiat": "RUB",
-            "amount": str(amt_rub),
-            "accepted_assets": asset,
-            "description": f"Пополнение {amt_rub} ₽ для user {cq.from_user.id}",
-            "payload": json.dumps(payload),
-            "allow_anonymous": True,
-            "allow_comments": False,
-            "expires_in": 1800,
-        }
-        headers = {
-            "Crypto-Pay-API-Token": settings.CRYPTOPAY_API_TOKEN,
-            "Content-Type": "application/json",
-        }
-        try:
-            async with httpx.AsyncClient(timeout=20) as client:
-                r = await client.post(f"{settings.CRYPTOPAY_API_URL}/createInvoice", headers=headers, json=body)
-                r.raise_for_status()
-                data = r.json()
-            if not data.get("ok"):
-                await cq.message.edit_text(f"Ошибка Crypto Pay: {data.get('error','unknown')}")
-                return
-            inv = data.get("result", {})
-            url = inv.get("mini_app_invoice_url") or inv.get("bot_invoice_url") or inv.get("pay_url")
-            if not url or not isinstance(url, str) or not url.startswith("http"):
-                await cq.message.edit_text("Crypto Pay вернул счёт без корректной ссылки для оплаты. Попробуйте позже.")
-                return
-            invoice_id = inv.get("invoice_id")
-            pending_topups[cq.from_user.id] = {"topup_id": payload["topup_id"], "amount_rub": amt_rub, "invoice_id": invoice_id}
-            kb = InlineKeyboardBuilder()
-            # ВАЖНО: bot_invoice_url — это t.me deep link для mini-app; его нужно передавать как обычный URL-кнопки,
-            # а не как web_app, иначе Telegram вернёт BUTTON_URL_INVALID
-            kb.button(text="Оплатить в Crypto Bot (mini-app)", url=url)
-            kb.button(text="Проверить оплату", callback_data="check_crypto")
-            kb.button(text="⬅️ Назад", callback_data="balance")
-            kb.adjust(1)
-            await cq.message.edit_text(
-                f"Выставлен счёт в Crypto Bot на {amt_rub} ₽ (актив: {asset}). Откроется мини‑апп CryptoBot.",
-                reply_markup=kb.as_markup(),
-            )
-            return
-        except Exception as e:
-            await cq.message.edit_text(f"Не удалось создать счёт в Crypto Pay: {e}")
+        key = (cq.from_user.id, "crypto_invoice")
+        if jobs.busy(key):
             return
+        # отвечаем сразу, запрос к Crypto Pay (до 20 с) идёт в фоне и сам правит сообщение
+        await cq.message.edit_text(f"⏳ Создаём счёт в Crypto Bot на {amt_rub} ₽…")
+        jobs.submit(key, _create_crypto_invoice, cq.message, cq.from_user.id, amt_rub, asset)
+        return
 
     # СБП — показываем инструкцию (без API), зачисление по кнопке «Я оплатил»
     kb = InlineKeyboardBuilder()
@@ -683,7 +1372,7 @@ async def cb_sbp_paid(cq: CallbackQuery):
     kb.button(text="✏️ Изменить сумму", callback_data=f"sbp_change:{sbp_id}")
     kb.adjust(2, 1)
     try:
-        await bot.send_message(
+        sent = await bot.send_message(
             admin_group_id,
             (
                 "Заявка на пополнение по Карте РФ:\n"
@@ -694,6 +1383,7 @@ async def cb_sbp_paid(cq: CallbackQuery):
             ),
             reply_markup=kb.as_markup(),
         )
+        msg_index.add(sbp_id, admin_group_id, sent.message_id, "admin")
     except Exception:
         try:
             await cq.message.answer("Не удалось отправить сообщение в группу админов. Проверьте, что бот добавлен в группу и имеет право писать.")
@@ -707,6 +1397,7 @@ async def cb_sbp_paid(cq: CallbackQuery):
         ),
         parse_mode="HTML",
     )
+    msg_index.add(sbp_id, cq.message.chat.id, cq.message.message_id, "user")
     # Сразу отправляем главное меню отдельным сообщением
     await bot.send_message(cq.from_user.id, make_welcome_text_for(cq), reply_markup=make_main_menu_kb(cq.from_user.id))
 # --- Новый обработчик: админ меняет сумму для СБП ---
@@ -766,14 +1457,23 @@ async def cb_sbp_back(cq: CallbackQuery):
     )
 
 
+# итог операции по заявке -> ответ на повторное нажатие
+DECIDED_TEXT = {"approved": "Заявка уже подтверждена.", "rejected": "Заявка уже отклонена."}
+
+
 # --- Новый обработчик: админ подтверждает оплату по СБП ---
 @dp.callback_query(F.data.startswith("sbp_approve:"))
 async def cb_sbp_approve(cq: CallbackQuery):
+    sbp_id = cq.data.split(":", 1)[1]
+    # повторное нажатие / повторная доставка — отвечаем сразу, без перечитывания файлов
+    decided = ledger_keys.get(f"sbp:{sbp_id}")
+    if decided:
+        await cq.answer(DECIDED_TEXT.get(decided, "Заявка уже обработана."))
+        return
     await cq.answer()
     if cq.from_user.id not in get_admin_ids():
         await cq.message.edit_text("Недостаточно прав.")
         return
-    sbp_id = cq.data.split(":", 1)[1]
     # Сначала пробуем найти в памяти; при отсутствии — подгружаем из файла
     rec = pending_sbp.get(sbp_id)
     if not rec:
@@ -785,32 +1485,21 @@ async def cb_sbp_approve(cq: CallbackQuery):
     if not rec:
         await cq.message.edit_text("Заявка уже обработана или не найдена.")
         return
-    # Теперь безопасно удаляем и сохраняем
-    pending_sbp.pop(sbp_id, None)
-    save_pending_sbp()
     user_id = rec.get("user_id")
-    # Всегда берём актуальную (возможно отредактированную) сумму из заявки
-    try:
-        amt_rub = int(str(rec.get("amount_rub", 0)).strip())
-    except Exception:
-        amt_rub = 0
-    if amt_rub <= 0:
+    # заявка закрывается только вместе с зачислением — с некорректной суммой она остаётся в очереди
+    amt_rub = credit_sbp_topup(sbp_id, rec)
+    if not amt_rub:
         await cq.message.edit_text("Ошибка: сумма пополнения некорректна. Отредактируйте сумму перед подтверждением.")
         return
-    rub_balance[user_id] = rub_balance.get(user_id, 0) + amt_rub * 100
-    save_balances()
-    # обновляем статистику суммарных пополнений
-    total_deposits[user_id] = total_deposits.get(user_id, 0) + amt_rub * 100
-    save_stats()
-    # Сообщаем пользователю и админу
+    # Сообщаем пользователю и правим остальные копии заявки у админов
+    kb_user = InlineKeyboardBuilder()
+    kb_user.button(text="⬅️ В меню", callback_data="menu")
+    kb_user.adjust(1)
     try:
-        kb_user = InlineKeyboardBuilder()
-        kb_user.button(text="⬅️ В меню", callback_data="menu")
-        kb_user.adjust(1)
-        await bot.send_message(
-            user_id,
-            f"Оплата по Карте РФ подтверждена. Баланс пополнен на {amt_rub} ₽.",
-            reply_markup=kb_user.as_markup(),
+        await announce_status(
+            sbp_id, user_id, f"Оплата по Карте РФ подтверждена. Баланс пополнен на {amt_rub} ₽.",
+            admin_text=f"✅ Заявка СБП {sbp_id}: баланс пользователя {user_id} пополнен на {amt_rub} ₽.",
+            user_markup=kb_user.as_markup(), skip=(cq.message.chat.id, cq.message.message_id),
         )
     except Exception:
         pass
@@ -826,11 +1515,16 @@ async def cb_sbp_approve(cq: CallbackQuery):
 # --- Новый обработчик: админ отклоняет оплату по СБП ---
 @dp.callback_query(F.data.startswith("sbp_reject:"))
 async def cb_sbp_reject(cq: CallbackQuery):
+    sbp_id = cq.data.split(":", 1)[1]
+    # повторное нажатие / повторная доставка — отвечаем сразу, без перечитывания файлов
+    decided = ledger_keys.get(f"sbp:{sbp_id}")
+    if decided:
+        await cq.answer(DECIDED_TEXT.get(decided, "Заявка уже обработана."))
+        return
     await cq.answer()
     if cq.from_user.id not in get_admin_ids():
         await cq.message.edit_text("Недостаточно прав.")
         return
-    sbp_id = cq.data.split(":", 1)[1]
     rec = pending_sbp.get(sbp_id)
     if not rec:
         try:
@@ -843,12 +1537,18 @@ async def cb_sbp_reject(cq: CallbackQuery):
         return
     pending_sbp.pop(sbp_id, None)
     save_pending_sbp()
+    ledger_keys.mark(f"sbp:{sbp_id}", "rejected")
+    save_balances()
     user_id = rec.get("user_id")
     amt_rub = int(rec.get("amount_rub", 0))
     # Уведомляем пользователя об отказе
     try:
-        await bot.send_message(user_id, (
-            "Оплата по Карте РФ не подтверждена. Если вы перевели средства, ответьте в чат с квитанцией, и мы проверим повторно."))
+        await announce_status(
+            sbp_id, user_id,
+            "Оплата по Карте РФ не подтверждена. Если вы перевели средства, ответьте в чат с квитанцией, и мы проверим повторно.",
+            admin_text=f"❌ Заявка СБП {sbp_id} на {amt_rub} ₽ (id={user_id}) отклонена.",
+            skip=(cq.message.chat.id, cq.message.message_id),
+        )
     except Exception:
         pass
     kb = InlineKeyboardBuilder()
@@ -860,11 +1560,16 @@ async def cb_sbp_reject(cq: CallbackQuery):
  # --- Новый обработчик: админ подтверждает заявку на покупку звёзд ---
 @dp.callback_query(F.data.startswith("star_approve:"))
 async def cb_star_approve(cq: CallbackQuery):
+    order_id = cq.data.split(":", 1)[1]
+    # повторное нажатие / повторная доставка — отвечаем сразу, без перечитывания файлов
+    decided = ledger_keys.get(f"order:{order_id}")
+    if decided:
+        await cq.answer(DECIDED_TEXT.get(decided, "Заявка уже обработана."))
+        return
     await cq.answer()
     if cq.from_user.id not in get_admin_ids():
         await cq.message.edit_text("Недостаточно прав.")
         return
-    order_id = cq.data.split(":", 1)[1]
     rec = pending_orders.get(order_id)
     if not rec:
         try:
@@ -879,28 +1584,22 @@ async def cb_star_approve(cq: CallbackQuery):
     qty = rec["qty"]
     price_kopecks = rec["price_kopecks"]
     username = rec["username"]
-    # повторная проверка наличия средств на момент подтверждения
-    if rub_balance.get(user_id, 0) < price_kopecks:
+    # списание (с повторной проверкой наличия средств на момент подтверждения) и уведомления
+    if not complete_star_order(order_id, rec):
         await cq.message.edit_text("Недостаточно средств на балансе пользователя для списания. Попросите пополнить баланс.")
         return
-    # списание и уведомления
-    rub_balance[user_id] = rub_balance.get(user_id, 0) - price_kopecks
-    save_balances()
-    total_stars[user_id] = total_stars.get(user_id, 0) + qty
-    save_stats()
-    pending_orders.pop(order_id, None)
-    save_pending_orders()
+    kb_user = InlineKeyboardBuilder()
+    kb_user.button(text="⬅️ В меню", callback_data="menu")
+    kb_user.adjust(1)
     try:
-        kb_user = InlineKeyboardBuilder()
-        kb_user.button(text="⬅️ В меню", callback_data="menu")
-        kb_user.adjust(1)
-        await bot.send_message(
-            user_id,
+        await announce_status(
+            order_id, user_id,
             (
                 f"Администратор подтвердил покупку {qty} ⭐ для {username}. "
                 f"Списано {price_kopecks/100:.2f} ₽. Спасибо!"
             ),
-            reply_markup=kb_user.as_markup(),
+            admin_text=f"✅ Заявка {order_id}: покупка {qty} ⭐ для {username} подтверждена, списано {price_kopecks/100:.2f} ₽.",
+            user_markup=kb_user.as_markup(), skip=(cq.message.chat.id, cq.message.message_id),
         )
     except Exception:
         pass
@@ -915,11 +1614,16 @@ async def cb_star_approve(cq: CallbackQuery):
 # --- Новый обработчик: админ отклоняет заявку на покупку звёзд ---
 @dp.callback_query(F.data.startswith("star_reject:"))
 async def cb_star_reject(cq: CallbackQuery):
+    order_id = cq.data.split(":", 1)[1]
+    # повторное нажатие / повторная доставка — отвечаем сразу, без перечитывания файлов
+    decided = ledger_keys.get(f"order:{order_id}")
+    if decided:
+        await cq.answer(DECIDED_TEXT.get(decided, "Заявка уже обработана."))
+        return
     await cq.answer()
     if cq.from_user.id not in get_admin_ids():
         await cq.message.edit_text("Недостаточно прав.")
         return
-    order_id = cq.data.split(":", 1)[1]
     rec = pending_orders.get(order_id)
     if not rec:
         try:
@@ -932,12 +1636,20 @@ async def cb_star_reject(cq: CallbackQuery):
         return
     pending_orders.pop(order_id, None)
     save_pending_orders()
+    release_order_hold(order_id, rec)
+    ledger_keys.mark(f"order:{order_id}", "rejected")
+    save_balances()
+    stats_agg.record_rejected()
+    save_stats()
     user_id = rec["user_id"]
     qty = rec["qty"]
     price_kopecks = rec["price_kopecks"]
     try:
-        await bot.send_message(user_id, (
-            f"Заявка на покупку {qty} ⭐ отклонена администратором. Средства не списаны."))
+        await announce_status(
+            order_id, user_id, f"Заявка на покупку {qty} ⭐ отклонена администратором. Средства не списаны.",
+            admin_text=f"❌ Заявка {order_id} на {qty} ⭐ для {rec['username']} отклонена.",
+            skip=(cq.message.chat.id, cq.message.message_id),
+        )
     except Exception:
         pass
     kb = InlineKeyboardBuilder()
@@ -946,12 +1658,180 @@ async def cb_star_reject(cq: CallbackQuery):
     await cq.message.edit_text("Заявка отклонена.", reply_markup=kb.as_markup())
 
 
-@dp.callback_query(F.data == "check_crypto")
-async def cb_check_crypto(cq: CallbackQuery):
+# --- Просмотр очередей заявок админом: /queue [orders|sbp] [15m|1h|24h] [user_id] ---
+QUEUE_PAGE_SIZE = 10
+# фильтр «старше чем»: метка -> секунды
+QUEUE_AGES = {"0": 0, "15m": 900, "1h": 3600, "24h": 86400}
+QUEUE_KINDS = {"a": "все", "o": "звёзды", "s": "СБП"}
+
+
+def _age_text(sec: float) -> str:
+    sec = int(max(0, sec))
+    if sec < 3600:
+        return f"{sec // 60} мин"
+    if sec < 86400:
+        return f"{sec // 3600} ч {sec % 3600 // 60} мин"
+    return f"{sec // 86400} д {sec % 86400 // 3600} ч"
+
+
+def render_queue(kind: str = "a", age: str = "0", user_id: int = 0, after: tuple[float, str] | None = None):
+    """Страница очереди после курсора after: (текст, клавиатура)."""
+    sources = []
+    if kind in ("a", "o"):
+        sources.append(("o", pending_orders))
+    if kind in ("a", "s"):
+        sources.append(("s", pending_sbp))
+    now = time.time()
+    filters = {"user_id": user_id or None, "until": now - QUEUE_AGES[age] if QUEUE_AGES[age] else None}
+    total = sum(idx.count(**filters) for _, idx in sources)
+    # на один элемент больше — чтобы понять, есть ли следующая страница
+    rows = merged_page(sources, after, QUEUE_PAGE_SIZE + 1, **filters)
+    has_more = len(rows) > QUEUE_PAGE_SIZE
+    rows = rows[:QUEUE_PAGE_SIZE]
+
+    title = f"Очередь заявок ({QUEUE_KINDS[kind]}"
+    if QUEUE_AGES[age]:
+        title += f", старше {age}"
+    if user_id:
+        title += f", пользователь {user_id}"
+    lines = [f"{title}): {total}"]
+    if not rows:
+        lines.append("Пусто." if after is None else "Больше заявок нет.")
+    for ts, item_id, k in rows:
+        if k == "o":
+            rec = pending_orders[item_id]
+            what = f"⭐ {rec['qty']} для {rec['username']} · {rec['price_kopecks']/100:.2f} ₽" + (" · авто" if rec.get("auto") else "")
+        else:
+            rec = pending_sbp[item_id]
+            what = f"💳 СБП {rec.get('amount_rub', 0)} ₽"
+        lines.append(f"<code>{item_id}</code> · {_age_text(now - ts)} · id={rec.get('user_id')} · {what}")
+
+    kb = InlineKeyboardBuilder()
+    for k, label in QUEUE_KINDS.items():
+        kb.button(text=("• " if k == kind else "") + label, callback_data=f"q:{k}:{age}:{user_id}:-")
+    for a in QUEUE_AGES:
+        kb.button(text=("• " if a == age else "") + ("любые" if a == "0" else f">{a}"), callback_data=f"q:{kind}:{a}:{user_id}:-")
+    nav = 0
+    if after is not None:
+        kb.button(text="⏮ В начало", callback_data=f"q:{kind}:{age}:{user_id}:-")
+        nav += 1
+    if has_more:
+        # курсор — (время в мс, id) последней показанной заявки
+        ts, item_id, _ = rows[-1]
+        kb.button(text="Дальше ▶", callback_data=f"q:{kind}:{age}:{user_id}:{round(ts * 1000)}:{item_id}")
+        nav += 1
+    kb.adjust(len(QUEUE_KINDS), len(QUEUE_AGES), *([nav] if nav else []))
+    return "\n".join(lines), kb.as_markup()
+
+
+@dp.callback_query(F.data.startswith("q:"))
+async def cb_queue_page(cq: CallbackQuery):
+    if cq.from_user.id not in get_admin_ids():
+        await cq.answer("Недостаточно прав.")
+        return
+    parts = cq.data.split(":", 5)
+    try:
+        kind, age, user_id = parts[1], parts[2], int(parts[3])
+        after = (int(parts[4]) / 1000, parts[5]) if parts[4] != "-" else None
+        if kind not in QUEUE_KINDS or age not in QUEUE_AGES:
+            raise ValueError
+    except (IndexError, ValueError):
+        await cq.answer("Некорректные данные.")
+        return
+    text, markup = render_queue(kind, age, user_id, after)
+    await cq.answer()
+    try:
+        await cq.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    except TelegramBadRequest:
+        pass
+
+
+# --- Пакетный выбор заявок админом: /approve → отметить → подтвердить/отклонить выбранные ---
+BULK_PAGE_SIZE = 25
+# admin_id -> выбранные ("order" | "sbp", id)
+bulk_selected: dict[int, set[tuple[str, str]]] = {}
+
+
+def _bulk_candidates() -> list[tuple[str, str, str]]:
+    """[(вид, id, подпись кнопки)] — первые BULK_PAGE_SIZE заявок обеих очередей."""
+    out = []
+    for order_id, rec in pending_orders.items():
+        if rec.get("auto"):
+            continue
+        out.append(("order", order_id, f"⭐ {rec['qty']} {rec['username']} · {rec['price_kopecks']/100:.0f} ₽"))
+        if len(out) >= BULK_PAGE_SIZE:
+            return out
+    for sbp_id, rec in pending_sbp.items():
+        out.append(("sbp", sbp_id, f"💳 {rec.get('amount_rub', 0)} ₽ · id={rec.get('user_id')}"))
+        if len(out) >= BULK_PAGE_SIZE:
+            break
+    return out
+
+
+def _bulk_kb(admin_id: int) -> InlineKeyboardMarkup:
+    selected = bulk_selected.setdefault(admin_id, set())
+    kb = InlineKeyboardBuilder()
+    candidates = _bulk_candidates()
+    for kind, item_id, label in candidates:
+        mark = "☑️" if (kind, item_id) in selected else "⬜"
+        kb.button(text=f"{mark} {label}", callback_data=f"bsel:{kind}:{item_id}")
+    n = len(selected)
+    kb.button(text=f"✅ Подтвердить ({n})", callback_data="bulk:approve")
+    kb.button(text=f"❌ Отклонить ({n})", callback_data="bulk:reject")
+    kb.button(text="Выбрать все", callback_data="bulk:all")
+    kb.button(text="Сбросить", callback_data="bulk:none")
+    rows = [1] * len(candidates) + [2, 2]
+    kb.adjust(*rows)
+    return kb.as_markup()
+
+
+@dp.callback_query(F.data.startswith("bsel:"))
+async def cb_bulk_select(cq: CallbackQuery):
+    if cq.from_user.id not in get_admin_ids():
+        await cq.answer("Недостаточно прав.")
+        return
+    _, kind, item_id = cq.data.split(":", 2)
+    selected = bulk_selected.setdefault(cq.from_user.id, set())
+    selected ^= {(kind, item_id)}
     await cq.answer()
-    topup = pending_topups.get(cq.from_user.id)
+    try:
+        await cq.message.edit_reply_markup(reply_markup=_bulk_kb(cq.from_user.id))
+    except TelegramBadRequest:
+        pass
+
+
+@dp.callback_query(F.data.startswith("bulk:"))
+async def cb_bulk_action(cq: CallbackQuery):
+    if cq.from_user.id not in get_admin_ids():
+        await cq.answer("Недостаточно прав.")
+        return
+    action = cq.data.split(":", 1)[1]
+    selected = bulk_selected.setdefault(cq.from_user.id, set())
+    if action in ("all", "none"):
+        selected.clear()
+        if action == "all":
+            selected.update((kind, item_id) for kind, item_id, _ in _bulk_candidates())
+        await cq.answer()
+        try:
+            await cq.message.edit_reply_markup(reply_markup=_bulk_kb(cq.from_user.id))
+        except TelegramBadRequest:
+            pass
+        return
+    if not selected:
+        await cq.answer("Ничего не выбрано.")
+        return
+    await cq.answer("Обрабатываю…")
+    items = sorted(selected)
+    bulk_selected.pop(cq.from_user.id, None)
+    report = await bulk_process(items, approve=(action == "approve"))
+    await cq.message.edit_text(report)
+
+
+async def _check_crypto_payment(message: Message, user_id: int) -> None:
+    """Фоновая задача: ищет оплаченный счёт пользователя в Crypto Pay и зачисляет пополнение."""
+    topup = pending_topups.get(user_id)
     if not topup:
-        await cq.message.edit_text("Нет ожидающих пополнений для проверки.")
+        await message.edit_text("Нет ожидающих пополнений для проверки.")
         return
 
     headers = {"Crypto-Pay-API-Token": settings.CRYPTOPAY_API_TOKEN}
@@ -960,20 +1840,20 @@ async def cb_check_crypto(cq: CallbackQuery):
         async with httpx.AsyncClient(timeout=20) as client:
             r = await client.get(f"{settings.CRYPTOPAY_API_URL}/getInvoices", headers=headers, params=params)
         if r.status_code != 200:
-            await cq.message.edit_text(f"Crypto Pay HTTP {r.status_code}: {r.text}")
+            await message.edit_text(f"Crypto Pay HTTP {r.status_code}: {r.text}")
             return
         # Пытаемся распарсить JSON; если вернулась строка/HTML — покажем как есть
         try:
             data = r.json()
         except Exception:
-            await cq.message.edit_text(f"Crypto Pay вернул не JSON:\n{r.text}")
+            await message.edit_text(f"Crypto Pay вернул не JSON:\n{r.text}")
             return
         if not isinstance(data, dict):
-            await cq.message.edit_text(f"Crypto Pay ответил неожиданно:\n{data}")
+            await message.edit_text(f"Crypto Pay ответил неожиданно:\n{data}")
             return
         if not data.get("ok"):
             err = data.get("error") or data
-            await cq.message.edit_text(f"Ошибка Crypto Pay: {err}")
+            await message.edit_text(f"Ошибка Crypto Pay: {err}")
             return
         result = data.get("result")
         if isinstance(result, list):
@@ -981,10 +1861,10 @@ async def cb_check_crypto(cq: CallbackQuery):
         elif isinstance(result, dict) and "items" in result:
             invoices = result["items"]
         else:
-            await cq.message.edit_text(f"Неверный формат invoices: {result}")
+            await message.edit_text(f"Неверный формат invoices: {result}")
             return
         if not isinstance(invoices, list):
-            await cq.message.edit_text(f"Неверный формат invoices: {invoices}")
+            await message.edit_text(f"Неверный формат invoices: {invoices}")
             return
         found = None
         for inv in invoices:
@@ -995,30 +1875,53 @@ async def cb_check_crypto(cq: CallbackQuery):
                 p = json.loads(p_raw) if isinstance(p_raw, str) else p_raw
             except Exception:
                 p = {}
-            if p.get("topup_id") == topup.get("topup_id") and int(p.get("user_id", 0)) == cq.from_user.id:
+            if p.get("topup_id") == topup.get("topup_id") and int(p.get("user_id", 0)) == user_id:
                 found = inv
                 break
         if not found:
-            await cq.message.edit_text("Платёж пока не виден как оплаченный. Попробуйте позже.")
+            await message.edit_text("Платёж пока не виден как оплаченный. Попробуйте позже.")
             return
+        topup_key = f"topup:{topup.get('topup_id')}"
+        if ledger_keys.get(topup_key):
+            pending_topups.pop(user_id, None)
+            await message.edit_text("Этот платёж уже зачислен на баланс.")
+            return
+        ledger_keys.mark(topup_key, "approved")
         # Зачисляем баланс
         amt_rub = int(topup.get("amount_rub", 0))
-        rub_balance[cq.from_user.id] = rub_balance.get(cq.from_user.id, 0) + amt_rub * 100
+        rub_balance[user_id] = rub_balance.get(user_id, 0) + amt_rub * 100
         save_balances()
         # обновляем статистику суммарных пополнений
-        total_deposits[cq.from_user.id] = total_deposits.get(cq.from_user.id, 0) + amt_rub * 100
+        total_deposits[user_id] = total_deposits.get(user_id, 0) + amt_rub * 100
+        deposits_rank.update(user_id, total_deposits[user_id])
+        stats_agg.record_deposit(topup.get("method") or "CRYPTO", amt_rub * 100)
         save_stats()
-        pending_topups.pop(cq.from_user.id, None)
-        balance_rub = rub_balance[cq.from_user.id] / 100
+        pending_topups.pop(user_id, None)
+        balance_rub = rub_balance[user_id] / 100
         kb = InlineKeyboardBuilder()
         kb.button(text="⬅️ В главное меню", callback_data="menu")
         kb.adjust(1)
-        await cq.message.edit_text(
+        await message.edit_text(
             f"Оплата найдена и подтверждена Crypto Bot. Баланс пополнен на {amt_rub} ₽. Текущий баланс: {balance_rub:.2f} ₽",
             reply_markup=kb.as_markup(),
         )
     except Exception as e:
-        await cq.message.edit_text(f"Ошибка проверки платежа: {e}")
+        await message.edit_text(f"Ошибка проверки платежа: {e}")
+
+
+@dp.callback_query(F.data == "check_crypto")
+async def cb_check_crypto(cq: CallbackQuery):
+    key = (cq.from_user.id, "check_crypto")
+    if jobs.busy(key):
+        await cq.answer("Уже проверяем оплату…")
+        return
+    await cq.answer()
+    if not pending_topups.get(cq.from_user.id):
+        await cq.message.edit_text("Нет ожидающих пополнений для проверки.")
+        return
+    # кнопки счёта оставляем — проверка идёт в фоне и сама покажет результат
+    await cq.message.edit_text("⏳ Проверяем оплату в Crypto Bot…", reply_markup=cq.message.reply_markup)
+    jobs.submit(key, _check_crypto_payment, cq.message, cq.from_user.id)
 
 
  # ======== Helpers: main menu & welcome text ========
@@ -1092,6 +1995,7 @@ async def cb_balance_info(cq: CallbackQuery):
     bal = rub_balance.get(cq.from_user.id, 0) / 100
     dep = total_deposits.get(cq.from_user.id, 0) / 100
     stars = total_stars.get(cq.from_user.id, 0)
+    rank = stars_rank.rank(cq.from_user.id) if stars else None
     kb = InlineKeyboardBuilder()
     kb.button(text="➕ Пополнить баланс", callback_data="balance")
     kb.button(text="⬅️ Назад", callback_data="menu")
@@ -1101,6 +2005,7 @@ async def cb_balance_info(cq: CallbackQuery):
             f"💰 <b>Баланс:</b> {bal:.2f} ₽\n\n"
             f"📥 <b>Пополнено за всё время:</b> {dep:.2f} ₽\n\n"
             f"⭐ <b>Куплено звёзд за всё время:</b> {stars} ⭐"
+            + (f"\n\n🏆 <b>Место среди покупателей:</b> {rank} из {len(stars_rank)}" if rank else "")
         ),
         reply_markup=kb.as_markup(),
         parse_mode="HTML",
@@ -1197,7 +2102,6 @@ async def cq_buy(cq: CallbackQuery):
         await cq.message.edit_text("Допустимый диапазон: от 50 до 1 000 000 ⭐. Введите число в чате или выберите из списка.")
         return
     await cq.answer()
-    username_text = f"@{cq.from_user.username}" if cq.from_user.username else f"id={cq.from_user.id}"
     pending_qty[cq.from_user.id] = qty
     username = f"@{cq.from_user.username}" if cq.from_user.username else str(cq.from_user.id)
     price_kopecks = calc_total_price_rub_kopecks(qty)
@@ -1223,39 +2127,13 @@ async def cq_buy(cq: CallbackQuery):
     }
     save_pending_orders()
 
-    # отправка админам
-    admin_group_id = get_admin_group_id()
-    if not admin_group_id:
-        await cq.message.edit_text("Не удалось отправить заявку: группа админов не настроена. Установите ADMIN_GROUP_ID в settings.py.")
+    # отправка админам или в очередь автопокупки
+    ok, text = await dispatch_star_order(order_id)
+    if not ok:
+        await cq.message.edit_text(text)
         return
-    kb = InlineKeyboardBuilder()
-    kb.button(text="✅ Подтвердить", callback_data=f"star_approve:{order_id}")
-    kb.button(text="❌ Отклонить", callback_data=f"star_reject:{order_id}")
-    kb.adjust(2)
-    try:
-        await bot.send_message(
-            admin_group_id,
-            (
-                "Заявка на покупку ⭐ вручную:\n"
-                f"Код: {order_id}\n"
-                f"Пользователь: {username_text}\n"
-                f"Количество: {qty} ⭐\n"
-                f"К списанию: {price_kopecks/100:.2f} ₽\n\n"
-                "После оплаты звёзд вручную подтвердите заявку."
-            ),
-            reply_markup=kb.as_markup(),
-        )
-    except Exception:
-        await cq.message.edit_text("Не удалось отправить сообщение в группу админов. Проверьте, что бот добавлен в группу и может писать.")
-        return
-
-    await cq.message.edit_text(
-        (
-            "Заявка отправлена администратору. Как только админ купит звёзды и подтвердит — с баланса спишется нужная сумма, а вы получите уведомление.\n"
-            f"Код заявки: <code>{order_id}</code>."
-        ),
-        parse_mode="HTML",
-    )
+    await cq.message.edit_text(text, parse_mode="HTML")
+    msg_index.add(order_id, cq.message.chat.id, cq.message.message_id, "user")
     # Сразу отправляем главное меню отдельным сообщением
     await bot.send_message(cq.from_user.id, make_welcome_text_for(cq), reply_markup=make_main_menu_kb(cq.from_user.id))
     return
@@ -1327,7 +2205,135 @@ async def handle_text(m: Message):
                 await m.answer("Использование: /set_cost 3.10")
             return
         if m.text.startswith("/stats"):
-            await m.answer("В этой демо-версии статистика хранится только в логах / памяти. Подключите БД для прод.")
+            # /stats — за всё время; /stats today | 7d | 2025-09-01 [2025-09-30]
+            try:
+                start, end = parse_range(m.text.split()[1:])
+            except Exception:
+                await m.answer("Использование: /stats [today | 7d | ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]]")
+                return
+            text = format_stats(start, end)
+            if start is None:
+                rc = render_cache.stats()
+                text += (
+                    f"\nПравки сообщений без изменений пропущены: {rc['skipped']} из {rc['skipped'] + rc['passed']}"
+                    f" ({rc['hit_rate']:.0%}), в кэше {rc['entries']} сообщ."
+                )
+                js = jobs.stats()
+                text += (
+                    f"\nФоновые задачи: выполнено {js['done']}, с ошибкой {js['failed']}, повторных нажатий {js['deduplicated']}; "
+                    f"сейчас {js['running']} (+{js['waiting']} ждут), пик {js['peak_running']} из {js['concurrency']}; "
+                    f"время p50/p95 {js['run_p50_ms']:.0f}/{js['run_p95_ms']:.0f} мс, ожидание p95 {js['wait_p95_ms']:.0f} мс"
+                )
+                ts = throttle_buckets.stats()
+                text += f"\nОграничение частоты: отклонено {ts['throttled']} из {ts['allowed'] + ts['throttled']}, активных вёдер {ts['buckets']}"
+            await m.answer(text)
+            return
+        if m.text.startswith("/approve_all") or m.text.startswith("/reject_all"):
+            # /approve_all [orders|sbp] — все ожидающие заявки одной пачкой (заявки автопокупки не трогаем)
+            args = m.text.split()[1:]
+            kinds = {"order", "sbp"}
+            if args and args[0].lower() in ("orders", "order", "stars"):
+                kinds = {"order"}
+            elif args and args[0].lower() == "sbp":
+                kinds = {"sbp"}
+            items = []
+            if "order" in kinds:
+                items += [("order", o) for o, rec in pending_orders.items() if not rec.get("auto")]
+            if "sbp" in kinds:
+                items += [("sbp", s) for s in pending_sbp]
+            if not items:
+                await m.answer("Ожидающих заявок нет.")
+                return
+            await m.answer(await bulk_process(items, approve=m.text.startswith("/approve_all")))
+            return
+        if m.text.startswith("/approve"):
+            if not pending_orders and not pending_sbp:
+                await m.answer("Ожидающих заявок нет.")
+                return
+            bulk_selected.pop(m.from_user.id, None)
+            await m.answer(
+                f"Отметьте заявки (показаны первые {BULK_PAGE_SIZE}) и подтвердите или отклоните их одной пачкой.",
+                reply_markup=_bulk_kb(m.from_user.id),
+            )
+            return
+        if m.text.startswith("/queue"):
+            # /queue [orders|sbp] [15m|1h|24h] [user_id] — аргументы в любом порядке
+            kind, age, user_id = "a", "0", 0
+            for arg in m.text.split()[1:]:
+                arg = arg.lower()
+                if arg in ("orders", "order", "stars"):
+                    kind = "o"
+                elif arg == "sbp":
+                    kind = "s"
+                elif arg in QUEUE_AGES:
+                    age = arg
+                elif arg.isdigit():
+                    user_id = int(arg)
+                else:
+                    await m.answer("Использование: /queue [orders|sbp] [15m|1h|24h] [user_id]")
+                    return
+            text, markup = render_queue(kind, age, user_id)
+            await m.answer(text, reply_markup=markup, parse_mode="HTML")
+            return
+        if m.text.startswith("/top"):
+            # /top [stars|deposits] [N]
+            args = m.text.split()[1:]
+            board, title, fmt = stars_rank, "Топ покупателей звёзд", lambda v: f"{v} ⭐"
+            if args and args[0].lower() in ("deposits", "dep", "пополнения"):
+                board, title, fmt = deposits_rank, "Топ по пополнениям", lambda v: f"{v/100:.2f} ₽"
+                args = args[1:]
+            elif args and args[0].lower() in ("stars", "звёзды", "звезды"):
+                args = args[1:]
+            try:
+                limit = max(1, min(50, int(args[0]))) if args else 10
+            except Exception:
+                limit = 10
+            rows = board.top(limit)
+            if not rows:
+                await m.answer(f"{title}: пока пусто.")
+                return
+            lines = [f"{title} (всего {len(board)}):"]
+            lines += [f"{i}. <a href=\"tg://user?id={uid}\">{uid}</a> — {fmt(score)}" for i, (uid, score) in enumerate(rows, 1)]
+            await m.answer("\n".join(lines), parse_mode="HTML")
+            return
+        if m.text.startswith("/fulfil"):
+            if fulfilment is None:
+                await m.answer("Автопокупка выключена (AUTO_FULFIL=0), все заявки идут админам.")
+                return
+            st = fulfilment.stats()
+            lines = [
+                "Автопокупка через split.tg:",
+                f"В очереди: {st['queued']}, в работе: {st['in_flight']}",
+                f"Успешно: {st['succeeded']}, передано админам: {st['failed']} (из них ссылок на оплату: {st['payment_links']})",
+                f"Покупок на split.tg: {st['batches']}, заявок объединено: {st['coalesced']}",
+                f"Успешность: {st['success_rate']*100:.0f}%, заказов в час: {st['per_hour']:.1f}",
+                f"Время покупки: p50 {st['p50_sec']:.0f} с, p95 {st['p95_sec']:.0f} с",
+            ]
+            if split_client is not None:
+                lines.append(f"Перезапусков процесса браузера: {split_client.restarts}")
+                steps = split_client.step_summary
+                slow = sorted(steps.items(), key=lambda kv: kv[1]["p95_ms"], reverse=True)[:5]
+                if slow:
+                    lines.append("Самые долгие шаги (p95):")
+                    lines += [f"  {name}: {v['p95_ms']/1000:.1f} с, таймаутов {v['timeouts']}" for name, v in slow]
+            await m.answer("\n".join(lines))
+            return
+        if m.text.startswith("/traces"):
+            # /traces [N] — последние N сохранённых Playwright trace (медленные/неудачные/выборочные заказы)
+            try:
+                limit = max(1, min(10, int(m.text.split()[1]))) if len(m.text.split()) > 1 else 3
+            except Exception:
+                limit = 3
+            artifacts = ArtifactStore(getattr(settings, "SPLIT_ARTIFACTS_DIR", "split_artifacts"), clean_tmp=False)
+            paths = artifacts.latest(limit, suffix=".zip")
+            if not paths:
+                await m.answer("Сохранённых trace пока нет. Включите SPLIT_TRACE_SAMPLE или SPLIT_TRACE_SLOW_MS.")
+                return
+            for path in paths:
+                try:
+                    await m.answer_document(FSInputFile(path), caption=f"{path}\nОткрыть: npx playwright show-trace trace.zip")
+                except Exception as e:
+                    await m.answer(f"Не удалось отправить {path}: {e}")
             return
 
     # Свободный ввод количества ⭐ без нажатия кнопок (если это не ввод суммы пополнения)
@@ -1356,7 +2362,6 @@ async def handle_text(m: Message):
         qty = min(1_000_000, qty_raw)
         pending_qty[m.from_user.id] = qty
         username = f"@{m.from_user.username}" if m.from_user.username else str(m.from_user.id)
-        username_text = f"@{m.from_user.username}" if m.from_user.username else f"id={m.from_user.id}"
         price_kopecks = calc_total_price_rub_kopecks(qty)
         current_balance = rub_balance.get(m.from_user.id, 0)
         if current_balance < price_kopecks:
@@ -1379,38 +2384,12 @@ async def handle_text(m: Message):
         }
         save_pending_orders()
 
-        admin_group_id = get_admin_group_id()
-        if not admin_group_id:
-            await m.answer("Не удалось отправить заявку: группа админов не настроена. Установите ADMIN_GROUP_ID в settings.py.")
-            return
-        kb = InlineKeyboardBuilder()
-        kb.button(text="✅ Подтвердить", callback_data=f"star_approve:{order_id}")
-        kb.button(text="❌ Отклонить", callback_data=f"star_reject:{order_id}")
-        kb.adjust(2)
-        try:
-            await bot.send_message(
-                admin_group_id,
-                (
-                    "Заявка на покупку ⭐ вручную:\n"
-                    f"Код: {order_id}\n"
-                    f"Пользователь: {username_text}\n"
-                    f"Количество: {qty} ⭐\n"
-                    f"К списанию: {price_kopecks/100:.2f} ₽\n\n"
-                    "После оплаты звёзд вручную подтвердите заявку."
-                ),
-                reply_markup=kb.as_markup(),
-            )
-        except Exception:
-            await m.answer("Не удалось отправить сообщение в группу админов. Проверьте, что бот добавлен в группу и может писать.")
+        ok, text = await dispatch_star_order(order_id)
+        if not ok:
+            await m.answer(text)
             return
-
-        await m.answer(
-            (
-                "Заявка отправлена администратору. Как только админ отправит звёзды и подтвердит — с баланса спишется нужная сумма, а вы получите уведомление.\n"
-                f"Код заявки: <code>{order_id}</code>."
-            ),
-            parse_mode="HTML",
-        )
+        sent = await m.answer(text, parse_mode="HTML")
+        msg_index.add(order_id, sent.chat.id, sent.message_id, "user")
         # Сразу отправляем главное меню отдельным сообщением
         await m.answer(make_welcome_text_for(m), reply_markup=make_main_menu_kb(m.from_user.id))
         return
@@ -1466,39 +2445,12 @@ async def handle_text(m: Message):
         }
         save_pending_orders()
 
-        admin_group_id = get_admin_group_id()
-        if not admin_group_id:
-            await m.answer("Не удалось отправить заявку: группа админов не настроена. Установите ADMIN_GROUP_ID в settings.py.")
+        ok, text = await dispatch_star_order(order_id)
+        if not ok:
+            await m.answer(text)
             return
-        kb = InlineKeyboardBuilder()
-        kb.button(text="✅ Подтвердить", callback_data=f"star_approve:{order_id}")
-        kb.button(text="❌ Отклонить", callback_data=f"star_reject:{order_id}")
-        kb.adjust(2)
-        username_text = f"@{m.from_user.username}" if m.from_user.username else f"id={m.from_user.id}"
-        try:
-            await bot.send_message(
-                admin_group_id,
-                (
-                    "Заявка на покупку ⭐ вручную:\n"
-                    f"Код: {order_id}\n"
-                    f"Пользователь: {username_text}\n"
-                    f"Количество: {qty} ⭐\n"
-                    f"К списанию: {price_kopecks/100:.2f} ₽\n\n"
-                    "После оплаты звёзд вручную подтвердите заявку."
-                ),
-                reply_markup=kb.as_markup(),
-            )
-        except Exception:
-            await m.answer("Не удалось отправить сообщение в группу админов. Проверьте, что бот добавлен в группу и может писать.")
-            return
-
-        await m.answer(
-            (
-                "Заявка отправлена администратору. Как только админ купит звёзды и подтвердит — с баланса спишется нужная сумма, а вы получите уведомление.\n"
-                f"Код заявки: <code>{order_id}</code>."
-            ),
-            parse_mode="HTML",
-        )
+        sent = await m.answer(text, parse_mode="HTML")
+        msg_index.add(order_id, sent.chat.id, sent.message_id, "user")
         # Сразу отправляем главное меню отдельным сообщением
         await m.answer(make_welcome_text_for(m), reply_markup=make_main_menu_kb(m.from_user.id))
         return
@@ -1557,6 +2509,7 @@ if __name__ == "__main__":
     load_balances()
     load_stats()
     load_pending()
+    msg_index.load()
     asyncio.run(dp.start_polling(bot))
 
 
@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import time
+
+
+class Expiry:
+    """Истечение срока для словарей состояния бота: min-heap дедлайнов с ленивым удалением.
+
+    Каждый вид (kind) — словарь и TTL. При записи ключа в словарь в кучу кладётся (дедлайн, kind, key);
+    удалённые или продлённые ключи из кучи не вычищаются — запись просто пропускается, когда дойдёт
+    до вершины. Поэтому проход стоит O(истёкших · log n), без периодического перебора словарей.
+
+    on_expire(key, rec) — вызывается перед удалением (можно async); вернёт False — ключ остаётся
+    ещё на один TTL (например, заявка уже в работе). on_flush() — один раз после прохода,
+    если в этом виде что-то истекло (сохранить файл).
+    """
+
+    def __init__(self, *, max_sleep: float = 30.0):
+        self.max_sleep = max_sleep
+        self._kinds: dict[str, dict] = {}
+        self._heap: list[tuple[float, int, str, object]] = []
+        self._deadline: dict[tuple[str, object], float] = {}
+        self._seq = itertools.count()
+        self.expired: dict[str, int] = {}
+
+    def register(self, kind: str, mapping: dict, ttl: float, *, on_expire=None, on_flush=None) -> None:
+        """ttl <= 0 — вид не истекает."""
+        self._kinds[kind] = {"mapping": mapping, "ttl": float(ttl or 0), "on_expire": on_expire, "on_flush": on_flush}
+        self.expired.setdefault(kind, 0)
+
+    def ttl(self, kind: str) -> float:
+        spec = self._kinds.get(kind)
+        return spec["ttl"] if spec else 0.0
+
+    def schedule(self, kind: str, key, *, since: float | None = None) -> None:
+        """(Пере)запускает таймер ключа: истечёт через TTL от since (по умолчанию — от сейчас).
+        since из будущего (время из кода заявки при сбитых часах и т.п.) считается равным «сейчас».
+        """
+        ttl = self.ttl(kind)
+        if ttl <= 0:
+            return
+        now = time.time()
+        deadline = (now if since is None else min(since, now)) + ttl
+        self._deadline[(kind, key)] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._seq), kind, key))
+        # продлённые/удалённые ключи оставляют в куче мусор — изредка пересобираем её целиком
+        if len(self._heap) > 2 * len(self._deadline) + 1024:
+            self._compact()
+
+    def _compact(self) -> None:
+        self._heap = [e for e in self._heap if self._deadline.get((e[2], e[3])) == e[0]]
+        heapq.heapify(self._heap)
+
+    def next_deadline(self) -> float | None:
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self) -> int:
+        return len(self._deadline)
+
+    # ======== Проход ========
+
+    async def sweep(self, now: float | None = None) -> int:
+        """Удаляет всё, чей срок истёк к now; возвращает число удалённых."""
+        now = time.time() if now is None else now
+        done = 0
+        dirty: set[str] = set()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, kind, key = heapq.heappop(self._heap)
+            if self._deadline.get((kind, key)) != deadline:
+                continue  # ключ продлён — актуальная запись лежит глубже в куче
+            del self._deadline[(kind, key)]
+            spec = self._kinds[kind]
+            mapping = spec["mapping"]
+            if key not in mapping:
+                continue  # уже обработан обычным путём
+            rec = mapping[key]
+            keep = None
+            if spec["on_expire"] is not None:
+                try:
+                    keep = spec["on_expire"](key, rec)
+                    if inspect.isawaitable(keep):
+                        keep = await keep
+                except Exception:
+                    keep = None
+            if keep is False:
+                self.schedule(kind, key)
+                continue
+            # колбэк мог сам закрыть запись; удаляем только если это всё ещё та же запись
+            if mapping.get(key) is rec:
+                mapping.pop(key, None)
+            self.expired[kind] += 1
+            dirty.add(kind)
+            done += 1
+        for kind in dirty:
+            if self._kinds[kind]["on_flush"] is not None:
+                try:
+                    self._kinds[kind]["on_flush"]()
+                except Exception:
+                    pass
+        return done
+
+    async def run(self) -> None:
+        """Фоновый цикл: спит до ближайшего дедлайна (не дольше max_sleep) и снимает истёкшее."""
+        while True:
+            nxt = self.next_deadline()
+            delay = self.max_sleep if nxt is None else min(self.max_sleep, max(0.0, nxt - time.time()))
+            await asyncio.sleep(delay)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+
+
+class ExpiringDict(dict):
+    """dict, который ставит таймер Expiry на каждую запись ключа (повторная запись продлевает срок)."""
+
+    def __init__(self, expiry: Expiry, kind: str):
+        super().__init__()
+        self._expiry = expiry
+        self._kind = kind
+
+    def __setitem__(self, key, value) -> None:
+        dict.__setitem__(self, key, value)
+        self._expiry.schedule(self._kind, key)
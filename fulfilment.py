@@ -0,0 +1,158 @@
+from collections import deque
+import asyncio
+import time
+
+PAYMENT_LINK_PREFIX = "PAYMENT_LINK::"
+
+
+class FulfilmentQueue:
+    """Фоновая автопокупка звёзд: заявки ставятся в очередь, воркеры покупают их через SplitClient.
+
+    buy(order_ids) -> str         — одна покупка на все заявки пачки; возвращает id заказа split.tg
+                                    или "PAYMENT_LINK::<url>"
+    on_success(order_id, result, batch_size)  — звёзды куплены: списать баланс, уведомить пользователя
+    on_failure(order_id, reason, payment_link, batch, error=...) — не получилось: отдать заявку админам вручную;
+                                    batch — все заявки пачки (счёт payment_link выписан на их суммарное количество),
+                                    error — исключение из buy (None, если split.tg выдал счёт)
+
+    Заявки с одним получателем (key), пришедшие в течение coalesce_sec от первой, объединяются
+    в одну покупку на суммарное количество (не больше max_qty); колбэки всё равно вызываются по каждой заявке.
+    Исключение из buy считается неудачей и тоже уходит в on_failure; ошибки колбэков глушатся,
+    чтобы один плохой заказ не останавливал воркер.
+    """
+
+    def __init__(self, buy, *, on_success, on_failure, workers: int = 1, window: int = 200,
+                 coalesce_sec: float = 0.0, max_qty: int = 0):
+        self._buy = buy
+        self._on_success = on_success
+        self._on_failure = on_failure
+        self.workers = max(1, int(workers))
+        self.coalesce_sec = max(0.0, float(coalesce_sec or 0))
+        self.max_qty = max(0, int(max_qty or 0))
+        # очередь пачек {"key", "orders", "qty", "since"}; _open — пачки, в которые ещё можно добавлять
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._open: dict[str, dict] = {}
+        self._queued: set[str] = set()
+        self._tasks: list[asyncio.Task] = []
+        self.in_flight = 0
+        # метрики
+        self.started_at = time.monotonic()
+        self.succeeded = 0
+        self.failed = 0
+        self.payment_links = 0
+        self.batches = 0
+        # сколько заявок ушло «попутно» в чужую покупку (= сэкономленных запусков браузера)
+        self.coalesced = 0
+        self._durations: deque = deque(maxlen=max(1, int(window)))
+        self._finished_at: deque = deque(maxlen=max(1, int(window)))
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self.started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, order_id: str, *, key: str | None = None, qty: int = 0) -> bool:
+        """Ставит заявку в очередь (повторная постановка того же id игнорируется).
+        key — получатель: заявки с одинаковым key в пределах coalesce_sec покупаются одним заказом.
+        """
+        if order_id in self._queued:
+            return False
+        self._queued.add(order_id)
+        key = key if (key and self.coalesce_sec) else f"order:{order_id}"
+        grp = self._open.get(key)
+        if (grp is None or (self.max_qty and grp["qty"] + qty > self.max_qty)
+                or time.monotonic() - grp["since"] > self.coalesce_sec):
+            # новая пачка (или текущая уже упёрлась в max_qty / ждёт в очереди дольше coalesce_sec)
+            grp = {"key": key, "orders": [], "qty": 0, "since": time.monotonic()}
+            self._open[key] = grp
+            self._queue.put_nowait(grp)
+        else:
+            self.coalesced += 1
+        grp["orders"].append(order_id)
+        grp["qty"] += int(qty)
+        return True
+
+    def qsize(self) -> int:
+        """Сколько заявок ждёт покупки."""
+        return len(self._queued) - self.in_flight
+
+    async def _worker(self) -> None:
+        while True:
+            grp = await self._queue.get()
+            # даём время докинуть в пачку остальные заявки того же получателя
+            left = grp["since"] + self.coalesce_sec - time.monotonic()
+            if left > 0:
+                await asyncio.sleep(left)
+            if self._open.get(grp["key"]) is grp:
+                del self._open[grp["key"]]
+            orders = list(grp["orders"])
+            self.in_flight += len(orders)
+            try:
+                await self._process(orders)
+            finally:
+                self.in_flight -= len(orders)
+                self._queued.difference_update(orders)
+                self._queue.task_done()
+
+    async def _process(self, orders: list[str]) -> None:
+        t0 = time.monotonic()
+        self.batches += 1
+        try:
+            result = await self._buy(orders)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = None
+            error = e
+            reason = f"{type(e).__name__}: {e}"
+        self._durations.append(time.monotonic() - t0)
+        self._finished_at.append(time.monotonic())
+        for order_id in orders:
+            try:
+                if result and not result.startswith(PAYMENT_LINK_PREFIX):
+                    self.succeeded += 1
+                    await self._on_success(order_id, result, len(orders))
+                elif result:
+                    # split.tg не списал сам, а выдал счёт на оплату — человеку нужно оплатить его вручную
+                    self.payment_links += 1
+                    self.failed += 1
+                    link = result[len(PAYMENT_LINK_PREFIX):]
+                    await self._on_failure(order_id, "split.tg не вернул номер заказа", None if link in ("", "None") else link, orders,
+                                           error=None)
+                else:
+                    self.failed += 1
+                    await self._on_failure(order_id, reason, None, orders, error=error)
+            except Exception:
+                pass
+
+    # ======== Метрики ========
+
+    def stats(self) -> dict:
+        done = self.succeeded + self.failed
+        durations = sorted(self._durations)
+        now = time.monotonic()
+        # пропускная способность считается в покупках (запусках браузера), а не в заявках
+        last_hour = sum(1 for t in self._finished_at if now - t <= 3600)
+        uptime_h = max(1e-9, (now - self.started_at) / 3600)
+        return {
+            "queued": self.qsize(),
+            "in_flight": self.in_flight,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "payment_links": self.payment_links,
+            "batches": self.batches,
+            "coalesced": self.coalesced,
+            "success_rate": (self.succeeded / done) if done else 0.0,
+            # за последний час (или за время работы, если оно меньше часа)
+            "per_hour": last_hour / max(0.1, min(1.0, uptime_h)),
+            "p50_sec": durations[len(durations) // 2] if durations else 0.0,
+            "p95_sec": durations[min(len(durations) - 1, int(0.95 * len(durations)))] if durations else 0.0,
+        }
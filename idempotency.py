@@ -0,0 +1,82 @@
+from collections import OrderedDict
+import time
+
+
+class RecentIds:
+    """Последние max_size идентификаторов (update_id) — чтобы повторно доставленный апдейт не обрабатывался."""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max(1, int(max_size))
+        self._ids: OrderedDict = OrderedDict()
+        self.repeats = 0
+
+    def add(self, key) -> bool:
+        """True — ключ новый (и запомнен), False — уже встречался."""
+        if key in self._ids:
+            self._ids.move_to_end(key)
+            self.repeats += 1
+            return False
+        self._ids[key] = None
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+        return True
+
+
+class AppliedKeys:
+    """Ключи идемпотентности денежных операций: "order:<id>", "sbp:<id>", "topup:<id>" -> [время, итог].
+
+    Операция проверяет ключ до изменения баланса и отмечает его в том же словаре, который
+    сохраняется вместе с балансами, — поэтому ни повторное нажатие, ни повторная доставка
+    апдейта после рестарта не спишут и не зачислят деньги дважды. Хранятся ключи за последние
+    max_age_days дней, но не больше max_keys (старые удаляются с начала). Активные резервы
+    (итог "held") не удаляются никогда: по ним ещё не принято решение, и без ключа резерв потеряется.
+    """
+
+    def __init__(self, max_keys: int = 100_000, max_age_days: float = 30):
+        self.max_keys = max(1, int(max_keys))
+        self.max_age = float(max_age_days) * 86400
+        self._keys: OrderedDict[str, list] = OrderedDict()
+
+    def get(self, key: str) -> str | None:
+        """Итог операции ("approved", "rejected", ...) или None, если её ещё не было."""
+        rec = self._keys.get(key)
+        return rec[1] if rec else None
+
+    def mark(self, key: str, outcome: str) -> None:
+        self._keys[key] = [int(time.time()), outcome]
+        self._keys.move_to_end(key)
+        self._prune()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.max_age
+        kept = 0
+        while len(self._keys) > kept:
+            key, (ts, outcome) = next(iter(self._keys.items()))
+            if ts >= cutoff and len(self._keys) <= self.max_keys:
+                return
+            if outcome == "held":
+                # резерв ждёт решения — переносим в конец (время не трогаем) и смотрим следующий
+                self._keys.move_to_end(key)
+                kept += 1
+                continue
+            del self._keys[key]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def to_dict(self) -> dict:
+        return dict(self._keys)
+
+    def load(self, data) -> None:
+        if not isinstance(data, dict):
+            return
+        self._keys.clear()
+        items = []
+        for key, rec in data.items():
+            try:
+                items.append((int(rec[0]), str(key), str(rec[1])))
+            except Exception:
+                continue
+        for ts, key, outcome in sorted(items):
+            self._keys[key] = [ts, outcome]
+        self._prune()
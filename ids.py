@@ -0,0 +1,67 @@
+import threading
+import time
+
+# Crockford base32: без I, L, O, U — код удобно продиктовать и переписать в комментарий к платежу
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# Отсчёт времени от 2024-01-01 UTC — 42 бит миллисекунд хватает примерно до 2163 года
+EPOCH_MS = 1704067200000
+
+TIME_BITS = 42
+REPLICA_BITS = 8
+SEQ_BITS = 10
+LENGTH = (TIME_BITS + REPLICA_BITS + SEQ_BITS) // 5  # 60 бит → 12 символов
+
+
+class IdAllocator:
+    """Коды заявок, упорядоченные по времени: [42 бит мс][8 бит номер реплики][10 бит счётчик].
+
+    Уникальность следует из построения — ничего не нужно хранить: внутри процесса счётчик в пределах
+    миллисекунды, между процессами — разный replica_id, между рестартами — разное время.
+    Если системные часы отошли назад, генератор продолжает от последней выданной миллисекунды.
+    """
+
+    def __init__(self, replica_id: int = 0):
+        if not 0 <= int(replica_id) < (1 << REPLICA_BITS):
+            raise ValueError(f"replica_id должен быть от 0 до {(1 << REPLICA_BITS) - 1}")
+        self.replica_id = int(replica_id)
+        self._last_ms = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _next_value(self) -> int:
+        with self._lock:
+            now = max(int(time.time() * 1000) - EPOCH_MS, self._last_ms)
+            if now == self._last_ms:
+                self._seq += 1
+                if self._seq >= (1 << SEQ_BITS):
+                    # 1024 кода за миллисекунду исчерпаны — занимаем следующую
+                    now += 1
+                    self._seq = 0
+            else:
+                self._seq = 0
+            self._last_ms = now
+            return (now << (REPLICA_BITS + SEQ_BITS)) | (self.replica_id << SEQ_BITS) | self._seq
+
+    def new(self, taken=None) -> str:
+        """Новый код; taken (dict/set живых заявок) проверяется через `in` — без копирования ключей."""
+        while True:
+            code = encode(self._next_value())
+            # страховка от старых кодов (случайный hex прежнего формата) и ручных правок файлов
+            if taken is None or code not in taken:
+                return code
+
+
+def encode(value: int) -> str:
+    out = []
+    for _ in range(LENGTH):
+        out.append(ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(out))
+
+
+def decode_time(code: str) -> float:
+    """Время выдачи кода (unix, секунды) — удобно при разборе заявок."""
+    value = 0
+    for ch in code.upper():
+        value = (value << 5) | ALPHABET.index(ch)
+    return ((value >> (REPLICA_BITS + SEQ_BITS)) + EPOCH_MS) / 1000
@@ -0,0 +1,86 @@
+from collections import deque
+import asyncio
+import time
+
+
+class JobRunner:
+    """Фоновые задачи для медленной работы из обработчиков (HTTP к Crypto Pay, покупки и т.п.).
+
+    Обработчик отвечает на callback сразу, а работа идёт отдельной задачей: не больше concurrency
+    одновременно, одна задача на ключ (например, (user_id, "check_crypto")) — повторное нажатие,
+    пока задача не завершилась, игнорируется. Ошибки задач глушатся: сообщить о них пользователю —
+    забота самой задачи.
+    """
+
+    def __init__(self, concurrency: int = 8, *, window: int = 200):
+        self.concurrency = max(1, int(concurrency))
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._tasks: dict[object, asyncio.Task] = {}
+        self.running = 0
+        self.peak_running = 0
+        # метрики
+        self.done = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self._wait_ms: deque = deque(maxlen=max(1, int(window)))
+        self._run_ms: deque = deque(maxlen=max(1, int(window)))
+
+    def busy(self, key) -> bool:
+        return key in self._tasks
+
+    def submit(self, key, func, *args, **kwargs) -> bool:
+        """Запускает func(*args, **kwargs) в фоне; False — задача с таким ключом ещё выполняется."""
+        if key in self._tasks:
+            self.deduplicated += 1
+            return False
+        task = asyncio.create_task(self._run(key, time.monotonic(), func, args, kwargs))
+        self._tasks[key] = task
+        return True
+
+    async def _run(self, key, queued_at: float, func, args, kwargs) -> None:
+        try:
+            async with self._sem:
+                started = time.monotonic()
+                self._wait_ms.append((started - queued_at) * 1000)
+                self.running += 1
+                self.peak_running = max(self.peak_running, self.running)
+                try:
+                    await func(*args, **kwargs)
+                    self.done += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.failed += 1
+                finally:
+                    self.running -= 1
+                    self._run_ms.append((time.monotonic() - started) * 1000)
+        finally:
+            self._tasks.pop(key, None)
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ======== Метрики ========
+
+    @staticmethod
+    def _pct(values, q: float) -> float:
+        vals = sorted(values)
+        return vals[min(len(vals) - 1, int(q * len(vals)))] if vals else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": len(self._tasks) - self.running,
+            "peak_running": self.peak_running,
+            "concurrency": self.concurrency,
+            "done": self.done,
+            "failed": self.failed,
+            "deduplicated": self.deduplicated,
+            "wait_p95_ms": self._pct(self._wait_ms, 0.95),
+            "run_p50_ms": self._pct(self._run_ms, 0.5),
+            "run_p95_ms": self._pct(self._run_ms, 0.95),
+        }
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+import asyncio
+import json
+import os
+import tempfile
+
+
+class MessageIndex:
+    """Где лежат сообщения бота о заявке: id заявки -> [(chat_id, message_id, роль)].
+
+    Роль — "admin" (копия в группе админов с кнопками) или "user" (сообщение пользователю).
+    По индексу смена статуса правит эти сообщения на месте вместо отправки новых.
+    Размер ограничен max_items заявками: при переполнении забываются самые старые
+    (для них бот просто отправит новое сообщение, как раньше). Файл пишется не на каждое
+    изменение, а фоновой autosave() раз в interval секунд, если что-то поменялось.
+    """
+
+    def __init__(self, path: str = "message_index.json", max_items: int = 20000):
+        self.path = path
+        self.max_items = max(1, int(max_items))
+        self._items: OrderedDict[str, list[list]] = OrderedDict()
+        self._dirty = False
+
+    def add(self, item_id: str, chat_id: int, message_id: int, role: str) -> None:
+        locs = self._items.get(item_id)
+        if locs is None:
+            locs = self._items[item_id] = []
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        loc = [int(chat_id), int(message_id), role]
+        if loc not in locs:
+            locs.append(loc)
+            self._dirty = True
+
+    def get(self, item_id: str) -> list[tuple[int, int, str]]:
+        return [tuple(loc) for loc in self._items.get(item_id, ())]
+
+    def pop(self, item_id: str) -> list[tuple[int, int, str]]:
+        locs = self._items.pop(item_id, None)
+        if locs is None:
+            return []
+        self._dirty = True
+        return [tuple(loc) for loc in locs]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    # ======== Хранение ========
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._items.clear()
+                for item_id, locs in data.items():
+                    if isinstance(locs, list):
+                        self._items[str(item_id)] = [
+                            [int(loc[0]), int(loc[1]), str(loc[2])] for loc in locs
+                            if isinstance(loc, list) and len(loc) == 3
+                        ]
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+        except Exception:
+            pass
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix="tmp_", dir=os.path.dirname(self.path) or ".")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._items, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except Exception:
+            # не валим бота при ошибке записи; попробуем в следующий раз
+            self._dirty = True
+
+    async def autosave(self, interval: float = 5.0) -> None:
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.save()
+        finally:
+            self.save()
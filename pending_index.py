@@ -0,0 +1,138 @@
+from bisect import bisect_left, bisect_right, insort
+import heapq
+import time
+
+from ids import EPOCH_MS, LENGTH as ID_LENGTH, decode_time
+
+# насколько время из кода может опережать локальные часы (коды выданы другой репликой)
+MAX_CLOCK_SKEW_SEC = 300
+
+
+class PendingIndex(dict):
+    """Очередь заявок (id -> запись) с индексами по времени создания и по пользователю.
+
+    Обычный dict для остального кода бота; при вставке/удалении поддерживаются отсортированные
+    списки ключей (created_at, id) — общий и по каждому user_id. Страница очереди —
+    бинарный поиск курсора + срез, O(log n + размер страницы), без сортировки всего словаря.
+    Вставка/удаление — insort/del по списку: поиск O(log n) плюс сдвиг памяти, для очередей
+    в тысячи заявок это микросекунды.
+    """
+
+    def __init__(self, *args, on_set=None, **kwargs):
+        super().__init__()
+        self._order: list[tuple[float, str]] = []
+        self._by_user: dict[int, list[tuple[float, str]]] = {}
+        # on_set(key, rec) — после каждой записи (например, поставить таймер истечения)
+        self.on_set = on_set
+        self.update(*args, **kwargs)
+
+    @staticmethod
+    def created_at(item_id: str, rec: dict, default: float | None = None) -> float:
+        """Время создания (unix, с точностью до мс): поле записи, иначе время из кода заявки,
+        иначе default (например, mtime файла очереди) или «сейчас».
+        Мс — чтобы курсор страницы точно восстанавливался из callback_data.
+        Прежние коды (uuid4().hex[:12]) той же длины, что и новые, и тоже разбираются decode_time,
+        но дают время вне [EPOCH_MS, сейчас] — такое время (и такое же поле записи) не принимается.
+        """
+        latest = time.time() + MAX_CLOCK_SKEW_SEC
+        try:
+            ts = float(rec.get("created_at") or 0)
+        except Exception:
+            ts = 0.0
+        if not EPOCH_MS / 1000 <= ts <= latest:
+            try:
+                ts = decode_time(item_id) if len(item_id) == ID_LENGTH else 0.0
+            except Exception:
+                ts = 0.0
+        if not EPOCH_MS / 1000 <= ts <= latest:
+            ts = default or time.time()
+        return round(min(ts, latest), 3)
+
+    # ======== dict ========
+
+    def __setitem__(self, key, rec) -> None:
+        if key in self:
+            self._unindex(key, dict.__getitem__(self, key))
+        rec["created_at"] = self.created_at(key, rec)
+        dict.__setitem__(self, key, rec)
+        entry = (rec["created_at"], key)
+        insort(self._order, entry)
+        insort(self._by_user.setdefault(rec.get("user_id"), []), entry)
+        if self.on_set is not None:
+            self.on_set(key, rec)
+
+    def __delitem__(self, key) -> None:
+        rec = dict.__getitem__(self, key)
+        dict.__delitem__(self, key)
+        self._unindex(key, rec)
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        rec = dict.__getitem__(self, key)
+        del self[key]
+        return rec
+
+    def popitem(self):
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs) -> None:
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def clear(self) -> None:
+        dict.clear(self)
+        self._order.clear()
+        self._by_user.clear()
+
+    def _unindex(self, key, rec: dict) -> None:
+        entry = (rec["created_at"], key)
+        _remove(self._order, entry)
+        lst = self._by_user.get(rec.get("user_id"))
+        if lst is not None:
+            _remove(lst, entry)
+            if not lst:
+                del self._by_user[rec.get("user_id")]
+
+    # ======== Запросы ========
+
+    def page(self, after: tuple[float, str] | None = None, limit: int = 10, *,
+             user_id: int | None = None, until: float | None = None) -> list[tuple[float, str]]:
+        """До limit ключей (created_at, id) по возрастанию времени, строго после курсора after.
+        user_id — только заявки пользователя; until — только созданные не позже until.
+        """
+        src = self._order if user_id is None else self._by_user.get(user_id, [])
+        lo = bisect_right(src, after) if after else 0
+        hi = bisect_right(src, (until, "\uffff")) if until is not None else len(src)
+        return src[lo:min(hi, lo + limit)]
+
+    def count(self, *, user_id: int | None = None, until: float | None = None) -> int:
+        src = self._order if user_id is None else self._by_user.get(user_id, [])
+        return bisect_right(src, (until, "\uffff")) if until is not None else len(src)
+
+    def oldest(self) -> tuple[float, str] | None:
+        return self._order[0] if self._order else None
+
+
+def _remove(lst: list, entry) -> None:
+    i = bisect_left(lst, entry)
+    if i < len(lst) and lst[i] == entry:
+        del lst[i]
+
+
+def merged_page(sources: list[tuple[str, PendingIndex]], after: tuple[float, str] | None = None,
+                limit: int = 10, **filters) -> list[tuple[float, str, str]]:
+    """Общая страница по нескольким очередям: [(created_at, id, вид)] по возрастанию времени."""
+    parts = [
+        [(ts, item_id, kind) for ts, item_id in idx.page(after, limit, **filters)]
+        for kind, idx in sources
+    ]
+    return list(heapq.merge(*parts))[:limit]
@@ -0,0 +1,157 @@
+import random
+
+MAX_LEVEL = 32
+P = 0.25
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: list["_Node | None"] = [None] * level
+        # width[i] — сколько элементов перескакивает ссылка next[i]
+        self.width: list[int] = [1] * level
+
+
+class Leaderboard:
+    """Рейтинг пользователей по счёту (звёзды, пополнения) — индексируемый skip list.
+
+    update / remove / rank — O(log n), top(n) — O(log n + n). Элементы упорядочены по убыванию
+    счёта, при равенстве — по user_id, чтобы место было детерминированным.
+    """
+
+    def __init__(self, items: dict[int, int] | None = None):
+        self._head = _Node(None, MAX_LEVEL)
+        self._level = 1
+        self._scores: dict[int, int] = {}
+        if items:
+            self._bulk_load(items)
+
+    def _bulk_load(self, items: dict[int, int]) -> None:
+        """Построение за один проход по отсортированным ключам (при старте бота, вместо n вставок)."""
+        self._scores = {int(u): int(s) for u, s in items.items()}
+        keys = sorted(self._key(u, s) for u, s in self._scores.items())
+        last = [self._head] * MAX_LEVEL
+        last_pos = [0] * MAX_LEVEL
+        for pos, key in enumerate(keys, 1):
+            level = self._random_level()
+            self._level = max(self._level, level)
+            node = _Node(key, level)
+            for i in range(level):
+                last[i].next[i] = node
+                last[i].width[i] = pos - last_pos[i]
+                last[i], last_pos[i] = node, pos
+        end = len(keys) + 1
+        for i in range(MAX_LEVEL):
+            last[i].width[i] = end - last_pos[i]
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._scores
+
+    @staticmethod
+    def _key(user_id: int, score: int) -> tuple:
+        return (-score, user_id)
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < MAX_LEVEL and random.random() < P:
+            level += 1
+        return level
+
+    def _find(self, key) -> tuple[list, list]:
+        """Предшественники key на каждом уровне и их позиции (1-based, голова — 0)."""
+        update = [self._head] * MAX_LEVEL
+        pos = [0] * MAX_LEVEL
+        node = self._head
+        cur = 0
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                cur += node.width[i]
+                node = node.next[i]
+            update[i] = node
+            pos[i] = cur
+        return update, pos
+
+    def _insert(self, key) -> None:
+        update, pos = self._find(key)
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                update[i] = self._head
+                pos[i] = 0
+                self._head.width[i] = len(self._scores) + 1
+            self._level = level
+        node = _Node(key, level)
+        rank = pos[0] + 1
+        for i in range(level):
+            prev = update[i]
+            node.next[i] = prev.next[i]
+            prev.next[i] = node
+            # prev.width[i] делится между prev → node и node → старый next
+            node.width[i] = prev.width[i] - (rank - pos[i]) + 1
+            prev.width[i] = rank - pos[i]
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+
+    def _delete(self, key) -> None:
+        update, _ = self._find(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return
+        for i in range(self._level):
+            if update[i].next[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+
+    def update(self, user_id: int, score: int) -> None:
+        """Выставляет счёт пользователя (добавляет или перемещает)."""
+        score = int(score)
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._delete(self._key(user_id, old))
+        self._scores[user_id] = score
+        self._insert(self._key(user_id, score))
+
+    def remove(self, user_id: int) -> None:
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._delete(self._key(user_id, old))
+
+    def score(self, user_id: int) -> int | None:
+        return self._scores.get(user_id)
+
+    def rank(self, user_id: int) -> int | None:
+        """Место пользователя (1 — первое) или None, если его нет в рейтинге."""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        _, pos = self._find(self._key(user_id, score))
+        return pos[0] + 1
+
+    def top(self, n: int = 10, offset: int = 0) -> list[tuple[int, int]]:
+        """[(user_id, score)] с мест offset+1 … offset+n."""
+        node = self._head
+        remaining = offset + 1
+        # спускаемся к элементу с местом offset+1 по ширинам ссылок
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.width[i] <= remaining:
+                remaining -= node.width[i]
+                node = node.next[i]
+        if remaining != 0:
+            # offset+1 за пределами рейтинга
+            return []
+        out = []
+        while node is not None and len(out) < n:
+            out.append((node.key[1], -node.key[0]))
+            node = node.next[0]
+        return out
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import (
+    DeleteMessage,
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    SendMessage,
+)
+
+
+def _markup_hash(markup) -> int:
+    if markup is None:
+        return 0
+    try:
+        return hash(markup.model_dump_json(exclude_none=True))
+    except Exception:
+        return hash(repr(markup))
+
+
+def _text_hash(method) -> int:
+    entities = method.entities
+    return hash((method.text, str(method.parse_mode), repr(entities) if entities else None))
+
+
+class RenderCache(BaseRequestMiddleware):
+    """Middleware сессии бота: не отправляет в Telegram правки, которые ничего не меняют.
+
+    Для последних max_size сообщений помнит хэш показанного текста и клавиатуры
+    по (chat_id, message_id). editMessageText / editMessageReplyMarkup с тем же содержимым
+    не уходят в API (Telegram всё равно ответил бы «message is not modified») — вызывающий
+    получает True, как при успешной правке. Сообщения меняет только сам бот, и все его
+    запросы проходят через этот middleware, поэтому кэш не устаревает.
+    """
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max(1, int(max_size))
+        self._seen: OrderedDict[tuple, tuple[int, int]] = OrderedDict()
+        self.skipped = 0
+        self.passed = 0
+
+    def stats(self) -> dict:
+        total = self.skipped + self.passed
+        return {
+            "skipped": self.skipped,
+            "passed": self.passed,
+            "hit_rate": (self.skipped / total) if total else 0.0,
+            "entries": len(self._seen),
+        }
+
+    def _remember(self, key: tuple, value: tuple[int, int]) -> None:
+        self._seen[key] = value
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, SendMessage):
+            msg = await make_request(bot, method)
+            if msg is not None:
+                self._remember((msg.chat.id, msg.message_id), (_text_hash(method), _markup_hash(method.reply_markup)))
+            return msg
+
+        if isinstance(method, (EditMessageCaption, EditMessageMedia, DeleteMessage)):
+            self._seen.pop((method.chat_id, method.message_id), None)
+            return await make_request(bot, method)
+        if not isinstance(method, (EditMessageText, EditMessageReplyMarkup)) or method.chat_id is None:
+            # прочие методы и правки inline-сообщений (по inline_message_id) — без кэша
+            return await make_request(bot, method)
+        key = (method.chat_id, method.message_id)
+
+        markup = _markup_hash(method.reply_markup)
+        cached = self._seen.get(key)
+        if isinstance(method, EditMessageText):
+            new = (_text_hash(method), markup)
+        else:
+            # правится только клавиатура — текст (если известен) остаётся прежним
+            new = (cached[0] if cached else None, markup)
+        if cached is not None and cached == new:
+            self.skipped += 1
+            self._seen.move_to_end(key)
+            return True
+        self.passed += 1
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            if "not modified" in str(e):
+                # в Telegram уже то же самое — запомним, чтобы не повторять запрос
+                self._remember(key, new)
+            else:
+                self._seen.pop(key, None)
+            raise
+        if new[0] is not None:
+            self._remember(key, new)
+        else:
+            self._seen.pop(key, None)
+        return response
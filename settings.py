@@ -30,8 +30,62 @@ CRYPTO_USDT_LINK = os.getenv("CRYPTO_USDT_LINK", "")
 # Для удобства ниже предполагаем, что USER_PRICE_PER_STAR и COST_PER_STAR выражены в Stars за 1 Star = 1.
 # Если вы хотите мыслить в рублях — храните курс отдельно и конвертируйте.
 
+# Автопокупка: новые заявки сразу покупаются через split.tg, при ошибке уходят админам (1 — включить)
+AUTO_FULFIL = os.getenv("AUTO_FULFIL", "0").strip().lower() in ("1", "true", "yes", "on")
+# Сколько покупок выполнять одновременно
+AUTO_FULFIL_WORKERS = int(os.getenv("AUTO_FULFIL_WORKERS", "1"))
+# Заявки на одного @username за это число секунд покупаются одним заказом (0 — каждая отдельно)
+AUTO_FULFIL_COALESCE_SEC = float(os.getenv("AUTO_FULFIL_COALESCE_SEC", "5"))
+# Процесс с браузером перезапускается после стольких покупок; покупка дольше таймаута (сек) убивает процесс
+SPLIT_WORKER_MAX_JOBS = int(os.getenv("SPLIT_WORKER_MAX_JOBS", "50"))
+SPLIT_WORKER_TIMEOUT = float(os.getenv("SPLIT_WORKER_TIMEOUT", "600"))
+
+# Сроки жизни незавершённых состояний, секунды (0 — не истекают). Истёкшие заявки и счета
+# дописываются в EXPIRED_ARCHIVE_FILE, пользователю (и админам — по заявкам) приходит уведомление.
+# Счёт Crypto Pay живёт 1800 с; ещё 5 минут оставляем на «Проверить оплату»
+EXPIRE_TOPUP_SEC = float(os.getenv("EXPIRE_TOPUP_SEC", "2100"))
+EXPIRE_SBP_SEC = float(os.getenv("EXPIRE_SBP_SEC", str(72 * 3600)))
+EXPIRE_ORDER_SEC = float(os.getenv("EXPIRE_ORDER_SEC", str(72 * 3600)))
+# Брошенный ввод: выбранное количество/сумма, ожидание своей суммы, ожидание новой суммы СБП от админа
+EXPIRE_INPUT_SEC = float(os.getenv("EXPIRE_INPUT_SEC", "3600"))
+EXPIRED_ARCHIVE_FILE = os.getenv("EXPIRED_ARCHIVE_FILE", "expired.jsonl").strip()
+
 SPLIT_EMAIL = os.getenv("SPLIT_EMAIL", "")
 SPLIT_PASSWORD = os.getenv("SPLIT_PASSWORD", "")
+# Адрес split.tg (можно указать локальную копию, см. bench/split_replica.py)
+SPLIT_BASE_URL = os.getenv("SPLIT_BASE_URL", "https://split.tg").strip()
+# Сколько страниц split.tg держать открытыми на форме получателя (0 — открывать сайт на каждый заказ)
+SPLIT_POOL_SIZE = int(os.getenv("SPLIT_POOL_SIZE", "0"))
+# Через сколько секунд прогретая страница переоткрывается заново
+SPLIT_POOL_REFRESH_SEC = float(os.getenv("SPLIT_POOL_REFRESH_SEC", "300"))
+# Блокировать картинки/шрифты/медиа, аналитику и сторонние скрипты при покупке: off / block / dry_run (только считать).
+# По умолчанию dry_run: список разрешённых сторонних скриптов ещё не проверен на живом split.tg —
+# включать block после того, как в dry_run видно, что покупке ничего из заблокированного не нужно.
+SPLIT_BLOCK_RESOURCES = os.getenv("SPLIT_BLOCK_RESOURCES", "dry_run").strip().lower()
+# Дисковый кэш JS/CSS split.tg между заказами (пусто — выключен) и его предел в мегабайтах
+SPLIT_ASSET_CACHE_DIR = os.getenv("SPLIT_ASSET_CACHE_DIR", "split_cache").strip()
+SPLIT_ASSET_CACHE_MB = int(os.getenv("SPLIT_ASSET_CACHE_MB", "200"))
+# Файл, где запоминаются сработавшие селекторы по шагам покупки (пусто — не запоминать)
+SPLIT_SELECTOR_MEMORY = os.getenv("SPLIT_SELECTOR_MEMORY", "split_selectors.json").strip()
+# Каталог отладочных артефактов покупок (скриншоты, HTML, видео неудачных заказов) и его предел в мегабайтах
+SPLIT_ARTIFACTS_DIR = os.getenv("SPLIT_ARTIFACTS_DIR", "split_artifacts").strip()
+SPLIT_ARTIFACTS_MB = int(os.getenv("SPLIT_ARTIFACTS_MB", "100"))
+# Playwright trace: доля заказов (0..1) и порог в мс, выше которого trace заказа сохраняется всегда (0 — выкл.)
+SPLIT_TRACE_SAMPLE = float(os.getenv("SPLIT_TRACE_SAMPLE", "0"))
+SPLIT_TRACE_SLOW_MS = int(os.getenv("SPLIT_TRACE_SLOW_MS", "0"))
+
+# Номер экземпляра бота (0–255), если их запущено несколько — входит в коды заявок, чтобы они не совпадали
+REPLICA_ID = int(os.getenv("REPLICA_ID", "0"))
+
+# Индекс «заявка -> сообщения бота о ней» (правятся на месте при смене статуса) и его предел в заявках
+MSG_INDEX_FILE = os.getenv("MSG_INDEX_FILE", "message_index.json").strip()
+MSG_INDEX_MAX = int(os.getenv("MSG_INDEX_MAX", "20000"))
+# Сколько последних сообщений помнить, чтобы не отправлять правки без изменений
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "5000"))
+# Сколько фоновых задач (проверка оплаты, создание счёта) выполнять одновременно
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "8"))
+# Сколько последних update_id помнить, чтобы не обработать повторно доставленный апдейт
+RECENT_UPDATES_SIZE = int(os.getenv("RECENT_UPDATES_SIZE", "10000"))
 
 ADMIN_IDS = [5206356561, 639822919]
 # Для супергруппы ID обычно отрицательный и начинается с -100
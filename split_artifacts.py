@@ -0,0 +1,190 @@
+import asyncio
+import gzip
+import os
+import shutil
+import threading
+import time
+
+# Что сохраняем сжатым (скриншоты снимаются в JPEG — они уже сжаты)
+GZIP_SUFFIXES = (".html", ".txt", ".json")
+
+
+class ArtifactStore:
+    """Отладочные файлы покупок split.tg: скриншоты, HTML, видео и трассы по id заказа.
+
+    root/
+        tmp/<id>/        — видео/трасса и предварительные скриншоты текущих контекстов; удаляются после успешного заказа
+        <id>/            — сохранённые артефакты (неудачные и медленные заказы)
+
+    Запись идёт в отдельном потоке (asyncio.to_thread), чтобы не стопорить event loop.
+    Общий размер ограничен max_bytes: при превышении удаляются самые старые заказы целиком.
+    Размеры заказов считаются один раз при первой записи, дальше — по ходу записи и удаления.
+    """
+
+    def __init__(self, root: str = "split_artifacts", max_bytes: int = 100 * 1024 * 1024, *, clean_tmp: bool = True):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.tmp_root = os.path.join(root, "tmp")
+        if clean_tmp:
+            # временные каталоги прошлого запуска никому не нужны (clean_tmp=False — только читать, как /traces)
+            shutil.rmtree(self.tmp_root, ignore_errors=True)
+        # id заказа -> байт на диске; None — ещё не считали
+        self._sizes: dict[str, int] | None = None
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id() -> str:
+        """Id, сортируемый по времени: 20250902-153012-1a2b3c."""
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+
+    def tmp_dir(self, art_id: str) -> str:
+        path = os.path.join(self.tmp_root, art_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def order_dir(self, art_id: str) -> str:
+        return os.path.join(self.root, art_id)
+
+    # ======== Запись ========
+
+    def _write(self, art_id: str, name: str, data: bytes, provisional: bool = False) -> str:
+        base = os.path.join(self.tmp_root, art_id) if provisional else self.order_dir(art_id)
+        path = os.path.join(base, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if name.endswith(GZIP_SUFFIXES):
+            path += ".gz"
+            data = gzip.compress(data, compresslevel=6)
+        if provisional:
+            # в лимит не входит: либо переедет в каталог заказа через persist(), либо удалится
+            with open(path, "wb") as f:
+                f.write(data)
+            return path
+        with self._lock:
+            self._scan()
+            old = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._add(art_id, len(data) - old)
+            self._enforce_cap(keep=art_id)
+        return path
+
+    async def save(self, art_id: str, name: str, data: bytes | str, *, provisional: bool = False) -> str | None:
+        """Сохраняет один файл заказа; текст/HTML сжимается gzip. Возвращает путь или None при ошибке.
+        provisional=True — файл кладётся в tmp/<id> и сохраняется, только если заказ потом не удастся (persist).
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        try:
+            return await asyncio.to_thread(self._write, art_id, name, data, provisional)
+        except Exception:
+            return None
+
+    async def capture(self, page, art_id: str, name: str, *, html: bool = True, provisional: bool = False) -> str:
+        """Скриншот (JPEG) и, по желанию, HTML страницы. Возвращает каталог заказа."""
+        try:
+            shot = await page.screenshot(type="jpeg", quality=70, full_page=False)
+            await self.save(art_id, f"{name}.jpg", shot, provisional=provisional)
+        except Exception:
+            pass
+        if html:
+            try:
+                await self.save(art_id, f"{name}.html", await page.content(), provisional=provisional)
+            except Exception:
+                pass
+        return self.order_dir(art_id)
+
+    def _persist(self, art_id: str) -> None:
+        src = os.path.join(self.tmp_root, art_id)
+        if not os.path.isdir(src):
+            return
+        dst = self.order_dir(art_id)
+        os.makedirs(dst, exist_ok=True)
+        with self._lock:
+            self._scan()
+            moved = 0
+            for name in os.listdir(src):
+                path = os.path.join(src, name)
+                size = os.path.getsize(path)
+                # Playwright иногда оставляет пустой .webm, если страница закрылась до первого кадра
+                if size == 0:
+                    continue
+                target = os.path.join(dst, name)
+                moved += size - (os.path.getsize(target) if os.path.exists(target) else 0)
+                os.replace(path, target)
+            self._add(art_id, moved)
+            self._enforce_cap(keep=art_id)
+        shutil.rmtree(src, ignore_errors=True)
+
+    async def persist(self, art_id: str) -> str:
+        """Переносит видео/трассу из tmp в каталог заказа (заказ не удался или был медленным)."""
+        try:
+            await asyncio.to_thread(self._persist, art_id)
+        except Exception:
+            pass
+        return self.order_dir(art_id)
+
+    async def discard(self, art_id: str) -> None:
+        """Удаляет временные файлы контекста (заказ прошёл нормально)."""
+        await asyncio.to_thread(shutil.rmtree, os.path.join(self.tmp_root, art_id), True)
+
+    # ======== Лимит и выборка ========
+
+    def _orders(self) -> list[tuple[str, str]]:
+        """[(id, путь)] сохранённых заказов от старых к новым (id начинается со времени)."""
+        try:
+            names = sorted(n for n in os.listdir(self.root) if n != "tmp")
+        except Exception:
+            return []
+        return [(n, os.path.join(self.root, n)) for n in names if os.path.isdir(os.path.join(self.root, n))]
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        total = 0
+        for dirpath, _, files in os.walk(path):
+            for fn in files:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, fn))
+                except OSError:
+                    pass
+        return total
+
+    def _scan(self) -> None:
+        if self._sizes is not None:
+            return
+        self._sizes = {name: self._dir_size(path) for name, path in self._orders()}
+        self.total_bytes = sum(self._sizes.values())
+
+    def _add(self, art_id: str, delta: int) -> None:
+        self._sizes[art_id] = self._sizes.get(art_id, 0) + delta
+        self.total_bytes += delta
+
+    def _enforce_cap(self, keep: str | None = None) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        # id начинается со времени — сортировка даёт порядок от старых к новым
+        for name in sorted(self._sizes):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self.order_dir(name), ignore_errors=True)
+            self.total_bytes -= self._sizes.pop(name)
+
+    def latest(self, limit: int = 5, *, suffix: str | None = None) -> list[str]:
+        """Пути к файлам последних заказов (свежие первыми); suffix — например ".zip" для трасс."""
+        out = []
+        for _, path in reversed(self._orders()):
+            try:
+                names = sorted(os.listdir(path))
+            except Exception:
+                continue
+            for fn in names:
+                if suffix is None or fn.endswith(suffix):
+                    out.append(os.path.join(path, fn))
+            if len(out) >= limit:
+                break
+        return out[:limit]
@@ -0,0 +1,270 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+# Статика: имя файла (без расширения) в группе 1
+STATIC_RE = re.compile(r"/([^/?#]+)\.(?:js|mjs|css|woff2?|ttf|svg|png|webp)(?:[?#]|$)")
+# Хэш содержимого — последний сегмент имени: не короче 8 символов, есть и цифры, и буквы
+# (3f9a1c0d, B1a2c3D4), а не слово вроде widget/tracking
+_HASH_SEGMENT_RE = re.compile(r"(?=[0-9A-Za-z]*[0-9])(?=[0-9A-Za-z]*[A-Za-z])[0-9A-Za-z]{8,}")
+# Заголовки, которые имеет смысл сохранять вместе с телом (кодировку/длину выставит сам Playwright)
+KEEP_HEADERS = ("content-type", "cache-control", "etag", "last-modified", "access-control-allow-origin")
+
+
+def is_hashed(url: str) -> bool:
+    """Бандл с хэшем в имени (index-B1a2c3D4.js, main.3f9a1c0d.css) — такой файл не меняется."""
+    m = STATIC_RE.search(url)
+    if not m:
+        return False
+    return bool(_HASH_SEGMENT_RE.fullmatch(re.split(r"[.\-_]", m.group(1))[-1]))
+
+
+def _immutable(headers: dict) -> bool:
+    cc = next((v for k, v in headers.items() if k.lower() == "cache-control"), "")
+    return "immutable" in cc.lower()
+
+
+class AssetCache:
+    """Кэш статики split.tg на диске между заказами.
+    Тела лежат по sha256 (objects/ab/abcdef...), индекс URL → sha256 хранится в index.json.
+    Хэшированные бандлы и статика с Cache-Control: immutable отдаются с диска сразу,
+    HTML каждый раз ревалидируется (ETag / Last-Modified).
+    Общий размер ограничен max_bytes, вытесняются давно не использованные URL (LRU).
+    Индекс меняется только в event loop; чтение/запись тел и удаление вытесненных файлов идут
+    в отдельном потоке (asyncio.to_thread), чтобы не стопорить остальные страницы пула.
+    """
+
+    def __init__(self, root: str = "split_cache", max_bytes: int = 200 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self._index: OrderedDict[str, dict] = OrderedDict()
+        # sha256 -> [размер, сколько URL на него ссылаются]
+        self._blobs: dict[str, list[int]] = {}
+        self.total_bytes = 0
+        # тела, на которые больше никто не ссылается, — удаляются с диска в потоке (_collect)
+        self._garbage: list[str] = []
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.saved_bytes = 0
+        self._load()
+
+    # ======== Индекс ========
+
+    def _index_path(self) -> str:
+        return os.path.join(self.root, "index.json")
+
+    def _blob_path(self, sha: str) -> str:
+        return os.path.join(self.root, "objects", sha[:2], sha)
+
+    def _load(self) -> None:
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return
+        if not isinstance(data, list):
+            return
+        # файл хранит записи от старых к свежим — порядок LRU сохраняется
+        for ent in data:
+            try:
+                url, sha, size = str(ent["url"]), str(ent["sha"]), int(ent["size"])
+            except Exception:
+                continue
+            if not os.path.exists(self._blob_path(sha)):
+                continue
+            self._index[url] = {"sha": sha, "size": size, "headers": dict(ent.get("headers") or {})}
+            self._ref(sha, size)
+
+    def flush(self) -> None:
+        """Сохраняет индекс атомарно (если были изменения)."""
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix="index_", dir=self.root)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump([{"url": u, **e} for u, e in self._index.items()], f, ensure_ascii=False)
+            os.replace(tmp_path, self._index_path())
+            self._dirty = False
+        except Exception:
+            pass
+
+    def _ref(self, sha: str, size: int) -> None:
+        blob = self._blobs.get(sha)
+        if blob is None:
+            self._blobs[sha] = [size, 1]
+            self.total_bytes += size
+        else:
+            blob[1] += 1
+
+    def _unref(self, sha: str) -> None:
+        blob = self._blobs.get(sha)
+        if blob is None:
+            return
+        blob[1] -= 1
+        if blob[1] > 0:
+            return
+        self._blobs.pop(sha, None)
+        self.total_bytes -= blob[0]
+        self._garbage.append(sha)
+
+    def _remove_blobs(self, shas: list[str]) -> None:
+        for sha in shas:
+            # тело могли снова сохранить, пока удаление ждало своей очереди
+            if sha in self._blobs:
+                continue
+            try:
+                os.remove(self._blob_path(sha))
+            except Exception:
+                pass
+
+    async def _collect(self) -> None:
+        if self._garbage:
+            shas, self._garbage = self._garbage, []
+            await asyncio.to_thread(self._remove_blobs, shas)
+
+    def _drop(self, url: str) -> None:
+        ent = self._index.pop(url, None)
+        if ent is not None:
+            self._unref(ent["sha"])
+            self._dirty = True
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def _read(self, url: str) -> bytes | None:
+        ent = self._index.get(url)
+        if ent is None:
+            return None
+        try:
+            body = await asyncio.to_thread(self._read_file, self._blob_path(ent["sha"]))
+        except Exception:
+            if self._index.get(url) is ent:
+                self._drop(url)
+                await self._collect()
+            return None
+        if url in self._index:
+            self._index.move_to_end(url)
+        return body
+
+    def _write_blob(self, body: bytes) -> str | None:
+        """sha256 тела; тело пишется на диск, если такого ещё нет. None — записать не удалось."""
+        sha = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(sha)
+        if sha not in self._blobs and not os.path.exists(path):
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.part"
+                with open(tmp_path, "wb") as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+            except Exception:
+                return None
+        return sha
+
+    async def _store(self, url: str, body: bytes, headers: dict) -> None:
+        if len(body) > self.max_bytes:
+            return
+        sha = await asyncio.to_thread(self._write_blob, body)
+        if sha is None:
+            return
+        kept = {k: v for k, v in headers.items() if k.lower() in KEEP_HEADERS}
+        old = self._index.pop(url, None)
+        self._index[url] = {"sha": sha, "size": len(body), "headers": kept}
+        self._ref(sha, len(body))
+        if old is not None:
+            self._unref(old["sha"])
+        self._dirty = True
+        while self.total_bytes > self.max_bytes and self._index:
+            self._drop(next(iter(self._index)))
+        await self._collect()
+
+    # ======== Playwright routing ========
+
+    async def handle(self, route) -> tuple[str, int] | None:
+        """Обрабатывает запрос из context.route.
+        Возвращает (итог, байт отдано с диска): "hit" — отдано с диска, "miss" — скачано и сохранено,
+        "pass" — скачано без сохранения; None — запрос не для кэша (его нужно пропустить дальше).
+        """
+        req = route.request
+        if req.method != "GET":
+            return None
+        if req.resource_type == "document":
+            return await self._handle_document(route)
+        if not STATIC_RE.search(req.url):
+            return None
+        hashed = is_hashed(req.url)
+        ent = self._index.get(req.url)
+        if ent is not None and (hashed or _immutable(ent["headers"])):
+            body = await self._read(req.url)
+            if body is not None:
+                self.hits += 1
+                self.saved_bytes += len(body)
+                await route.fulfill(status=200, headers=ent["headers"], body=body)
+                return "hit", len(body)
+        resp = await route.fetch()
+        body = await resp.body()
+        if resp.status == 200 and (hashed or _immutable(resp.headers)):
+            self.misses += 1
+            await self._store(req.url, body, resp.headers)
+            result = "miss"
+        else:
+            # без хэша в имени и без immutable файл может поменяться — не храним (и забываем старую копию)
+            if ent is not None and self._index.get(req.url) is ent:
+                self._drop(req.url)
+                await self._collect()
+            result = "pass"
+        await route.fulfill(response=resp, body=body)
+        return result, 0
+
+    async def _handle_document(self, route) -> str | None:
+        req = route.request
+        ent = self._index.get(req.url)
+        headers = dict(req.headers)
+        if ent is not None:
+            etag = ent["headers"].get("etag")
+            last_modified = ent["headers"].get("last-modified")
+            if not etag and not last_modified:
+                ent = None
+            if etag:
+                headers["if-none-match"] = etag
+            if last_modified:
+                headers["if-modified-since"] = last_modified
+        resp = await route.fetch(headers=headers)
+        if resp.status == 304 and ent is not None:
+            body = await self._read(req.url)
+            if body is not None:
+                self.revalidated += 1
+                self.hits += 1
+                self.saved_bytes += len(body)
+                await route.fulfill(status=200, headers=self._index[req.url]["headers"], body=body)
+                return "hit", len(body)
+            # тело пропало с диска — запрашиваем страницу целиком
+            resp = await route.fetch()
+        self.misses += 1
+        body = await resp.body()
+        # без валидаторов HTML всё равно пришлось бы качать заново — не храним
+        if resp.status == 200 and (resp.headers.get("etag") or resp.headers.get("last-modified")):
+            await self._store(req.url, body, resp.headers)
+        await route.fulfill(response=resp, body=body)
+        return "miss", 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "saved_bytes": self.saved_bytes,
+            "stored_bytes": self.total_bytes,
+            "entries": len(self._index),
+        }
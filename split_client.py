@@ -1,582 +1,1109 @@
+from collections import deque
 from typing import Optional
-from playwright.async_api import async_playwright
+from urllib.parse import urlsplit
+from split_artifacts import ArtifactStore
+from split_cache import AssetCache
+import asyncio
+import json
 import os
+import random
 import re
+import tempfile
+import time
+
+# Типы ресурсов, без которых форма покупки работает (картинки, шрифты, видео)
+DEFAULT_BLOCK_TYPES = ("image", "media", "font")
+# Аналитика и трекеры — запросы к ним обрываем всегда
+DEFAULT_BLOCK_DOMAINS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "mc.yandex.ru",
+    "facebook.net",
+    "hotjar.com",
+    "clarity.ms",
+    "sentry.io",
+    "segment.io",
+    "amplitude.com",
+    "mixpanel.com",
+)
+# Свои домены сайта: скрипты с них нужны для SPA
+DEFAULT_FIRST_PARTY = ("split.tg",)
+# То, что нужно сценарию покупки, даже если попадает под правила выше (regex по URL)
+DEFAULT_ALLOW = (
+    r"telegram\.org/js/",
+    r"tonconnect",
+)
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    # playwright.async_api.TimeoutError и asyncio.TimeoutError; playwright импортируется лениво
+    return isinstance(exc, asyncio.TimeoutError) or type(exc).__name__ == "TimeoutError"
+
+
+def _host_matches(host: str, domains) -> bool:
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+class RoutePolicy:
+    """Какие запросы можно не загружать во время покупки (через context.route).
+    dry_run=True ничего не блокирует, а только считает, что было бы заблокировано, и сколько это весит.
+    """
+
+    def __init__(self, *, block_types=DEFAULT_BLOCK_TYPES, block_domains=DEFAULT_BLOCK_DOMAINS,
+                 first_party=DEFAULT_FIRST_PARTY, block_third_party_scripts: bool = True,
+                 allow=DEFAULT_ALLOW, dry_run: bool = False):
+        self.block_types = set(block_types)
+        self.block_domains = tuple(block_domains)
+        self.first_party = tuple(first_party)
+        self.block_third_party_scripts = bool(block_third_party_scripts)
+        self.allow = [re.compile(x) for x in allow]
+        self.dry_run = bool(dry_run)
+
+    @classmethod
+    def from_mode(cls, mode: str | None) -> "RoutePolicy | None":
+        """Режим из settings.SPLIT_BLOCK_RESOURCES: "block", "dry_run" или "off"."""
+        mode = (mode or "").strip().lower()
+        if mode == "block":
+            return cls()
+        if mode in ("dry_run", "dry-run", "observe"):
+            return cls(dry_run=True)
+        return None
+
+    def reason(self, url: str, resource_type: str) -> str | None:
+        """Причина блокировки запроса или None, если его нужно пропустить."""
+        if any(rx.search(url) for rx in self.allow):
+            return None
+        host = (urlsplit(url).hostname or "").lower()
+        if _host_matches(host, self.block_domains):
+            return "analytics"
+        if resource_type in self.block_types:
+            return resource_type
+        if self.block_third_party_scripts and resource_type == "script" and not _host_matches(host, self.first_party):
+            return "third_party_script"
+        return None
+
+
+# Результат покупки за один evaluate: текст номера заказа (как .order-id / text=Order ID) и href всех ссылок
+_JS_RESULT = """() => {
+    const text = (el) => el ? (el.textContent || "").trim() || null : null;
+    let orderId = text(document.querySelector(".order-id"));
+    for (const phrase of ["Order ID", "Номер заказа"]) {
+        if (orderId || !document.body) break;
+        const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+        for (let n = walker.nextNode(); n; n = walker.nextNode()) {
+            if (n.nodeValue.includes(phrase)) { orderId = text(n.parentElement); break; }
+        }
+    }
+    const hrefs = Array.from(document.querySelectorAll("a[href]"), (a) => a.getAttribute("href"));
+    return {order_id: orderId, hrefs};
+}"""
+
+# Атрибуты всех видимых input (аналог input:visible) за один evaluate
+_JS_VISIBLE_INPUTS = """(els) => els
+    .filter((e) => !!(e.offsetWidth || e.offsetHeight || e.getClientRects().length))
+    .map((e) => ({
+        type: e.getAttribute("type"),
+        name: e.getAttribute("name"),
+        placeholder: e.getAttribute("placeholder"),
+        aria: e.getAttribute("aria-label"),
+    }))"""
+
+
+def _is_invoice_href(href: str | None) -> bool:
+    return bool(href) and ("t.me/CryptoBot" in href or "t.me/CryptoBot/app" in href or "startapp=invoice-" in href)
+
+
+async def extract_result(page) -> dict:
+    """{"order_id", "invoice_url"} со страницы результата за один round-trip к браузеру."""
+    data = await page.evaluate(_JS_RESULT)
+    invoice_url = next((h for h in data.get("hrefs") or [] if _is_invoice_href(h)), None)
+    return {"order_id": data.get("order_id"), "invoice_url": invoice_url}
+
+
+async def describe_inputs(page) -> list[dict]:
+    """type/name/placeholder/aria-label видимых input за один round-trip к браузеру."""
+    return await page.eval_on_selector_all("input", _JS_VISIBLE_INPUTS)
+
+
+def _sel(selector: str, timeout: int | None = None) -> tuple:
+    """Кандидат-селектор для _click_first/_fill_first: (метка, builder(frame) -> Locator[, свой таймаут])."""
+    def build(fr):
+        return fr.locator(selector)
+    return (selector, build) if timeout is None else (selector, build, timeout)
+
+
+class SelectorMemory:
+    """Помнит, какой селектор сработал на каждом шаге покупки, и хранит это в JSON.
+    Прошлый победитель пробуется первым; после demote_after неудач подряд он теряет приоритет.
+    """
+
+    def __init__(self, path: str = "split_selectors.json", demote_after: int = 2):
+        self.path = path
+        self.demote_after = max(1, int(demote_after))
+        # step -> {"winner": метка | None, "fails": неудач подряд, "wins": {метка: побед}}
+        self._steps: dict[str, dict] = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for step, rec in data.items():
+                    if isinstance(rec, dict):
+                        self._steps[str(step)] = {
+                            "winner": rec.get("winner"),
+                            "fails": int(rec.get("fails", 0)),
+                            "wins": {str(k): int(v) for k, v in (rec.get("wins") or {}).items()},
+                        }
+        except Exception:
+            pass
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        try:
+            tmp_dir = os.path.dirname(self.path) or "."
+            fd, tmp_path = tempfile.mkstemp(prefix="selectors_", dir=tmp_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._steps, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except Exception:
+            pass
+
+    def winner(self, step: str) -> str | None:
+        rec = self._steps.get(step)
+        return rec.get("winner") if rec else None
+
+    def order(self, step: str, candidates: list) -> list:
+        """Кандидаты в порядке попыток: прошлый победитель первым, остальные — как в коде."""
+        win = self.winner(step)
+        if not win:
+            return list(candidates)
+        first = [c for c in candidates if c[0] == win]
+        return first + [c for c in candidates if c[0] != win]
+
+    def record(self, step: str, label: str, *, ok: bool) -> None:
+        rec = self._steps.setdefault(step, {"winner": None, "fails": 0, "wins": {}})
+        if ok:
+            rec["wins"][label] = rec["wins"].get(label, 0) + 1
+            rec["winner"] = label
+            rec["fails"] = 0
+        elif label == rec.get("winner"):
+            rec["fails"] += 1
+            if rec["fails"] >= self.demote_after:
+                rec["winner"] = None
+                rec["fails"] = 0
+        self._dirty = True
+
+
+class RouteStats:
+    """Счётчики запросов одного заказа (одного browser context)."""
+
+    def __init__(self):
+        self.requests = 0
+        self.blocked = 0
+        # вес заблокированного: известен точно в dry_run, иначе — по размеру, виденному раньше
+        self.blocked_bytes = 0
+        self.loaded_bytes = 0
+        self.by_reason: dict[str, int] = {}
+        # отдано из AssetCache без сети
+        self.cache_hits = 0
+        self.cache_bytes = 0
+
+    def add(self, other: "RouteStats") -> None:
+        self.requests += other.requests
+        self.blocked += other.blocked
+        self.blocked_bytes += other.blocked_bytes
+        self.loaded_bytes += other.loaded_bytes
+        self.cache_hits += other.cache_hits
+        self.cache_bytes += other.cache_bytes
+        for k, v in other.by_reason.items():
+            self.by_reason[k] = self.by_reason.get(k, 0) + v
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "blocked": self.blocked,
+            "blocked_bytes": self.blocked_bytes,
+            "loaded_bytes": self.loaded_bytes,
+            "cache_hits": self.cache_hits,
+            "cache_bytes": self.cache_bytes,
+            "by_reason": dict(self.by_reason),
+        }
+
+
+class StepMetrics:
+    """Скользящая статистика времени шагов buy_stars: последние window замеров на шаг → p50/p95."""
+
+    def __init__(self, window: int = 500):
+        self.window = max(1, int(window))
+        self._elapsed: dict[str, deque] = {}
+        self._timeouts: dict[str, int] = {}
+        self._fallbacks: dict[str, int] = {}
+
+    def observe(self, spans: list[dict]) -> None:
+        for span in spans:
+            step = span.get("step")
+            if not step:
+                continue
+            self._elapsed.setdefault(step, deque(maxlen=self.window)).append(int(span.get("elapsed_ms") or 0))
+            if span.get("timed_out"):
+                self._timeouts[step] = self._timeouts.get(step, 0) + int(span["timed_out"])
+            if span.get("fallback"):
+                self._fallbacks[step] = self._fallbacks.get(step, 0) + 1
+
+    @staticmethod
+    def _pct(values: list[int], q: float) -> int:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    def summary(self) -> dict:
+        """{step: {"count", "p50_ms", "p95_ms", "timeouts", "fallbacks"}}, шаги — в порядке первого появления."""
+        out = {}
+        for step, values in self._elapsed.items():
+            vals = list(values)
+            out[step] = {
+                "count": len(vals),
+                "p50_ms": self._pct(vals, 0.5),
+                "p95_ms": self._pct(vals, 0.95),
+                "timeouts": self._timeouts.get(step, 0),
+                "fallbacks": self._fallbacks.get(step, 0),
+            }
+        return out
+
 
 class SplitClient:
     """Грубый пример headless-скрипта для оформления покупки на split.tg.
     ⚠️ Сайт и селекторы могут меняться. Вам потребуется актуализировать селекторы под реальную разметку.
     """
 
-    def __init__(self, email: str, password: str, *, headless: bool | None = None, slow_mo: int | None = None, record_video: bool = False):
+    def __init__(self, email: str, password: str, *, headless: bool | None = None, slow_mo: int | None = None, record_video: bool = False,
+                 pool_size: int = 0, pool_refresh_sec: float = 300.0, route_policy: RoutePolicy | None = None,
+                 asset_cache: AssetCache | None = None, selector_memory: SelectorMemory | None = None,
+                 base_url: str = "https://split.tg", artifacts: ArtifactStore | None = None,
+                 trace_sample: float = 0.0, trace_slow_ms: int = 0):
         self.email = email
         self.password = password
         # Опции видимости/отладки (по умолчанию быстрый режим)
         self.headless = True if headless is None else bool(headless)
         self.slow_mo = 0 if slow_mo is None else int(slow_mo)
         self.record_video = bool(record_video)
+        # Пул заранее открытых страниц с формой "Buy Stars to User" (0 — без пула, как раньше)
+        self.pool_size = max(0, int(pool_size or 0))
+        # Через сколько секунд прогретую страницу нужно открыть заново (сессия/цены на сайте устаревают)
+        self.pool_refresh_sec = max(30.0, float(pool_refresh_sec))
+        self._pw = None
+        self._browser = None
+        self._pool: asyncio.Queue | None = None
+        self._refresher: asyncio.Task | None = None
+        self._warming: set[asyncio.Task] = set()
+        # Адрес сайта (для локальной копии split.tg — например, http://127.0.0.1:8765)
+        self.base_url = (base_url or "https://split.tg").rstrip("/")
+        # Политика блокировки лишних запросов (None — грузим всё, как браузер)
+        self.route_policy = route_policy
+        base_host = (urlsplit(self.base_url).hostname or "").lower()
+        if route_policy is not None and base_host and not _host_matches(base_host, route_policy.first_party):
+            # скрипты самого сайта не считаем сторонними
+            route_policy.first_party = route_policy.first_party + (base_host,)
+        self._route_stats: dict = {}
+        # размеры ответов по URL — чтобы оценивать вес заблокированного
+        self._size_hint: dict[str, int] = {}
+        self.last_route_stats: RouteStats | None = None
+        # Дисковый кэш JS/CSS split.tg между заказами (None — без кэша)
+        self.asset_cache = asset_cache
+        # Какие селекторы срабатывали раньше — с них и начинаем (None — порядок как в коде)
+        self.selector_memory = selector_memory
+        # Трасса шагов (какой кандидат победил и за сколько) по контекстам; каждый buy_stars собирает свою
+        # в локальный список, last_trace — только снимок последнего завершившегося заказа (для чтения)
+        self._step_trace: dict = {}
+        self.last_trace: list[dict] = []
+        # p50/p95 по шагам за последние заказы
+        self.step_metrics = StepMetrics()
+        # Скриншоты/HTML/видео по id заказа с лимитом размера (None — старые split_debug_* в рабочем каталоге)
+        self.artifacts = artifacts
+        self._art_ids: dict = {}
+        # каталог с артефактами последнего неудачного заказа
+        self.last_artifact_dir: str | None = None
+        # Playwright trace (снимки DOM + сеть) для доли заказов trace_sample и для всех медленнее trace_slow_ms.
+        # Пишется только вместе с artifacts: trace.zip попадает в каталог заказа (смотреть — npx playwright show-trace).
+        self.trace_sample = min(1.0, max(0.0, float(trace_sample or 0)))
+        self.trace_slow_ms = max(0, int(trace_slow_ms or 0))
+        self._tracing: dict = {}
+        self.route_totals = RouteStats()
 
-    async def buy_stars(self, tg_username: str, qty: int, *, asset_preference: str = "TON") -> str:
-        """Покупает qty звёзд на пользователя tg_username. Возвращает id заказа/квитанции.
+    @classmethod
+    def from_settings(cls, settings) -> "SplitClient":
+        """Клиент со всеми опциями из settings.py (SPLIT_*): пул, блокировка запросов, кэш, артефакты, trace."""
+        cache_dir = getattr(settings, "SPLIT_ASSET_CACHE_DIR", "")
+        memory_path = getattr(settings, "SPLIT_SELECTOR_MEMORY", "")
+        artifacts_dir = getattr(settings, "SPLIT_ARTIFACTS_DIR", "")
+        return cls(
+            getattr(settings, "SPLIT_EMAIL", ""),
+            getattr(settings, "SPLIT_PASSWORD", ""),
+            pool_size=getattr(settings, "SPLIT_POOL_SIZE", 0),
+            pool_refresh_sec=getattr(settings, "SPLIT_POOL_REFRESH_SEC", 300.0),
+            route_policy=RoutePolicy.from_mode(getattr(settings, "SPLIT_BLOCK_RESOURCES", "dry_run")),
+            asset_cache=AssetCache(cache_dir, getattr(settings, "SPLIT_ASSET_CACHE_MB", 200) * 1024 * 1024) if cache_dir else None,
+            selector_memory=SelectorMemory(memory_path) if memory_path else None,
+            base_url=getattr(settings, "SPLIT_BASE_URL", "https://split.tg"),
+            artifacts=ArtifactStore(artifacts_dir, getattr(settings, "SPLIT_ARTIFACTS_MB", 100) * 1024 * 1024) if artifacts_dir else None,
+            trace_sample=getattr(settings, "SPLIT_TRACE_SAMPLE", 0.0),
+            trace_slow_ms=getattr(settings, "SPLIT_TRACE_SLOW_MS", 0),
+        )
+
+    # ======== Постоянный браузер и пул прогретых страниц ========
+
+    async def start(self) -> None:
+        """Запускает постоянный браузер и прогревает pool_size страниц до формы получателя.
+        Без вызова start() каждая покупка, как и раньше, поднимает браузер с нуля.
         """
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=self.headless, slow_mo=self.slow_mo)
-            ctx_kwargs = {}
-            if self.record_video:
-                os.makedirs("videos", exist_ok=True)
-                ctx_kwargs["record_video_dir"] = "videos"
-            context = await browser.new_context(**ctx_kwargs)
-            page = await context.new_page()
-
-            # Увеличим таймауты по-умолчанию, чтобы не спешить
+        if self._browser is not None:
+            return
+        from playwright.async_api import async_playwright
+
+        self._pw = await async_playwright().start()
+        self._browser = await self._pw.chromium.launch(headless=self.headless, slow_mo=self.slow_mo)
+        self._pool = asyncio.Queue()
+        for _ in range(self.pool_size):
+            self._spawn_warm()
+        if self.pool_size:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        """Останавливает прогрев, закрывает страницы пула и браузер."""
+        tasks = list(self._warming)
+        if self._refresher:
+            tasks.append(self._refresher)
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._refresher = None
+        if self._pool is not None:
+            while not self._pool.empty():
+                _, context, _ = self._pool.get_nowait()
+                await self._release(context)
+        self._pool = None
+        if self._browser is not None:
             try:
-                page.set_default_timeout(90000)
+                await self._browser.close()
             except Exception:
                 pass
-
-            # 1) Открыть сайт
-            await page.goto("https://split.tg/stars", wait_until="domcontentloaded")
+            self._browser = None
+        if self._pw is not None:
             try:
-                await page.wait_for_load_state("networkidle", timeout=60000)
+                await self._pw.stop()
             except Exception:
                 pass
+            self._pw = None
+
+    def pool_ready(self) -> int:
+        """Сколько прогретых страниц сейчас ждут заказа."""
+        return self._pool.qsize() if self._pool is not None else 0
 
-            # Переход в раздел "Premium & Stars" (SPA: без обязательной навигации)
-            opened_store = False
+    async def _new_page(self, browser):
+        ctx_kwargs = {}
+        art_id = self.artifacts.new_id() if self.artifacts is not None else None
+        if self.record_video and art_id:
+            # видео пишется во временный каталог и сохраняется, только если заказ не удался
+            ctx_kwargs["record_video_dir"] = self.artifacts.tmp_dir(art_id)
+        elif self.record_video:
+            os.makedirs("videos", exist_ok=True)
+            ctx_kwargs["record_video_dir"] = "videos"
+        context = await browser.new_context(**ctx_kwargs)
+        if art_id:
+            self._art_ids[context] = art_id
+            sampled = random.random() < self.trace_sample
+            # порог по времени заранее не проверить — при trace_slow_ms пишем всегда, а лишнее выбрасываем
+            if sampled or self.trace_slow_ms:
+                try:
+                    await context.tracing.start(title=art_id, screenshots=True, snapshots=True)
+                    self._tracing[context] = sampled
+                except Exception:
+                    pass
+        if self.route_policy is not None or self.asset_cache is not None:
+            await self._install_routes(context)
+        page = await context.new_page()
+
+        # Увеличим таймауты по-умолчанию, чтобы не спешить
+        try:
+            page.set_default_timeout(90000)
+        except Exception:
+            pass
+        return context, page
+
+    async def _install_routes(self, context) -> None:
+        # Один обработчик на всё: сначала политика блокировки, затем дисковый кэш.
+        # NB: при включённом routing Chromium не использует свой HTTP-кэш, поэтому AssetCache здесь особенно полезен.
+        policy = self.route_policy
+        cache = self.asset_cache
+        stats = RouteStats()
+        self._route_stats[context] = stats
+        would_block: dict = {}
+        from_cache: set = set()
+
+        async def _handle(route):
+            req = route.request
+            stats.requests += 1
+            reason = policy.reason(req.url, req.resource_type) if policy is not None else None
+            if reason is not None:
+                stats.blocked += 1
+                stats.by_reason[reason] = stats.by_reason.get(reason, 0) + 1
+                if policy.dry_run:
+                    would_block[req] = reason
+                    await route.continue_()
+                    return
+                stats.blocked_bytes += self._size_hint.get(req.url, 0)
+                await route.abort("blockedbyclient")
+                return
+            if cache is not None:
+                try:
+                    served = await cache.handle(route)
+                except Exception:
+                    served = None
+                if served is not None:
+                    result, size = served
+                    if result == "hit":
+                        from_cache.add(req)
+                        stats.cache_hits += 1
+                        stats.cache_bytes += size
+                    return
+            await route.continue_()
+
+        async def _finished(req):
             try:
-                link = page.locator("a[href='/store'][data-discover='true']")
-                await link.wait_for(timeout=10000)
-                await link.scroll_into_view_if_needed(timeout=2000)
-                await link.click()
-                opened_store = True
+                size = int((await req.sizes()).get("responseBodySize") or 0)
             except Exception:
-                premium_selectors = [
-                    "a[href='/store']",
-                    "a:has-text('Premium & Stars')",
-                    "button:has-text('Premium & Stars')",
-                    "[role=tab]:has-text('Premium & Stars')",
-                    "text=Premium & Stars",
-                ]
-                for sel in premium_selectors:
-                    try:
-                        el = page.locator(sel)
-                        await el.wait_for(timeout=5000)
-                        try:
-                            await el.scroll_into_view_if_needed(timeout=2000)
-                        except Exception:
-                            pass
-                        await el.click()
-                        opened_store = True
-                        break
-                    except Exception:
-                        continue
+                return
+            if len(self._size_hint) > 5000:
+                self._size_hint.clear()
+            self._size_hint[req.url] = size
+            if req in from_cache:
+                from_cache.discard(req)
+            elif would_block.pop(req, None) is not None:
+                stats.blocked_bytes += size
+            else:
+                stats.loaded_bytes += size
+
+        await context.route("**/*", _handle)
+        context.on("requestfinished", _finished)
 
-            # Ждём смены URL/контента магазина
+    async def _release(self, context, *, order: bool = False, failed: bool = False, started: float | None = None,
+                       trace_out: list | None = None) -> None:
+        """Закрывает context; для заказа запоминает его счётчики запросов, а spans шагов дописывает в trace_out.
+        Видео и trace контекста сохраняются в артефакты для неудачного (failed), медленного
+        (дольше trace_slow_ms от started) или попавшего в выборку заказа, иначе удаляются.
+        """
+        stats = self._route_stats.pop(context, None)
+        trace = self._step_trace.pop(context, [])
+        if order and trace_out is not None:
+            trace_out.extend(trace)
+        if order and stats is not None:
+            self.last_route_stats = stats
+            self.route_totals.add(stats)
+        if order and self.asset_cache is not None:
+            self.asset_cache.flush()
+        if order and self.selector_memory is not None:
+            self.selector_memory.flush()
+        art_id = self._art_ids.pop(context, None)
+        slow = bool(order and started is not None and self.trace_slow_ms
+                    and (time.monotonic() - started) * 1000 >= self.trace_slow_ms)
+        keep = bool(order and (failed or slow))
+        if context in self._tracing:
+            sampled = self._tracing.pop(context)
+            keep = keep or bool(order and sampled)
             try:
-                await page.wait_for_url("**/store*", timeout=15000)
+                if keep and art_id:
+                    await context.tracing.stop(path=os.path.join(self.artifacts.tmp_dir(art_id), "trace.zip"))
+                else:
+                    await context.tracing.stop()
             except Exception:
                 pass
+        try:
+            await context.close()
+        except Exception:
+            pass
+        # видео дописывается на диск при закрытии контекста — только теперь его можно переносить
+        if art_id and self.artifacts is not None:
+            if keep:
+                self.last_artifact_dir = await self.artifacts.persist(art_id)
+            else:
+                await self.artifacts.discard(art_id)
+
+    def _spawn_warm(self) -> None:
+        t = asyncio.create_task(self._warm_one())
+        self._warming.add(t)
+        t.add_done_callback(self._warming.discard)
+
+    async def _warm_one(self) -> None:
+        context, page = await self._new_page(self._browser)
+        try:
+            await self._open_recipient_form(page)
+        except Exception:
+            # не удалось прогреть (сайт недоступен и т.п.) — страницу выбрасываем, заказ откроет форму сам
+            await self._release(context)
+            return
+        if self._pool is None:
+            await self._release(context)
+            return
+        # навигация прогрева не относится к заказу — в его трассе только заполнение формы
+        self._step_trace.pop(context, None)
+        if context in self._tracing:
             try:
-                await page.wait_for_load_state("networkidle", timeout=30000)
+                await context.tracing.stop_chunk()
+                await context.tracing.start_chunk(title=self._art_ids.get(context))
             except Exception:
                 pass
+        await self._pool.put((time.monotonic(), context, page))
 
-            # Переходим в карточку товара Telegram Stars, если на /store список товаров
-            product_opened = False
-            product_candidates = [
-                "a[href*='/stars']",
-                "a:has-text('Telegram Stars')",
-                "button:has-text('Telegram Stars')",
-                "text=Telegram Stars",
-            ]
-            for sel in product_candidates:
+    async def _refresh_loop(self) -> None:
+        # Периодически переоткрываем устаревшие страницы и добираем пул до pool_size
+        while True:
+            await asyncio.sleep(min(30.0, self.pool_refresh_sec / 2))
+            now = time.monotonic()
+            for _ in range(self._pool.qsize()):
                 try:
-                    el = page.locator(sel)
-                    await el.wait_for(timeout=5000)
-                    try:
-                        await el.scroll_into_view_if_needed(timeout=2000)
-                    except Exception:
-                        pass
-                    await el.click()
-                    product_opened = True
-                    try:
-                        await page.wait_for_url("**/stars*", timeout=10000)
-                    except Exception:
-                        pass
-                    try:
-                        await page.wait_for_load_state("networkidle", timeout=15000)
-                    except Exception:
-                        pass
+                    item = self._pool.get_nowait()
+                except asyncio.QueueEmpty:
                     break
-                except Exception:
+                warmed_at, context, page = item
+                if now - warmed_at < self.pool_refresh_sec and not page.is_closed():
+                    self._pool.put_nowait(item)
                     continue
-            if product_opened:
+                await self._release(context)
+                self._spawn_warm()
+            missing = self.pool_size - self._pool.qsize() - len(self._warming)
+            for _ in range(max(0, missing)):
+                self._spawn_warm()
+
+    async def _acquire_page(self, trace_out: list | None = None):
+        """Берёт прогретую страницу из пула (и сразу заказывает замену) или открывает форму с нуля."""
+        while self._pool is not None and not self._pool.empty():
+            _, context, page = self._pool.get_nowait()
+            self._spawn_warm()
+            if not page.is_closed():
+                return context, page
+            await self._release(context)
+        context, page = await self._new_page(self._browser)
+        try:
+            await self._open_recipient_form(page)
+        except Exception:
+            await self._release(context, order=True, failed=True, trace_out=trace_out)
+            raise
+        return context, page
+
+    # ======== Покупка ========
+
+    async def buy_stars(self, tg_username: str, qty: int, *, asset_preference: str = "TON", with_timings: bool = False):
+        """Покупает qty звёзд на пользователя tg_username. Возвращает id заказа/квитанции.
+        После start() использует прогретую страницу из пула: остаётся только заполнить форму.
+        С with_timings=True возвращает (id, spans) — время каждого шага этого заказа.
+        Заказы могут идти одновременно (воркер SplitWorker): spans собираются в локальный список вызова,
+        last_trace — лишь копия трассы последнего завершившегося заказа.
+        """
+        trace: list[dict] = []
+        t0 = time.monotonic()
+        try:
+            result = await self._buy(tg_username, qty, asset_preference=asset_preference, trace_out=trace)
+        finally:
+            # итоговый span и агрегаты пишем и для неудачных заказов — они как раз самые интересные
+            total_ms = int((time.monotonic() - t0) * 1000)
+            trace.append({
+                "step": "total",
+                "elapsed_ms": total_ms,
+                "winner": None,
+                "fallback": None,
+                "probes": sum(int(s.get("probes") or 0) for s in trace),
+                "failed": sum(int(s.get("failed") or 0) for s in trace),
+                "timed_out": sum(int(s.get("timed_out") or 0) for s in trace),
+                "wait_ms": sum(int(s.get("wait_ms") or 0) for s in trace),
+            })
+            self.step_metrics.observe(trace)
+            self.last_trace = list(trace)
+        if with_timings:
+            return result, trace
+        return result
+
+    async def _buy(self, tg_username: str, qty: int, *, asset_preference: str = "TON", trace_out: list | None = None) -> str:
+        started = time.monotonic()
+        if self._browser is not None:
+            context, page = await self._acquire_page(trace_out)
+            failed = True
+            try:
+                result = await self._fill_and_submit(page, tg_username, qty, asset_preference=asset_preference)
+                failed = False
+                return result
+            finally:
+                await self._release(context, order=True, failed=failed, started=started, trace_out=trace_out)
+
+        from playwright.async_api import async_playwright
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=self.headless, slow_mo=self.slow_mo)
+            context, page = await self._new_page(browser)
+            failed = True
+            try:
+                await self._open_recipient_form(page)
+                result = await self._fill_and_submit(page, tg_username, qty, asset_preference=asset_preference)
+                failed = False
+                return result
+            finally:
+                await self._release(context, order=True, failed=failed, started=started, trace_out=trace_out)
                 try:
-                    await page.wait_for_load_state("networkidle", timeout=60000)
+                    await browser.close()
                 except Exception:
                     pass
 
-            # Нажимаем кнопку/ссылку "Buy Stars to User" (может быть <a> или <button> со вложенным <span>)
-            buy_to_user_clicked = False
-            buy_to_user_locators = [
-                page.get_by_role("button", name="Buy Stars to User"),
-                page.locator("a:has(span:has-text('Buy Stars to User'))"),
-                page.locator("button:has(span:has-text('Buy Stars to User'))"),
-                page.get_by_text("Buy Stars to User", exact=True),
-                page.locator("xpath=//*[self::a or self::button][.//span[contains(normalize-space(.), 'Buy Stars to User')]]"),
-            ]
-            for loc in buy_to_user_locators:
+    async def _open_recipient_form(self, page) -> None:
+        """Навигация до формы "Buy Stars to User": одинакова для всех заказов, поэтому её можно делать заранее."""
+        main = [page.main_frame]
+
+        # 1) Открыть сайт
+        await self._timed(page, "navigation", page.goto(f"{self.base_url}/stars", wait_until="domcontentloaded"), swallow=False)
+        await self._timed(page, "navigation_idle", page.wait_for_load_state("networkidle", timeout=60000))
+
+        # Переход в раздел "Premium & Stars" (SPA: без обязательной навигации)
+        await self._click_first("store_link", main, [
+            _sel("a[href='/store'][data-discover='true']", 10000),
+            _sel("a[href='/store']"),
+            _sel("a:has-text('Premium & Stars')"),
+            _sel("button:has-text('Premium & Stars')"),
+            _sel("[role=tab]:has-text('Premium & Stars')"),
+            _sel("text=Premium & Stars"),
+        ], wait_timeout=5000)
+
+        # Ждём смены URL/контента магазина
+        await self._timed(page, "store_url", page.wait_for_url("**/store*", timeout=15000))
+        await self._timed(page, "store_idle", page.wait_for_load_state("networkidle", timeout=30000))
+
+        # Переходим в карточку товара Telegram Stars, если на /store список товаров
+        product_opened = await self._click_first("product_card", main, [
+            _sel("a[href*='/stars']"),
+            _sel("a:has-text('Telegram Stars')"),
+            _sel("button:has-text('Telegram Stars')"),
+            _sel("text=Telegram Stars"),
+        ], wait_timeout=5000)
+        if product_opened:
+            await self._timed(page, "product_url", page.wait_for_url("**/stars*", timeout=10000))
+            await self._timed(page, "product_idle", page.wait_for_load_state("networkidle", timeout=15000))
+            await self._timed(page, "product_settle", page.wait_for_load_state("networkidle", timeout=60000))
+
+        # Нажимаем кнопку/ссылку "Buy Stars to User" (может быть <a> или <button> со вложенным <span>)
+        buy_to_user_clicked = await self._click_first("buy_to_user", main, [
+            ("role=button[name='Buy Stars to User']", lambda fr: fr.get_by_role("button", name="Buy Stars to User")),
+            _sel("a:has(span:has-text('Buy Stars to User'))"),
+            _sel("button:has(span:has-text('Buy Stars to User'))"),
+            ("text='Buy Stars to User'", lambda fr: fr.get_by_text("Buy Stars to User", exact=True)),
+            _sel("xpath=//*[self::a or self::button][.//span[contains(normalize-space(.), 'Buy Stars to User')]]"),
+        ], wait_timeout=15000)
+        if not buy_to_user_clicked:
+            await self._capture(page, "no_buy_to_user", html=False, provisional=True)
+            # некоторые страницы сразу показывают форму без этой кнопки — продолжаем
+
+        # после клика подождём дорендер формы
+        await self._timed(page, "form_idle", page.wait_for_load_state("networkidle", timeout=15000))
+
+        await self._accept_cookies(page)
+
+    async def _accept_cookies(self, page):
+        # Пытаемся закрыть баннер согласия с cookies, если он мешает кликам
+        await self._click_first("cookies", [page.main_frame], [
+            _sel("button:has-text('Accept')"),
+            _sel("button:has-text('I agree')"),
+            _sel("button:has-text('Я согласен')"),
+            _sel("button:has-text('Принять')"),
+            _sel("text=Accept"),
+            _sel("text=Принять"),
+        ], wait_timeout=2000)
+
+    # ======== Перебор селекторов ========
+
+    def _ordered(self, step: str, candidates: list) -> list:
+        if self.selector_memory is None:
+            return list(candidates)
+        return self.selector_memory.order(step, candidates)
+
+    async def _first_match(self, step: str, frames, candidates: list, wait_timeout: int, act) -> str | None:
+        """Ищет кандидат, для которого act(locator) прошёл без ошибок; возвращает его метку.
+        Кандидат — (метка, builder(frame) -> Locator[, свой таймаут]).
+        Все фреймы × кандидаты ждутся одновременно с общим дедлайном шага: побеждает первый видимый,
+        а если видимы сразу несколько — тот, что раньше в списке. Остальные ожидания отменяются.
+        """
+        memory = self.selector_memory
+        remembered = memory.winner(step) if memory is not None else None
+        probes = []
+        for fr in frames:
+            for cand in self._ordered(step, candidates):
                 try:
-                    await loc.wait_for(timeout=15000)
+                    loc = cand[1](fr)
+                except Exception:
+                    continue
+                probes.append((cand[0], loc, cand[2] if len(cand) > 2 else wait_timeout))
+        declared = [c[0] for c in candidates]
+        deadline_ms = max([wait_timeout] + [t for _, _, t in probes])
+        t0 = time.monotonic()
+        tasks = {asyncio.create_task(loc.wait_for(timeout=t)): i for i, (_, loc, t) in enumerate(probes)}
+        pending = set(tasks)
+        failed = 0
+        timed_out = 0
+        wait_ms = None
+        winner = None
+        try:
+            while pending and winner is None:
+                left = deadline_ms / 1000 - (time.monotonic() - t0)
+                if left <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+                ready = sorted(tasks[t] for t in done if t.exception() is None)
+                for t in done:
+                    if t.exception() is not None:
+                        # свой таймаут кандидата истёк раньше дедлайна шага — это тоже «не дождались»
+                        if _is_timeout(t.exception()):
+                            timed_out += 1
+                        else:
+                            failed += 1
+                if not ready:
+                    continue
+                if wait_ms is None:
+                    wait_ms = int((time.monotonic() - t0) * 1000)
+                # кандидаты выше по списку могли стать видимыми одновременно — проверяем их без ожидания
+                higher = sorted(tasks[t] for t in pending if tasks[t] < ready[0])
+                if higher:
+                    vis = await asyncio.gather(*(probes[i][1].is_visible() for i in higher), return_exceptions=True)
+                    ready = [i for i, v in zip(higher, vis) if v is True] + ready
+                for i in ready:
                     try:
-                        await loc.scroll_into_view_if_needed(timeout=2000)
+                        await act(probes[i][1])
                     except Exception:
-                        pass
-                    await loc.click()
-                    buy_to_user_clicked = True
+                        failed += 1
+                        continue
+                    winner = probes[i][0]
                     break
-                except Exception:
-                    continue
-            if not buy_to_user_clicked:
-                try:
-                    await page.screenshot(path="split_debug_no_buy_to_user.png")
-                except Exception:
-                    pass
-                # некоторые страницы сразу показывают форму без этой кнопки — продолжаем
+        finally:
+            if winner is None:
+                # не дождались до дедлайна шага
+                timed_out += len(pending)
+            for t in pending:
+                t.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        elapsed_ms = int((time.monotonic() - t0) * 1000)
+        if memory is not None:
+            if remembered and winner != remembered:
+                # прошлый победитель не сработал — понижаем
+                memory.record(step, remembered, ok=False)
+            if winner:
+                memory.record(step, winner, ok=True)
+        self._record_span(frames[0].page if frames else None, {
+            "step": step,
+            "elapsed_ms": elapsed_ms,
+            "winner": winner,
+            # номер сработавшего кандидата в списке из кода: 0 — основной селектор, >0 — fallback
+            "fallback": declared.index(winner) if winner in declared else None,
+            "probes": len(probes),
+            "failed": failed,
+            "timed_out": timed_out,
+            # сколько ждали появления первого подходящего элемента (остальное — клик/ввод)
+            "wait_ms": elapsed_ms if wait_ms is None else wait_ms,
+        })
+        return winner
+
+    async def _timed(self, page, step: str, awaitable, *, swallow: bool = True) -> bool:
+        """Ожидание (goto / networkidle / wait_for_url) как отдельный span; таймаут по умолчанию не пробрасывается."""
+        t0 = time.monotonic()
+        ok = True
+        try:
+            await awaitable
+        except Exception:
+            ok = False
+            if not swallow:
+                raise
+        finally:
+            elapsed_ms = int((time.monotonic() - t0) * 1000)
+            self._record_span(page, {
+                "step": step,
+                "elapsed_ms": elapsed_ms,
+                "winner": None,
+                "fallback": None,
+                "probes": 0,
+                "failed": 0,
+                "timed_out": 0 if ok else 1,
+                "wait_ms": elapsed_ms,
+            })
+        return ok
+
+    def _record_span(self, page, span: dict) -> None:
+        try:
+            context = page.context
+        except Exception:
+            return
+        self._step_trace.setdefault(context, []).append(span)
+
+    async def _save_artifact(self, page, name: str, data) -> str:
+        """Пишет файл в артефакты заказа (или, без ArtifactStore, как раньше — split_<name> в рабочий каталог)."""
+        art_id = self._art_ids.get(page.context)
+        if self.artifacts is not None and art_id:
+            await self.artifacts.save(art_id, name, data)
+            return self.artifacts.order_dir(art_id)
+        path = f"split_{name}"
+        mode = "wb" if isinstance(data, bytes) else "w"
 
-            # после клика подождём дорендер формы
+        def _write():
+            with open(path, mode, **({} if mode == "wb" else {"encoding": "utf-8"})) as f:
+                f.write(data)
+
+        await asyncio.to_thread(_write)
+        return path
+
+    async def _capture(self, page, name: str, *, html: bool = True, provisional: bool = False) -> str:
+        """Скриншот и HTML страницы на шаге, где что-то не нашлось. Возвращает, куда сохранено.
+        provisional=True — для шагов, после которых покупка продолжается: снимок сохранится, только если заказ не удастся.
+        """
+        art_id = self._art_ids.get(page.context)
+        if self.artifacts is not None and art_id:
+            return await self.artifacts.capture(page, art_id, name, html=html, provisional=provisional)
+        try:
+            await self._save_artifact(page, f"debug_{name}.png", await page.screenshot())
+            if html:
+                await self._save_artifact(page, f"debug_{name}.html", await page.content())
+        except Exception:
+            pass
+        return f"split_debug_{name}.png" + (" / .html" if html else "")
+
+    async def _click_first(self, step: str, frames, candidates: list, wait_timeout=60000) -> str | None:
+        async def _click(loc):
             try:
-                await page.wait_for_load_state("networkidle", timeout=15000)
+                await loc.scroll_into_view_if_needed(timeout=2000)
             except Exception:
                 pass
+            await loc.click()
 
-            async def _accept_cookies():
-                # Пытаемся закрыть баннер согласия с cookies, если он мешает кликам
-                candidates = [
-                    "button:has-text('Accept')",
-                    "button:has-text('I agree')",
-                    "button:has-text('Я согласен')",
-                    "button:has-text('Принять')",
-                    "text=Accept",
-                    "text=Принять",
-                ]
-                for sel in candidates:
-                    try:
-                        el = page.locator(sel)
-                        await el.wait_for(timeout=2000)
-                        try:
-                            await el.scroll_into_view_if_needed(timeout=1000)
-                        except Exception:
-                            pass
-                        await el.click()
-                        break
-                    except Exception:
-                        continue
+        return await self._first_match(step, frames, candidates, wait_timeout, _click)
 
-            async def _click_first(frames, builders_or_factory, wait_timeout=60000):
-                for fr in frames:
-                    try:
-                        if callable(builders_or_factory):
-                            locators = builders_or_factory(fr)
-                        else:
-                            tmp = builders_or_factory
-                            locators = []
-                            for b in tmp:
-                                try:
-                                    locators.append(b(fr) if callable(b) else b)
-                                except Exception:
-                                    continue
-                    except Exception:
-                        continue
+    async def _all_frames(self, page):
+        # return main frame first, then children
+        frs = [page.main_frame]
+        try:
+            for f in page.frames:
+                if f not in frs:
+                    frs.append(f)
+        except Exception:
+            pass
+        return frs
 
-                    for loc in locators:
-                        try:
-                            await loc.wait_for(timeout=wait_timeout)
-                            try:
-                                await loc.scroll_into_view_if_needed(timeout=2000)
-                            except Exception:
-                                pass
-                            await loc.click()
-                            return True
-                        except Exception:
-                            continue
-                return False
-
-            async def _all_frames():
-                # return main frame first, then children
-                frs = [page.main_frame]
-                try:
-                    for f in page.frames:
-                        if f not in frs:
-                            frs.append(f)
-                except Exception:
-                    pass
-                return frs
+    async def _click_tiers(self, frames, tiers: list) -> str | None:
+        """Ярусы [(step, candidates, wait_timeout)] пробуются по очереди: внутри яруса кандидаты ждутся
+        одновременно, а следующий (более общий) ярус стартует только после таймаута предыдущего —
+        иначе широкий fallback мог бы сработать раньше, чем отрисуется точный элемент.
+        """
+        for step, candidates, wait_timeout in tiers:
+            won = await self._click_first(step, frames, candidates, wait_timeout=wait_timeout)
+            if won:
+                return won
+        return None
 
-            async def _fill_first(frames, builders_or_factory, value, wait_timeout=60000, type_delay=20):
-                for fr in frames:
-                    # Получаем список локаторов для текущего фрейма:
-                    try:
-                        if callable(builders_or_factory):
-                            # Фабрика возвращает уже список локаторов для данного фрейма
-                            locators = builders_or_factory(fr)
-                        else:
-                            # Список builder'ов или уже готовых локаторов
-                            tmp = builders_or_factory
-                            locators = []
-                            for b in tmp:
-                                try:
-                                    locators.append(b(fr) if callable(b) else b)
-                                except Exception:
-                                    continue
-                    except Exception:
-                        continue
+    async def _fill_tiers(self, frames, tiers: list, value: str, type_delay=20) -> str | None:
+        """Как _click_tiers, но с вводом value в найденное поле."""
+        for step, candidates, wait_timeout in tiers:
+            won = await self._fill_first(step, frames, candidates, value, wait_timeout=wait_timeout, type_delay=type_delay)
+            if won:
+                return won
+        return None
 
-                    # Перебираем локаторы и пытаемся заполнить
-                    for loc in locators:
-                        try:
-                            await loc.wait_for(timeout=wait_timeout)
-                            try:
-                                await loc.scroll_into_view_if_needed(timeout=2000)
-                            except Exception:
-                                pass
-                            await loc.click()
-                            try:
-                                await loc.fill("")
-                            except Exception:
-                                pass
-                            await loc.type(value, delay=type_delay)
-                            return True
-                        except Exception:
-                            continue
-                return False
-
-            await _accept_cookies()
-
-            # === Username field: сначала точный placeholder, затем fallback ===
-            user_value = tg_username.lstrip("@")
-            username_filled = False
-            # 1) Прямая попытка по точному placeholder из вашей вёрстки
+    async def _fill_first(self, step: str, frames, candidates: list, value: str, wait_timeout=60000, type_delay=20) -> str | None:
+        async def _fill(loc):
             try:
-                u = page.get_by_placeholder("Enter Telegram @username")
-                await u.wait_for(timeout=15000)
-                await u.scroll_into_view_if_needed(timeout=2000)
-                await u.click()
-                try:
-                    await u.fill("")
-                except Exception:
-                    pass
-                await u.type(user_value, delay=20)
-                username_filled = True
+                await loc.scroll_into_view_if_needed(timeout=2000)
             except Exception:
-                username_filled = False
-
-            # 2) Fallback: поиск во всех фреймах по нескольким локаторам (RU/EN/attr)
-            ok_user = False
-            if not username_filled:
-                frames = await _all_frames()
-                def _user_locators(fr):
-                    return [
-                        fr.get_by_placeholder("Введите Telegram @username"),
-                        fr.get_by_placeholder("Enter Telegram @username"),
-                        fr.locator("input[placeholder*='@username']"),
-                        fr.locator("input[name='username']"),
-                        fr.locator("input[type='text']").first,
-                    ]
-                ok_user = await _fill_first(frames, _user_locators, user_value, wait_timeout=60000, type_delay=20)
-            else:
-                ok_user = True
+                pass
+            await loc.click()
+            try:
+                await loc.fill("")
+            except Exception:
+                pass
+            await loc.type(value, delay=type_delay)
 
-            # 3) Доп. fallback: попытаться в первый input
-            if not ok_user:
-                try:
-                    first_input = page.locator("input").first
-                    await first_input.wait_for(timeout=5000)
-                    await first_input.click()
-                    await first_input.type(user_value, delay=20)
-                    ok_user = True
-                except Exception:
-                    ok_user = False
+        return await self._first_match(step, frames, candidates, wait_timeout, _fill)
 
-            # 4) Если так и не нашли — снимем скрин и дамп HTML
-            if not ok_user:
-                try:
-                    await page.screenshot(path="split_debug_no_username.png")
-                    html = await page.content()
-                    with open("split_debug_no_username.html", "w", encoding="utf-8") as f:
-                        f.write(html)
-                except Exception:
-                    pass
-                raise RuntimeError("Не найдено поле ввода username (см. split_debug_no_username.png / .html)")
+    async def _fill_and_submit(self, page, tg_username: str, qty: int, *, asset_preference: str = "TON") -> str:
+        """Заполняет username, актив и количество на открытой форме и подтверждает покупку."""
+        main = [page.main_frame]
 
-            # === Currency dropdown — жёстко: сначала кликаем по кнопке USDT (TON), затем выбираем TON ===
-            # 1) Открыть дропдаун валют (строго тот <button> из макета)
-            dropdown_opened = False
-            dropdown_precise_locators = [
+        # === Username field: сначала точный placeholder, затем fallback ===
+        user_value = tg_username.lstrip("@")
+        # 1) Прямая попытка по точному placeholder из вашей вёрстки
+        ok_user = await self._fill_first("username", main, [
+            ("placeholder=Enter Telegram @username", lambda fr: fr.get_by_placeholder("Enter Telegram @username")),
+        ], user_value, wait_timeout=15000, type_delay=20)
+
+        # 2) Fallback: поиск во всех фреймах по нескольким локаторам (RU/EN/attr)
+        if not ok_user:
+            frames = await self._all_frames(page)
+            ok_user = await self._fill_first("username_frames", frames, [
+                ("placeholder=Введите Telegram @username", lambda fr: fr.get_by_placeholder("Введите Telegram @username")),
+                ("placeholder=Enter Telegram @username", lambda fr: fr.get_by_placeholder("Enter Telegram @username")),
+                _sel("input[placeholder*='@username']"),
+                _sel("input[name='username']"),
+                ("input[type='text'] >> first", lambda fr: fr.locator("input[type='text']").first),
+            ], user_value, wait_timeout=60000, type_delay=20)
+
+        # 3) Доп. fallback: попытаться в первый input
+        if not ok_user:
+            ok_user = await self._fill_first("username_first_input", main, [
+                ("input >> first", lambda fr: fr.locator("input").first),
+            ], user_value, wait_timeout=5000, type_delay=20)
+
+        # 4) Если так и не нашли — снимем скрин и дамп HTML
+        if not ok_user:
+            where = await self._capture(page, "no_username")
+            raise RuntimeError(f"Не найдено поле ввода username (см. {where})")
+
+        # === Currency dropdown — жёстко: сначала кликаем по кнопке USDT (TON), затем выбираем TON ===
+        # 1) Открыть дропдаун валют: строго тот <button> из макета, затем прежние универсальные варианты
+        dropdown_opened = await self._click_tiers(main, [
+            ("asset_dropdown", [
                 # XPath по точному дереву: кнопка, внутри div с текстом 'USDT (TON)'
-                page.locator("xpath=//button[.//div[contains(normalize-space(.), 'USDT (TON)')]]"),
+                _sel("xpath=//button[.//div[contains(normalize-space(.), 'USDT (TON)')]]"),
                 # Текстовый селектор через has() — более устойчивый к классам Tailwind
-                page.locator("button:has(div:has-text('USDT (TON)'))"),
+                _sel("button:has(div:has-text('USDT (TON)'))"),
                 # Роль + текст — запасной вариант
-                page.get_by_role("button", name=re.compile(r"USDT\s*\(TON\)", re.I)),
-            ]
-            for loc in dropdown_precise_locators:
-                try:
-                    await loc.wait_for(timeout=10000)
-                    try:
-                        await loc.scroll_into_view_if_needed(timeout=2000)
-                    except Exception:
-                        pass
-                    await loc.click()
-                    dropdown_opened = True
-                    break
-                except Exception:
-                    continue
+                ("role=button[name=/USDT\\s*\\(TON\\)/i]", lambda fr: fr.get_by_role("button", name=re.compile(r"USDT\s*\(TON\)", re.I))),
+            ], 10000),
+            # универсальные варианты — только если точных нет
+            ("asset_dropdown_generic", [
+                ("role=button[name=/(USDT|TON)/i]", lambda fr: fr.get_by_role("button", name=re.compile(r"(USDT|TON)", re.I))),
+                ("button.rounded-xl:has(div) >> first", lambda fr: fr.locator("button.rounded-xl:has(div)").first),
+            ], 8000),
+        ])
 
-            # Если не вышло — пробуем прежние универсальные варианты
-            if not dropdown_opened:
-                fallback_dropdown = [
-                    page.get_by_role("button", name=re.compile(r"(USDT|TON)", re.I)),
-                    page.locator("button.rounded-xl:has(div)").first,
-                ]
-                for loc in fallback_dropdown:
-                    try:
-                        await loc.wait_for(timeout=8000)
-                        try:
-                            await loc.scroll_into_view_if_needed(timeout=1000)
-                        except Exception:
-                            pass
-                        await loc.click()
-                        dropdown_opened = True
-                        break
-                    except Exception:
-                        continue
+        # 2) Выбрать пункт TON в меню
+        if dropdown_opened:
+            ton_clicked = await self._click_first("asset_option", main, [
+                _sel("li.flex.cursor-pointer:has-text('TON')"),
+                _sel("li:has-text('TON')"),
+                ("role=listitem[name=/TON/i]", lambda fr: fr.get_by_role("listitem", name=re.compile(r"\\bTON\\b", re.I))),
+                _sel("xpath=//li[.//text()[contains(., 'TON')]]"),
+            ], wait_timeout=10000)
+            if not ton_clicked:
+                await self._capture(page, "no_asset_TON", html=False, provisional=True)
+        # если дропдаун не открылся — возможно нужная валюта уже выбрана, продолжаем
 
-            # 2) Выбрать пункт TON в меню
-            if dropdown_opened:
-                ton_locators = [
-                    page.locator("li.flex.cursor-pointer:has-text('TON')"),
-                    page.locator("li:has-text('TON')"),
-                    page.get_by_role("listitem", name=re.compile(r"\\bTON\\b", re.I)),
-                    page.locator("xpath=//li[.//text()[contains(., 'TON')]]"),
-                ]
-                ton_clicked = False
-                for opt in ton_locators:
-                    try:
-                        await opt.wait_for(timeout=10000)
-                        try:
-                            await opt.scroll_into_view_if_needed(timeout=1000)
-                        except Exception:
-                            pass
-                        await opt.click()
-                        ton_clicked = True
-                        break
-                    except Exception:
-                        continue
-                if not ton_clicked:
-                    try:
-                        await page.screenshot(path="split_debug_no_asset_TON.png")
-                    except Exception:
-                        pass
-            # если дропдаун не открылся — возможно нужная валюта уже выбрана, продолжаем
+        # === Amount field: расширенный поиск и ввод количества ===
+        qty_str = str(qty)
+        amount_rx = re.compile(r"(amount|Quantity|кол-во|количество|Stars)", re.I)
+        ok_amount = await self._fill_tiers(main, [
+            # 1) Плейсхолдеры (RU/EN, regex) — ждём, пока отрисуется форма
+            ("amount", [
+                ("placeholder=Введите кол-во Telegram Stars", lambda fr: fr.get_by_placeholder("Введите кол-во Telegram Stars")),
+                ("placeholder=Enter number of Telegram Stars", lambda fr: fr.get_by_placeholder("Enter number of Telegram Stars")),
+                ("placeholder=/amount|Stars/i", lambda fr: fr.get_by_placeholder(amount_rx)),
+                _sel("input[placeholder*='Stars']"),
+                _sel("input[placeholder*='кол']"),
+            ], 15000),
+            # 2) По label / aria-label и имени поля
+            ("amount_label", [
+                ("label=/amount|Stars/i", lambda fr: fr.get_by_label(amount_rx)),
+                _sel("input[aria-label*='Stars']"),
+                _sel("input[aria-label*='Количество']"),
+                _sel("input[name='amount']"),
+                _sel("input[name='qty']"),
+            ], 3000),
+            # 3) Относительно текста рядом (XPath: ближайший input после текста) — может попасть в поле получателя,
+            #    поэтому только когда точные варианты не нашлись
+            ("amount_near", [
+                _sel("xpath=(//label[contains(., 'Stars')]/following::input)[1]"),
+                _sel("xpath=(//*[contains(., 'Количество')]/following::input)[1]"),
+                _sel("xpath=(//span[contains(., 'Stars')]/following::input)[1]"),
+            ], 3000),
+            # 4) Любое числовое поле
+            ("amount_type", [
+                ("input[type='number'] >> first", lambda fr: fr.locator("input[type='number']").first),
+            ], 3000),
+        ], qty_str, type_delay=10)
 
-            # === Amount field: расширенный поиск и ввод количества ===
-            async def _try_type_amount(loc, value: str, wait_timeout=15000):
-                try:
-                    await loc.wait_for(timeout=wait_timeout)
-                    try:
-                        await loc.scroll_into_view_if_needed(timeout=2000)
-                    except Exception:
-                        pass
-                    await loc.click()
-                    try:
-                        await loc.fill("")
-                    except Exception:
-                        pass
-                    await loc.type(value, delay=10)
-                    return True
-                except Exception:
-                    return False
-
-            qty_str = str(qty)
-            ok_amount = False
-
-            # 1) Плейсхолдеры (RU/EN, regex)
-            for loc in [
-                page.get_by_placeholder("Введите кол-во Telegram Stars"),
-                page.get_by_placeholder("Enter number of Telegram Stars"),
-                page.get_by_placeholder(re.compile(r"(amount|Quantity|кол-во|количество|Stars)", re.I)),
-                page.locator("input[placeholder*='Stars']"),
-                page.locator("input[placeholder*='кол']"),
-            ]:
-                if await _try_type_amount(loc, qty_str):
-                    ok_amount = True
-                    break
+        # 5) Попытка во всех фреймах через универсальные локаторы (на случай вложенных компонентов)
+        if not ok_amount:
+            frames = await self._all_frames(page)
+            ok_amount = await self._fill_tiers(frames, [
+                ("amount_frames", [
+                    ("placeholder=Введите кол-во Telegram Stars", lambda fr: fr.get_by_placeholder("Введите кол-во Telegram Stars")),
+                    ("placeholder=Enter number of Telegram Stars", lambda fr: fr.get_by_placeholder("Enter number of Telegram Stars")),
+                    ("placeholder=/amount|Stars/i", lambda fr: fr.get_by_placeholder(amount_rx)),
+                    _sel("input[name='amount']"),
+                    _sel("input[name='qty']"),
+                ], 30000),
+                ("amount_frames_type", [
+                    ("input[type='number'] >> first", lambda fr: fr.locator("input[type='number']").first),
+                ], 3000),
+            ], qty_str, type_delay=10)
 
-            # 2) По label / aria-label
-            if not ok_amount:
-                for loc in [
-                    page.get_by_label(re.compile(r"(amount|Quantity|кол-во|количество|Stars)", re.I)),
-                    page.locator("input[aria-label*='Stars']"),
-                    page.locator("input[aria-label*='Количество']"),
-                ]:
-                    if await _try_type_amount(loc, qty_str):
-                        ok_amount = True
-                        break
-
-            # 3) Относительно текста рядом (XPath: ближайший input после текста)
-            if not ok_amount:
-                near_xpaths = [
-                    "xpath=(//label[contains(., 'Stars')]/following::input)[1]",
-                    "xpath=(//span[contains(., 'Stars')]/following::input)[1]",
-                    "xpath=(//*[contains(., 'Количество')]/following::input)[1]",
+        # 6) Если всё ещё не нашли — снимем подробные дампы, чтобы быстро подобрать нужный селектор
+        if not ok_amount:
+            where = await self._capture(page, "no_amount")
+            # Дополнительно соберём список всех видимых input и их атрибутов (одним вызовом)
+            try:
+                lines = [
+                    f"#{i}: type={inp['type']} name={inp['name']} placeholder={inp['placeholder']} aria-label={inp['aria']}"
+                    for i, inp in enumerate(await describe_inputs(page))
                 ]
-                for xp in near_xpaths:
-                    if await _try_type_amount(page.locator(xp), qty_str):
-                        ok_amount = True
-                        break
-
-            # 4) Имя/тип
-            if not ok_amount:
-                for loc in [
-                    page.locator("input[name='amount']"),
-                    page.locator("input[name='qty']"),
-                    page.locator("input[type='number']").first,
-                ]:
-                    if await _try_type_amount(loc, qty_str):
-                        ok_amount = True
-                        break
-
-            # 5) Попытка во всех фреймах через универсальные локаторы (на случай вложенных компонентов)
-            if not ok_amount:
-                frames = await _all_frames()
-                def _amount_locators(fr):
-                    return [
-                        fr.get_by_placeholder("Введите кол-во Telegram Stars"),
-                        fr.get_by_placeholder("Enter number of Telegram Stars"),
-                        fr.get_by_placeholder(re.compile(r"(amount|Quantity|кол-во|количество|Stars)", re.I)),
-                        fr.locator("input[name='amount']"),
-                        fr.locator("input[name='qty']"),
-                        fr.locator("input[type='number']").first,
-                    ]
-                ok_amount = await _fill_first(frames, _amount_locators, qty_str, wait_timeout=30000, type_delay=10)
-
-            # 6) Если всё ещё не нашли — снимем подробные дампы, чтобы быстро подобрать нужный селектор
-            if not ok_amount:
-                try:
-                    await page.screenshot(path="split_debug_no_amount.png")
-                    html = await page.content()
-                    with open("split_debug_no_amount.html", "w", encoding="utf-8") as f:
-                        f.write(html)
-                    # Дополнительно соберём список всех видимых input и их атрибутов
-                    try:
-                        inputs = page.locator("input:visible")
-                        cnt = await inputs.count()
-                        lines = []
-                        for i in range(cnt):
-                            el = inputs.nth(i)
-                            try:
-                                ph = await el.get_attribute("placeholder")
-                            except Exception:
-                                ph = None
-                            try:
-                                nm = await el.get_attribute("name")
-                            except Exception:
-                                nm = None
-                            try:
-                                typ = await el.get_attribute("type")
-                            except Exception:
-                                typ = None
-                            try:
-                                aria = await el.get_attribute("aria-label")
-                            except Exception:
-                                aria = None
-                            lines.append(f"#{i}: type={typ} name={nm} placeholder={ph} aria-label={aria}")
-                        with open("split_inputs_dump.txt", "w", encoding="utf-8") as f:
-                            f.write("\n".join(lines))
-                    except Exception:
-                        pass
-                except Exception:
-                    pass
-                raise RuntimeError("Не найдено поле количества (см. split_debug_no_amount.png / .html / split_inputs_dump.txt)")
-
-            # 5) Подтвердить заказ. Пробуем несколько вариантов кнопки (RU/EN)
-            buy_selectors = [
-                "button:has-text('Купить Telegram Stars')",
-                "button:has-text('Buy Telegram Stars')",
-                "button:has-text('Оплатить')",
-                "button:has-text('Buy')",
-                "button[type='submit']",
-            ]
+                await self._save_artifact(page, "inputs_dump.txt", "\n".join(lines))
+            except Exception:
+                pass
+            raise RuntimeError(f"Не найдено поле количества (см. {where})")
 
-            await _accept_cookies()
+        # 5) Подтвердить заказ. Пробуем несколько вариантов кнопки (RU/EN)
+        await self._accept_cookies(page)
 
-            clicked = False
-            for sel in buy_selectors:
-                try:
-                    el = page.locator(sel)
-                    await el.wait_for(timeout=60000)
-                    try:
-                        await el.scroll_into_view_if_needed(timeout=2000)
-                    except Exception:
-                        pass
-                    await el.click()
-                    clicked = True
-                    break
-                except Exception:
-                    continue
-            if not clicked:
-                # Попробуем отправить форму по Enter
-                try:
-                    await page.keyboard.press("Enter")
-                    clicked = True
-                except Exception:
-                    pass
-            if not clicked:
-                try:
-                    await page.screenshot(path="split_debug_no_buy.png")
-                except Exception:
-                    pass
-                raise RuntimeError("Кнопка покупки не найдена. Снял скриншот split_debug_no_buy.png")
-
-            # 6) Пытаемся понять, что произошло: либо появился номер заказа, либо отдали ссылку на оплату (CryptoBot)
-            order_id = None
-            invoice_url = None
+        clicked = bool(await self._click_tiers(main, [
+            ("buy_button", [
+                _sel("button:has-text('Купить Telegram Stars')"),
+                _sel("button:has-text('Buy Telegram Stars')"),
+                _sel("button:has-text('Оплатить')"),
+            ], 60000),
+            # общие варианты могут попасть не в ту кнопку — только после таймаута точных
+            ("buy_button_generic", [
+                _sel("button:has-text('Buy')"),
+                _sel("button[type='submit']"),
+            ], 5000),
+        ]))
+        if not clicked:
+            # Попробуем отправить форму по Enter
             try:
-                # Вариант 1: появился блок с номером заказа
-                await page.wait_for_selector(".order-id, text=Order ID, text=Номер заказа", timeout=30000)
-                # Считываем любой из возможных элементов
-                for sel in [".order-id", "text=Order ID", "text=Номер заказа"]:
-                    try:
-                        txt = await page.text_content(sel)
-                        if txt:
-                            order_id = txt.strip()
-                            break
-                    except Exception:
-                        pass
+                await page.keyboard.press("Enter")
+                clicked = True
             except Exception:
-                # Вариант 2: страница показала ссылку на оплату через CryptoBot — найдём t.me/CryptoBot
-                links = await page.locator("a").all()
-                for i in range(len(links)):
-                    try:
-                        href = await links[i].get_attribute("href")
-                    except Exception:
-                        href = None
-                    if href and ("t.me/CryptoBot" in href or "t.me/CryptoBot/app" in href or "startapp=invoice-" in href):
-                        invoice_url = href
-                        break
+                pass
+        if not clicked:
+            where = await self._capture(page, "no_buy", html=False)
+            raise RuntimeError(f"Кнопка покупки не найдена. Снял скриншот: {where}")
 
+        # 6) Пытаемся понять, что произошло: либо появился номер заказа, либо отдали ссылку на оплату (CryptoBot)
+        order_id = None
+        invoice_url = None
+        # Вариант 1: появился блок с номером заказа; вариант 2: страница показала ссылку на оплату через CryptoBot
+        await self._timed(page, "result_wait", page.wait_for_selector(".order-id, text=Order ID, text=Номер заказа", timeout=30000))
+        # номер заказа и все ссылки — одним вызовом в браузере, без round-trip на каждый <a>
+        try:
+            result = await extract_result(page)
+        except Exception:
+            result = {"order_id": None, "invoice_url": None}
+        order_id = result["order_id"]
+        invoice_url = None if order_id else result["invoice_url"]
+
+        if not order_id or self.artifacts is None:
+            # страница без номера заказа — то, что потом приходится разбирать руками
             try:
-                html = await page.content()
-                with open("split_step_2_result.html", "w", encoding="utf-8") as f:
-                    f.write(html)
+                await self._save_artifact(page, "step_2_result.html", await page.content())
             except Exception:
                 pass
 
-            await context.close()
-            await browser.close()
-
         # Возвращаем order_id если он есть, иначе специальный маркер с ссылкой оплаты
         if order_id:
             return order_id
-        return f"PAYMENT_LINK::{invoice_url}"
\ No newline at end of file
+        return f"PAYMENT_LINK::{invoice_url}"
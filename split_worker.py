@@ -0,0 +1,210 @@
+"""Покупки через SplitClient в отдельном процессе.
+
+Бот не импортирует Playwright: SplitWorker запускает `python split_worker.py` и общается с ним
+строками JSON через stdin/stdout:
+
+    → {"id": 1, "method": "buy_stars", "params": {"tg_username": "@user", "qty": 100}}
+    ← {"id": 1, "result": {"order": "ORD-1", "spans": [...], "steps": {...}}}
+    ← {"id": 1, "error": "RuntimeError: ..."}
+
+Падение, зависание или распухание Chromium убивает только дочерний процесс: незавершённые вызовы
+получают OutcomeUnknown (покупка могла уже пройти — заявка уходит админам с сохранённым резервом),
+следующий вызов поднимает процесс заново.
+После max_jobs покупок процесс перезапускается, чтобы не копить память браузера.
+"""
+import asyncio
+import itertools
+import json
+import os
+import sys
+
+
+class OutcomeUnknown(RuntimeError):
+    """Дочерний процесс умер или убит по таймауту, пока вызов был в работе: покупка могла уже пройти."""
+
+
+class SplitWorker:
+    """Клиент дочернего процесса с SplitClient; интерфейс покупки как у SplitClient.buy_stars."""
+
+    def __init__(self, *, max_jobs: int = 50, timeout: float = 600.0, python: str | None = None):
+        self.max_jobs = max(1, int(max_jobs))
+        self.timeout = float(timeout)
+        self.python = python or sys.executable
+        self._proc: asyncio.subprocess.Process | None = None
+        self._reader: asyncio.Task | None = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+        self._jobs = 0
+        self.restarts = 0
+        # p50/p95 по шагам из последнего ответа дочернего процесса (SplitClient.step_metrics.summary())
+        self.step_summary: dict = {}
+        self.last_trace: list[dict] = []
+
+    # ======== Процесс ========
+
+    async def _ensure(self) -> asyncio.subprocess.Process:
+        async with self._lock:
+            if self._proc is not None and self._proc.returncode is None:
+                # отработал свою норму и сейчас простаивает — перезапускаем
+                if self._jobs >= self.max_jobs and not self._pending:
+                    await self._stop_proc()
+                    self.restarts += 1
+                else:
+                    return self._proc
+            elif self._proc is not None:
+                # упал или был убит по таймауту
+                self.restarts += 1
+            self._proc = await asyncio.create_subprocess_exec(
+                self.python, os.path.abspath(__file__),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                cwd=os.getcwd(),
+                limit=16 * 1024 * 1024,
+            )
+            self._jobs = 0
+            self._reader = asyncio.create_task(self._read_loop(self._proc))
+            return self._proc
+
+    async def _read_loop(self, proc) -> None:
+        try:
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except Exception:
+                    continue
+                fut = self._pending.pop(msg.get("id"), None)
+                if fut is None or fut.done():
+                    continue
+                if "error" in msg:
+                    fut.set_exception(RuntimeError(msg["error"]))
+                else:
+                    fut.set_result(msg.get("result"))
+        finally:
+            # процесс умер — всем, кто ждёт, отвечаем: итог неизвестен
+            if self._proc is proc:
+                self._fail_pending("процесс split_worker завершился посреди вызова")
+
+    def _fail_pending(self, reason: str) -> None:
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(OutcomeUnknown(reason))
+        self._pending.clear()
+
+    async def _stop_proc(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        if proc.returncode is None:
+            try:
+                proc.stdin.close()
+                await asyncio.wait_for(proc.wait(), timeout=30)
+            except Exception:
+                proc.kill()
+                await proc.wait()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._stop_proc()
+
+    # ======== RPC ========
+
+    async def call(self, method: str, **params):
+        proc = await self._ensure()
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        self._jobs += 1
+        try:
+            proc.stdin.write(json.dumps({"id": req_id, "method": method, "params": params}).encode() + b"\n")
+            await proc.stdin.drain()
+            return await asyncio.wait_for(fut, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # зависший браузер не лечится — убиваем процесс, следующий вызов поднимет новый.
+            # Вместе с ним гибнут и остальные покупки этого процесса: их итог тоже неизвестен
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            if self._proc is proc:
+                self._proc = None
+                self.restarts += 1
+                self._fail_pending(f"split_worker убит: вызов {req_id} не завершился за {self.timeout:.0f} с")
+            raise OutcomeUnknown(f"split_worker не ответил за {self.timeout:.0f} с")
+        finally:
+            self._pending.pop(req_id, None)
+
+    async def buy_stars(self, tg_username: str, qty: int, *, asset_preference: str = "TON") -> str:
+        res = await self.call("buy_stars", tg_username=tg_username, qty=qty, asset_preference=asset_preference)
+        self.last_trace = res.get("spans") or []
+        self.step_summary = res.get("steps") or {}
+        return res["order"]
+
+
+# ======== Дочерний процесс ========
+
+async def _serve() -> None:
+    # stdout — канал протокола; всё, что печатают библиотеки, уводим в stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+
+    import settings
+    from split_client import SplitClient
+
+    client = SplitClient.from_settings(settings)
+    if client.pool_size:
+        await client.start()
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    def reply(msg: dict) -> None:
+        out.write(json.dumps(msg, ensure_ascii=False) + "\n")
+        out.flush()
+
+    async def handle(msg: dict) -> None:
+        req_id = msg.get("id")
+        try:
+            if msg.get("method") == "buy_stars":
+                params = msg.get("params") or {}
+                order, spans = await client.buy_stars(
+                    params["tg_username"], int(params["qty"]),
+                    asset_preference=params.get("asset_preference", "TON"), with_timings=True,
+                )
+                reply({"id": req_id, "result": {"order": order, "spans": spans, "steps": client.step_metrics.summary()}})
+            elif msg.get("method") == "stats":
+                reply({"id": req_id, "result": {"steps": client.step_metrics.summary(), "routes": client.route_totals.as_dict()}})
+            else:
+                reply({"id": req_id, "error": f"неизвестный метод {msg.get('method')!r}"})
+        except Exception as e:
+            reply({"id": req_id, "error": f"{type(e).__name__}: {e}"})
+
+    tasks: set[asyncio.Task] = set()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                msg = json.loads(line)
+            except Exception:
+                continue
+            t = asyncio.create_task(handle(msg))
+            tasks.add(t)
+            t.add_done_callback(tasks.discard)
+        # stdin закрыт — доделываем начатые покупки и выходим
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_serve())
@@ -0,0 +1,158 @@
+from datetime import date, datetime, timedelta
+import time
+
+# Сколько дней храним почасовые корзины (дневные храним всегда — это ~365 записей в год)
+HOURLY_DAYS = 14
+
+
+def _empty_bucket() -> dict:
+    return {
+        "deposits": {},        # метод -> [кол-во, копейки]
+        "stars": 0,
+        "revenue": 0,          # копейки
+        "profit": 0,           # копейки
+        "approved": 0,
+        "rejected": 0,
+        "expired": 0,          # заявки, закрытые по сроку (не отклонённые админом)
+    }
+
+
+def _add_bucket(dst: dict, src: dict) -> None:
+    for method, (cnt, kop) in src["deposits"].items():
+        cur = dst["deposits"].setdefault(method, [0, 0])
+        cur[0] += cnt
+        cur[1] += kop
+    for k in ("stars", "revenue", "profit", "approved", "rejected", "expired"):
+        dst[k] += src[k]
+
+
+class StatsAggregator:
+    """Статистика бота, которая считается по мере событий, а не пересчётом словарей пользователей.
+
+    totals — итоги за всё время; days["YYYY-MM-DD"] и hours["YYYY-MM-DD HH"] — корзины с теми же полями.
+    Ответ за всё время — O(1), за период — O(число дней в периоде), от числа пользователей не зависит.
+    """
+
+    def __init__(self):
+        self.totals = _empty_bucket()
+        self.days: dict[str, dict] = {}
+        self.hours: dict[str, dict] = {}
+
+    # ======== События ========
+
+    def _buckets(self, ts: float | None):
+        t = time.localtime(ts if ts is not None else time.time())
+        day = time.strftime("%Y-%m-%d", t)
+        hour = time.strftime("%Y-%m-%d %H", t)
+        d = self.days.get(day)
+        if d is None:
+            d = self.days[day] = _empty_bucket()
+        h = self.hours.get(hour)
+        if h is None:
+            h = self.hours[hour] = _empty_bucket()
+            self._trim_hours(day)
+        return (self.totals, d, h)
+
+    def _trim_hours(self, today: str) -> None:
+        cutoff = (date.fromisoformat(today) - timedelta(days=HOURLY_DAYS)).isoformat()
+        for key in [k for k in self.hours if k < cutoff]:
+            del self.hours[key]
+
+    def record_deposit(self, method: str, kopecks: int, *, ts: float | None = None) -> None:
+        """Зачисленное пополнение: method — SBP / TON / USDT."""
+        method = (method or "OTHER").upper()
+        for b in self._buckets(ts):
+            cur = b["deposits"].setdefault(method, [0, 0])
+            cur[0] += 1
+            cur[1] += int(kopecks)
+
+    def record_order(self, qty: int, revenue_kopecks: int, profit_kopecks: int, *, ts: float | None = None) -> None:
+        """Подтверждённая (вручную или автоматически) покупка звёзд."""
+        for b in self._buckets(ts):
+            b["stars"] += int(qty)
+            b["revenue"] += int(revenue_kopecks)
+            b["profit"] += int(profit_kopecks)
+            b["approved"] += 1
+
+    def record_rejected(self, *, ts: float | None = None) -> None:
+        for b in self._buckets(ts):
+            b["rejected"] += 1
+
+    def record_expired(self, *, ts: float | None = None) -> None:
+        """Заявка закрыта по сроку (EXPIRE_ORDER_SEC), а не решением админа."""
+        for b in self._buckets(ts):
+            b["expired"] += 1
+
+    # ======== Запросы ========
+
+    def summary(self, start: date | None = None, end: date | None = None) -> dict:
+        """Итоги за всё время (без дат) или за дни [start, end] включительно."""
+        if start is None and end is None:
+            return self.totals
+        start = start or end
+        end = end or start
+        out = _empty_bucket()
+        if (end - start).days >= len(self.days):
+            # период длиннее истории — быстрее пройти по самим корзинам
+            lo, hi = start.isoformat(), end.isoformat()
+            for key, b in self.days.items():
+                if lo <= key <= hi:
+                    _add_bucket(out, b)
+            return out
+        day = start
+        while day <= end:
+            b = self.days.get(day.isoformat())
+            if b is not None:
+                _add_bucket(out, b)
+            day += timedelta(days=1)
+        return out
+
+    def hourly(self, day: date) -> list[tuple[int, dict]]:
+        """[(час, корзина)] за день — только по часам, где что-то было (хранятся HOURLY_DAYS дней)."""
+        prefix = day.isoformat()
+        return [(int(k[-2:]), self.hours[k]) for k in sorted(self.hours) if k.startswith(prefix)]
+
+    # ======== Хранение ========
+
+    def to_dict(self) -> dict:
+        return {"totals": self.totals, "days": self.days, "hours": self.hours}
+
+    def load(self, data: dict) -> None:
+        if not isinstance(data, dict):
+            return
+        if isinstance(data.get("totals"), dict):
+            self.totals = self._clean(data["totals"])
+        for attr in ("days", "hours"):
+            src = data.get(attr)
+            if isinstance(src, dict):
+                setattr(self, attr, {str(k): self._clean(v) for k, v in src.items() if isinstance(v, dict)})
+
+    @staticmethod
+    def _clean(raw: dict) -> dict:
+        b = _empty_bucket()
+        for method, pair in (raw.get("deposits") or {}).items():
+            try:
+                b["deposits"][str(method)] = [int(pair[0]), int(pair[1])]
+            except Exception:
+                pass
+        for k in ("stars", "revenue", "profit", "approved", "rejected", "expired"):
+            try:
+                b[k] = int(raw.get(k, 0))
+            except Exception:
+                pass
+        return b
+
+
+def parse_range(args: list[str]) -> tuple[date | None, date | None]:
+    """Аргументы /stats: пусто — всё время; today / 7d / 2025-09-01 / 2025-09-01 2025-09-30."""
+    if not args:
+        return None, None
+    today = datetime.now().date()
+    first = args[0].lower()
+    if first in ("today", "сегодня"):
+        return today, today
+    if first.endswith("d") and first[:-1].isdigit():
+        return today - timedelta(days=int(first[:-1]) - 1), today
+    start = date.fromisoformat(args[0])
+    end = date.fromisoformat(args[1]) if len(args) > 1 else start
+    return (start, end) if start <= end else (end, start)
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+import time
+
+
+class TokenBuckets:
+    """Набор token bucket'ов по произвольному ключу (например, (user_id, действие)).
+
+    Ведро вмещает burst токенов и пополняется со скоростью rate в секунду; действие разрешено,
+    если в ведре есть целый токен. Пополнение считается лениво при обращении — O(1) на проверку,
+    без таймеров. Ключи хранятся в OrderedDict в порядке последнего обращения: вёдра, к которым
+    не обращались дольше, чем нужно для полного пополнения, удаляются с начала — тоже O(1)
+    на проверку в среднем. Удалённое ведро равносильно полному, так что лимит от этого не меняется.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max(1, int(max_keys))
+        # ключ -> [токены, время последнего обращения, время полного пополнения]
+        self._buckets: OrderedDict = OrderedDict()
+        self.allowed = 0
+        self.throttled = 0
+
+    def take(self, key, rate: float, burst: float, *, now: float | None = None) -> float:
+        """Пытается взять токен. 0 — разрешено, иначе — через сколько секунд появится токен."""
+        now = time.monotonic() if now is None else now
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = [float(burst), now, burst / rate if rate > 0 else 0.0]
+        else:
+            b[0] = min(float(burst), b[0] + (now - b[1]) * rate)
+            b[1] = now
+            self._buckets.move_to_end(key)
+        self._evict(now)
+        if b[0] >= 1.0:
+            b[0] -= 1.0
+            self.allowed += 1
+            return 0.0
+        self.throttled += 1
+        return (1.0 - b[0]) / rate if rate > 0 else float("inf")
+
+    def _evict(self, now: float) -> None:
+        # с начала — самые давние; проверяем не больше двух, чтобы стоимость проверки оставалась O(1)
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, b = next(iter(self._buckets.items()))
+            if now - b[1] >= b[2] or len(self._buckets) > self.max_keys:
+                del self._buckets[key]
+            else:
+                return
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "throttled": self.throttled, "buckets": len(self._buckets)}